@@ -335,6 +335,18 @@ SPACY_MODELS.set('fr', {
       LogHelper.info('Not all spaCy models are installed')
       await installSpacyModels()
     }
+
+    try {
+      LogHelper.info('Compiling the gazetteer...')
+      await command('pipenv run python tcp_server/src/build_gazetteer.py', {
+        shell: true,
+        stdio: 'inherit'
+      })
+      LogHelper.success('Gazetteer compiled')
+    } catch (e) {
+      // Not fatal, the TCP server compiles it on startup when it is missing
+      LogHelper.warning(`Failed to compile the gazetteer: ${e}`)
+    }
   }
 
   LogHelper.success(`${setupTarget} development environment ready`)
@@ -219,6 +219,8 @@ export const PYTHON_TCP_SERVER_HOST = process.env['LEON_PY_TCP_SERVER_HOST']
 export const PYTHON_TCP_SERVER_PORT = Number(
   process.env['LEON_PY_TCP_SERVER_PORT']
 )
+export const PYTHON_TCP_SERVER_UNIX_SOCKET_PATH =
+  process.env['LEON_PY_TCP_SERVER_UNIX_SOCKET_PATH'] || null
 
 export const IS_TELEMETRY_ENABLED = process.env['LEON_TELEMETRY'] === 'true'
 
@@ -271,24 +271,21 @@ export default class NER {
   /**
    * Get spaCy entities from the TCP server
    */
-  private getSpacyEntities(utterance: NLPUtterance): Promise<NERSpacyEntity[]> {
-    return new Promise((resolve) => {
-      const spacyEntitiesReceivedHandler = async ({
-        spacyEntities
-      }: {
+  private async getSpacyEntities(
+    utterance: NLPUtterance
+  ): Promise<NERSpacyEntity[]> {
+    try {
+      const { spacyEntities } = await PYTHON_TCP_CLIENT.request<{
         spacyEntities: NERSpacyEntity[]
-      }): Promise<void> => {
-        resolve(spacyEntities)
-      }
+      }>('get-spacy-entities', { utterance, lang: BRAIN.lang })
 
-      PYTHON_TCP_CLIENT.ee.removeAllListeners()
-      PYTHON_TCP_CLIENT.ee.on(
-        'spacy-entities-received',
-        spacyEntitiesReceivedHandler
-      )
+      return spacyEntities
+    } catch (e) {
+      LogHelper.title('NER')
+      LogHelper.error(`Failed to get spaCy entities: ${e}`)
 
-      PYTHON_TCP_CLIENT.emit('get-spacy-entities', utterance)
-    })
+      return []
+    }
   }
 
   /**
@@ -1,7 +1,11 @@
 import Net from 'node:net'
 import { EventEmitter } from 'node:events'
 
-import { IS_PRODUCTION_ENV, STT_PROVIDER } from '@/constants'
+import {
+  IS_PRODUCTION_ENV,
+  PYTHON_TCP_SERVER_UNIX_SOCKET_PATH,
+  STT_PROVIDER
+} from '@/constants'
 import { STT } from '@/core'
 import { OSTypes } from '@/types'
 import { LogHelper } from '@/helpers/log-helper'
@@ -13,16 +17,52 @@ const INTERVAL = IS_PRODUCTION_ENV ? 3000 : 500
 // Number of retries to connect to the TCP server
 const RETRIES_NB = IS_PRODUCTION_ENV ? 8 : 30
 
+/**
+ * Every message is framed with a header followed by the payload:
+ * payload length (uint32), request id (uint32), message type (uint8).
+ * All header fields are big-endian.
+ * Keep in sync with tcp_server/src/lib/protocol.py
+ */
+const FRAME_HEADER_SIZE = 9
+const MESSAGE_TYPE_JSON = 1
+const MESSAGE_TYPE_BINARY = 2
+// Used by the server for messages that do not answer a request (e.g. ASR events)
+const UNSOLICITED_REQUEST_ID = 0
+const MAX_REQUEST_ID = 0xffffffff
+// Topic replied by the server when a handler fails
+const ERROR_TOPIC = 'tcp-server-error'
+/**
+ * Progress messages sent with the request ID before the final reply,
+ * they must not settle the request.
+ * Keep in sync with tcp_server/src/lib/protocol.py
+ */
+const INTERMEDIATE_TOPICS = new Set([
+  'tts-job-queued',
+  'tts-stream-started',
+  'tts-audio-chunk-written'
+])
+
 export interface ChunkData {
   topic: string
   data: Record<string, unknown>
 }
+interface PendingRequest {
+  resolve: (data: Record<string, unknown>) => void
+  reject: (error: Error) => void
+}
+export interface BinaryChunkData {
+  requestId: number
+  payload: Buffer
+}
 type TCPClientName = 'Python'
 
 export default class TCPClient {
   private reconnectCounter = 0
   private tcpSocket = new Net.Socket()
   private _isConnected = false
+  private buffer = Buffer.alloc(0)
+  private lastRequestId = UNSOLICITED_REQUEST_ID
+  private pendingRequests = new Map<number, PendingRequest>()
 
   public readonly ee = new EventEmitter()
 
@@ -49,7 +89,11 @@ export default class TCPClient {
     this.tcpSocket.on('connect', () => {
       LogHelper.title(`${this.name} TCP Client`)
       LogHelper.success(
-        `Connected to the ${this.name} TCP server at tcp://${this.host}:${this.port}`
+        `Connected to the ${this.name} TCP server at ${
+          PYTHON_TCP_SERVER_UNIX_SOCKET_PATH
+            ? `unix://${PYTHON_TCP_SERVER_UNIX_SOCKET_PATH}`
+            : `tcp://${this.host}:${this.port}`
+        }`
       )
 
       this.reconnectCounter = 0
@@ -57,39 +101,35 @@ export default class TCPClient {
       this.ee.emit('connected', null)
     })
 
-    this.tcpSocket.on('data', (chunk: ChunkData) => {
-      LogHelper.title(`${this.name} TCP Client`)
-      LogHelper.info(`Received data: ${String(chunk)}`)
-
-      const strChunk = String(chunk)
+    this.tcpSocket.on('data', (chunk: Buffer) => {
+      this.buffer = Buffer.concat([this.buffer, chunk])
 
       /**
-       * If the topic is related to ASR, then parse the data manually
-       * in the local STT parser
+       * A chunk can contain a partial frame or several frames,
+       * so only consume the frames that are complete
        */
-      if (strChunk.includes('"topic": "asr-')) {
-        if (STT_PROVIDER === STTProviders.Local) {
-          // eslint-disable-next-line @typescript-eslint/ban-ts-comment
-          // @ts-expect-error
-          STT.parser?.parse(strChunk)
-        }
-      } else {
-        try {
-          const data = JSON.parse(strChunk)
-
-          this.ee.emit(data.topic, data.data)
-        } catch (e) {
-          LogHelper.title(`${this.name} TCP Client`)
-          LogHelper.error(`Failed to parse the data: ${e}`)
-          LogHelper.error(`Received data: ${String(chunk)}`)
+      while (this.buffer.length >= FRAME_HEADER_SIZE) {
+        const payloadSize = this.buffer.readUInt32BE(0)
+        const frameSize = FRAME_HEADER_SIZE + payloadSize
+
+        if (this.buffer.length < frameSize) {
+          break
         }
+
+        const requestId = this.buffer.readUInt32BE(4)
+        const messageType = this.buffer.readUInt8(8)
+        const payload = this.buffer.subarray(FRAME_HEADER_SIZE, frameSize)
+
+        this.buffer = this.buffer.subarray(frameSize)
+        this.handleFrame(requestId, messageType, payload)
       }
     })
 
     this.tcpSocket.on('error', (err: NodeJS.ErrnoException) => {
       LogHelper.title(`${this.name} TCP Client`)
 
-      if (err.code === 'ECONNREFUSED') {
+      // ENOENT when the Unix socket file is not created yet
+      if (err.code === 'ECONNREFUSED' || err.code === 'ENOENT') {
         this.reconnectCounter += 1
 
         const { type: osType } = SystemHelper.getInformation()
@@ -121,6 +161,8 @@ export default class TCPClient {
       }
 
       this._isConnected = false
+      this.buffer = Buffer.alloc(0)
+      this.rejectPendingRequests(`${this.name} TCP client error: ${err}`)
     })
 
     this.tcpSocket.on('end', () => {
@@ -128,6 +170,10 @@ export default class TCPClient {
       LogHelper.success(`Disconnected from the ${this.name} TCP server`)
 
       this._isConnected = false
+      this.buffer = Buffer.alloc(0)
+      this.rejectPendingRequests(
+        `Disconnected from the ${this.name} TCP server`
+      )
     })
   }
 
@@ -137,19 +183,137 @@ export default class TCPClient {
     }, INTERVAL)
   }
 
-  public emit(topic: string, data: unknown): void {
+  /**
+   * Send a message to the TCP server
+   * @returns The request ID the server will use to reply
+   */
+  public emit(topic: string, data: unknown): number {
     const obj = {
       topic,
       data
     }
+    const payload = Buffer.from(JSON.stringify(obj), 'utf8')
+    const header = Buffer.alloc(FRAME_HEADER_SIZE)
 
-    this.tcpSocket.write(JSON.stringify(obj))
+    this.lastRequestId =
+      this.lastRequestId >= MAX_REQUEST_ID ? 1 : this.lastRequestId + 1
+
+    header.writeUInt32BE(payload.length, 0)
+    header.writeUInt32BE(this.lastRequestId, 4)
+    header.writeUInt8(MESSAGE_TYPE_JSON, 8)
+
+    this.tcpSocket.write(Buffer.concat([header, payload]))
+
+    return this.lastRequestId
   }
 
-  private connectSocket(): void {
-    this.tcpSocket.connect({
-      host: this.host,
-      port: this.port
+  /**
+   * Send a message to the TCP server and wait for its final reply,
+   * the progress messages (e.g. "tts-job-queued") are only emitted as events.
+   * Several requests can be in flight at the same time
+   * @example request('get-spacy-entities', 'Hello') // { spacyEntities: [] }
+   */
+  public request<T = Record<string, unknown>>(
+    topic: string,
+    data: unknown
+  ): Promise<T> {
+    return new Promise((resolve, reject) => {
+      const requestId = this.emit(topic, data)
+
+      this.pendingRequests.set(requestId, {
+        resolve: (replyData): void => resolve(replyData as T),
+        reject
+      })
     })
   }
+
+  /**
+   * The replies of the in-flight requests will never come,
+   * so settle them instead of leaving their callers waiting
+   */
+  private rejectPendingRequests(reason: string): void {
+    const pendingRequests = [...this.pendingRequests.values()]
+
+    this.pendingRequests.clear()
+
+    for (const pendingRequest of pendingRequests) {
+      pendingRequest.reject(new Error(reason))
+    }
+  }
+
+  private handleFrame(
+    requestId: number,
+    messageType: number,
+    payload: Buffer
+  ): void {
+    if (messageType === MESSAGE_TYPE_BINARY) {
+      const binaryChunkData: BinaryChunkData = { requestId, payload }
+
+      this.ee.emit('binary', binaryChunkData)
+      return
+    }
+
+    if (messageType !== MESSAGE_TYPE_JSON) {
+      LogHelper.title(`${this.name} TCP Client`)
+      LogHelper.error(`Unknown message type: ${messageType}`)
+      return
+    }
+
+    const strChunk = payload.toString('utf8')
+
+    LogHelper.title(`${this.name} TCP Client`)
+    LogHelper.info(`Received data: ${strChunk}`)
+
+    /**
+     * If the topic is related to ASR, then parse the data manually
+     * in the local STT parser
+     */
+    if (strChunk.includes('"topic": "asr-')) {
+      if (STT_PROVIDER === STTProviders.Local) {
+        // eslint-disable-next-line @typescript-eslint/ban-ts-comment
+        // @ts-expect-error
+        STT.parser?.parse(strChunk)
+      }
+    } else {
+      try {
+        const data: ChunkData = JSON.parse(strChunk)
+        const pendingRequest = this.pendingRequests.get(requestId)
+
+        if (pendingRequest && !INTERMEDIATE_TOPICS.has(data.topic)) {
+          this.pendingRequests.delete(requestId)
+
+          if (data.topic === ERROR_TOPIC) {
+            pendingRequest.reject(
+              new Error(`${data.data['topic']}: ${data.data['message']}`)
+            )
+          } else {
+            pendingRequest.resolve(data.data)
+          }
+        }
+
+        this.ee.emit(data.topic, data.data)
+      } catch (e) {
+        LogHelper.title(`${this.name} TCP Client`)
+        LogHelper.error(`Failed to parse the data: ${e}`)
+        LogHelper.error(`Received data: ${strChunk}`)
+      }
+    }
+  }
+
+  private connectSocket(): void {
+    /**
+     * Prefer the Unix domain socket when set as the core
+     * and the TCP server run on the same host
+     */
+    if (PYTHON_TCP_SERVER_UNIX_SOCKET_PATH) {
+      this.tcpSocket.connect({
+        path: PYTHON_TCP_SERVER_UNIX_SOCKET_PATH
+      })
+    } else {
+      this.tcpSocket.connect({
+        host: this.host,
+        port: this.port
+      })
+    }
+  }
 }
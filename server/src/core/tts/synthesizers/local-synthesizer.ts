@@ -77,11 +77,11 @@ export default class LocalSynthesizer extends TTSSynthesizerBase {
             LogHelper.title(this.name)
             LogHelper.warning(`Failed to get audio duration: ${e}`)
           }
-          try {
-            fs.unlinkSync(outputPath)
-          } catch (e) {
-            LogHelper.warning(`Failed to delete tmp audio file: ${e}`)
-          }
+          /**
+           * The TCP server owns the audio file and evicts it
+           * from its audio store once it is acknowledged
+           */
+          PYTHON_TCP_CLIENT.emit('tts-audio-acknowledged', { audioId })
         })
       })
     }
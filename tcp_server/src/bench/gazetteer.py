@@ -0,0 +1,194 @@
+"""
+Compare the location resolution of the gazetteer index and of the compiled gazetteer file
+with the former full scans of geonamescache.
+
+Usage (from the root of the project):
+    python tcp_server/src/bench/gazetteer.py --iterations 20
+"""
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from geonamescache import GeonamesCache  # noqa: E402
+
+from lib.gazetteer import Gazetteer, GazetteerFile, compile_gazetteer  # noqa: E402
+from lib.utils import get_rss_bytes  # noqa: E402
+
+LOCATIONS = [
+    'Paris',
+    'france',
+    'New York',
+    'Berlin',
+    'Tokyo',
+    'São Paulo',
+    'Shanghai',
+    'Georgia',
+    'Springfield',
+    'Nowhere Town'
+]
+
+
+def scan_resolve_location(countries: dict, cities: dict, text: str) -> tuple:
+    """Former implementation: scan all countries, then all cities, then all countries again"""
+    matching_country = None
+    for country in countries:
+        if countries[country]['name'].casefold() == text.casefold():
+            matching_country = countries[country]
+            break
+
+    matching_city = None
+    city_country = None
+    city_population = 0
+    for city in cities:
+        alternatenames = [name.casefold() for name in cities[city]['alternatenames']]
+        if cities[city]['name'].casefold() == text.casefold() or text.casefold() in alternatenames:
+            if cities[city]['population'] > city_population:
+                matching_city = cities[city]
+                city_population = cities[city]['population']
+
+                for country in countries:
+                    if countries[country]['iso'] == cities[city]['countrycode']:
+                        city_country = countries[country]
+                        break
+
+    return matching_country, matching_city, city_country
+
+
+def index_resolve_location(gazetteer: Gazetteer | GazetteerFile, text: str) -> tuple:
+    matching_country = gazetteer.find_country(text)
+    matching_city = None
+    city_country = None
+
+    matching_cities = gazetteer.find_cities(text)
+    if matching_cities and matching_cities[0]['population'] > 0:
+        matching_city = matching_cities[0]
+        city_country = gazetteer.find_country_by_iso(matching_city['countrycode'])
+
+    return matching_country, matching_city, city_country
+
+
+def delete_unneeded_country_data(data: dict) -> None:
+    for key in ('geonameid', 'neighbours', 'languages', 'iso3', 'fips', 'currencyname', 'postalcoderegex', 'areakm2'):
+        del data[key]
+
+
+def copy_resolve_location(gazetteer: GazetteerFile, text: str) -> tuple:
+    """Former resolution payloads: deep copy the matching records, then delete the fields that are not exported"""
+    entity_suffix = ''
+    data = None
+
+    country = gazetteer.find_country(text)
+    if country:
+        entity_suffix += ':country'
+        data = copy.deepcopy(country)
+        delete_unneeded_country_data(data)
+
+    matching_cities = gazetteer.find_cities(text)
+    if matching_cities:
+        entity_suffix += ':city'
+        city = matching_cities[0]
+
+        if city['population'] > 0:
+            data = copy.deepcopy(city)
+            del data['geonameid']
+            del data['admin1code']
+            city_country = gazetteer.find_country_by_iso(city['countrycode'])
+            if city_country:
+                data['country'] = copy.deepcopy(city_country)
+                delete_unneeded_country_data(data['country'])
+
+    return entity_suffix, data
+
+
+def payload_resolve_location(gazetteer: GazetteerFile, text: str) -> tuple:
+    """Same as nlp.resolve_location"""
+    entity_suffix = ''
+    data = gazetteer.find_country_resolution(text)
+    if data:
+        entity_suffix += ':country'
+
+    city_match = gazetteer.find_city_resolution(text)
+    if city_match:
+        entity_suffix += ':city'
+        if city_match[0] > 0:
+            data = city_match[1]
+
+    return entity_suffix, data
+
+
+def measure(resolve, iterations: int) -> float:
+    """:return: Mean duration of one location resolution in milliseconds"""
+    tic = time.perf_counter()
+    for _ in range(iterations):
+        for location in LOCATIONS:
+            resolve(location)
+
+    return (time.perf_counter() - tic) * 1000 / (iterations * len(LOCATIONS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gazetteer location resolution microbenchmark')
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    rss_before = get_rss_bytes()
+    tic = time.perf_counter()
+    geonamescache = GeonamesCache()
+    countries = geonamescache.get_countries()
+    cities = geonamescache.get_cities()
+    load_duration = (time.perf_counter() - tic) * 1000
+    dicts_rss = get_rss_bytes() - rss_before
+
+    tic = time.perf_counter()
+    gazetteer = Gazetteer(countries, cities)
+    build_duration = (time.perf_counter() - tic) * 1000
+
+    gazetteer_path = os.path.join(tempfile.mkdtemp(), 'gazetteer.bin')
+    tic = time.perf_counter()
+    compile_gazetteer(countries, cities, gazetteer_path)
+    compile_duration = (time.perf_counter() - tic) * 1000
+
+    tic = time.perf_counter()
+    gazetteer_file = GazetteerFile(gazetteer_path)
+    map_duration = (time.perf_counter() - tic) * 1000
+
+    for location in LOCATIONS:
+        scan_result = scan_resolve_location(countries, cities, location)
+        assert scan_result == index_resolve_location(gazetteer, location), location
+
+        # The file does not keep the alternate names
+        file_result = index_resolve_location(gazetteer_file, location)
+        expected_city = scan_result[1] and {key: value for key, value in scan_result[1].items() if key != 'alternatenames'}
+        assert file_result == (scan_result[0], expected_city, scan_result[2]), location
+
+        assert copy_resolve_location(gazetteer_file, location) == payload_resolve_location(gazetteer_file, location), location
+
+    scan_duration = measure(lambda location: scan_resolve_location(countries, cities, location), args.iterations)
+    index_duration = measure(lambda location: index_resolve_location(gazetteer, location), args.iterations * 1000)
+    file_duration = measure(lambda location: index_resolve_location(gazetteer_file, location), args.iterations * 100)
+    copy_duration = measure(lambda location: copy_resolve_location(gazetteer_file, location), args.iterations * 100)
+    payload_duration = measure(lambda location: payload_resolve_location(gazetteer_file, location), args.iterations * 100)
+
+    print(f'{len(countries)} countries, {len(cities)} cities, {len(gazetteer.cities_by_name)} indexed names')
+    print(f'geonamescache dicts: {load_duration:.1f} ms to load, {dicts_rss / 1024 / 1024:.1f} MB of RSS')
+    print(f'Index build:         {build_duration:.1f} ms')
+    print(f'File compile:        {compile_duration:.1f} ms (build step), {os.path.getsize(gazetteer_path) / 1024 / 1024:.1f} MB')
+    print(f'File map:            {map_duration:.3f} ms (at startup)')
+    print(f'Full scans:          {scan_duration:.4f} ms per location')
+    print(f'Index:               {index_duration:.4f} ms per location')
+    print(f'File:                {file_duration:.4f} ms per location')
+    print(f'Resolution payloads: {copy_duration:.4f} ms per location with deep copies, '
+          f'{payload_duration:.4f} ms with the pre-trimmed payloads')
+
+    gazetteer_file.close()
+    os.remove(gazetteer_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Replay traffic recorded by the TCP server (LEON_PY_TCP_SERVER_RECORD_PATH) against a running TCP server
+and report throughput, tail latency and memory growth per topic.
+
+Usage (from the root of the project):
+    python tcp_server/src/bench/replay.py recording.jsonl --concurrency 4 --rate 10 --repeat 3
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.protocol import FrameDecoder, INTERMEDIATE_TOPICS, MESSAGE_TYPE_JSON, encode_json_frame  # noqa: E402
+from lib.metrics import Histogram  # noqa: E402
+
+
+class Connection:
+    """Client side of one connection, matching replies to requests by request ID"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.request_ids = itertools.count(1)
+        self.pending: dict[int, dict] = {}
+        self.reader_task = asyncio.create_task(self.read_frames())
+
+    async def read_frames(self) -> None:
+        decoder = FrameDecoder()
+
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                break
+
+            for frame in decoder.feed(data):
+                pending = self.pending.get(frame.request_id)
+                if not pending:
+                    continue
+
+                if pending['first_reply_at'] is None:
+                    pending['first_reply_at'] = time.perf_counter()
+
+                if frame.message_type == MESSAGE_TYPE_JSON:
+                    reply = frame.json()
+                    if reply['topic'] not in INTERMEDIATE_TOPICS:
+                        del self.pending[frame.request_id]
+                        pending['future'].set_result(reply)
+
+    async def request(self, topic: str, data) -> tuple[dict, float, float]:
+        """:return: The final reply, the time to the first reply and the time to the final reply"""
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        pending = {
+            'future': future,
+            'first_reply_at': None
+        }
+        self.pending[request_id] = pending
+
+        tic = time.perf_counter()
+        self.writer.write(encode_json_frame({'topic': topic, 'data': data}, request_id))
+        await self.writer.drain()
+        reply = await future
+        toc = time.perf_counter()
+
+        return reply, pending['first_reply_at'] - tic, toc - tic
+
+    async def close(self) -> None:
+        self.reader_task.cancel()
+        self.writer.close()
+
+
+async def connect(args) -> Connection:
+    if args.unix_socket:
+        reader, writer = await asyncio.open_unix_connection(args.unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+
+    return Connection(reader, writer)
+
+
+def load_recording(path: str, topics: list[str]) -> list[dict]:
+    with open(path, encoding='utf-8') as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    if topics:
+        requests = [request for request in requests if request['topic'] in topics]
+
+    return requests
+
+
+async def get_rss_bytes(connection: Connection) -> int:
+    reply, _, _ = await connection.request('server-metrics', None)
+
+    return reply['data']['gauges'].get('process.rss_bytes', 0)
+
+
+async def replay(args) -> dict:
+    requests = load_recording(args.recording, args.topics) * args.repeat
+    if not requests:
+        raise SystemExit('No request to replay')
+
+    control_connection = await connect(args)
+    rss_before = await get_rss_bytes(control_connection)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, request in enumerate(requests):
+        queue.put_nowait((index, request))
+
+    latencies: dict[str, Histogram] = {}
+    first_reply_latencies: dict[str, Histogram] = {}
+    errors: dict[str, int] = {}
+    started_at = time.perf_counter()
+
+    async def worker():
+        connection = await connect(args)
+
+        try:
+            while not queue.empty():
+                index, request = queue.get_nowait()
+
+                # Pace the requests globally when a rate is given
+                if args.rate:
+                    delay = started_at + index / args.rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                topic = request['topic']
+                reply, first_reply_duration, duration = await connection.request(topic, request['data'])
+
+                if reply['topic'] == 'tcp-server-error':
+                    errors[topic] = errors.get(topic, 0) + 1
+                latencies.setdefault(topic, Histogram(len(requests))).observe(duration * 1000)
+                first_reply_latencies.setdefault(topic, Histogram(len(requests))).observe(first_reply_duration * 1000)
+        finally:
+            await connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    rss_after = await get_rss_bytes(control_connection)
+    await control_connection.close()
+
+    return {
+        'requestsCount': len(requests),
+        'duration': round(elapsed, 3),
+        'throughput': round(len(requests) / elapsed, 3),
+        'rssBefore': rss_before,
+        'rssAfter': rss_after,
+        'rssGrowth': rss_after - rss_before,
+        'topics': {
+            topic: {
+                'throughput': round(histogram.count / elapsed, 3),
+                'errors': errors.get(topic, 0),
+                'latency': histogram.to_dict(),
+                'firstReplyLatency': first_reply_latencies[topic].to_dict()
+            } for topic, histogram in latencies.items()
+        }
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['requestsCount']} requests in {report['duration']}s ({report['throughput']} req/s)")
+    print(f"RSS: {report['rssBefore'] / 1024 / 1024:.1f} MB -> {report['rssAfter'] / 1024 / 1024:.1f} MB "
+          f"({report['rssGrowth'] / 1024 / 1024:+.1f} MB)")
+    print()
+    print(f"{'topic':<28}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+    for topic, topic_report in report['topics'].items():
+        latency = topic_report['latency']
+        print(f"{topic:<28}{latency['count']:>8}{topic_report['errors']:>8}{topic_report['throughput']:>10}"
+              f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}{latency['max']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded traffic against the TCP server')
+    parser.add_argument('recording', help='JSON-lines file recorded with LEON_PY_TCP_SERVER_RECORD_PATH')
+    parser.add_argument('--host', default=os.environ.get('LEON_PY_TCP_SERVER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('LEON_PY_TCP_SERVER_PORT', 1342)))
+    parser.add_argument('--unix-socket', default=os.environ.get('LEON_PY_TCP_SERVER_UNIX_SOCKET_PATH'))
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of connections sending requests')
+    parser.add_argument('--rate', type=float, default=0, help='Requests per second, 0 for as fast as possible')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times the recording is replayed')
+    parser.add_argument('--topics', nargs='*', default=[], help='Only replay these topics')
+    parser.add_argument('--json', dest='json_output', help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    report = asyncio.run(replay(args))
+    print_report(report)
+
+    if args.json_output:
+        with open(args.json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Compare the stock spaCy pipeline with the CPU optimized one (lib/nlp_optimization.py)
+on the utterances of fixtures/ner_utterances.json: entity accuracy against the annotations,
+agreement between both pipelines and inference latency.
+
+Usage (from the root of the project):
+    python tcp_server/src/bench/spacy_cpu.py en --iterations 5 --threads 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import spacy  # noqa: E402
+
+from lib.metrics import Histogram  # noqa: E402
+from lib.nlp import spacy_model_mapping  # noqa: E402
+from lib.nlp_optimization import optimize_for_cpu  # noqa: E402
+from lib.utils import get_rss_bytes  # noqa: E402
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ner_utterances.json')
+
+
+def get_entities(nlp, lang: str, text: str) -> set[tuple[str, str]]:
+    entity_mapping = spacy_model_mapping[lang]['entity_mapping']
+
+    return {(ent.text, entity_mapping[ent.label_]) for ent in nlp(text).ents if ent.label_ in entity_mapping}
+
+
+def get_scores(predicted: list[set], expected: list[set]) -> dict:
+    """Micro-averaged precision, recall and F1 of the (text, entity) pairs"""
+    true_positives = sum(len(p & e) for p, e in zip(predicted, expected))
+    predicted_count = sum(len(p) for p in predicted)
+    expected_count = sum(len(e) for e in expected)
+    precision = true_positives / predicted_count if predicted_count else 1.
+    recall = true_positives / expected_count if expected_count else 1.
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.
+
+    return {
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(f1, 4)
+    }
+
+
+def evaluate(nlp, lang: str, fixtures: list[dict], iterations: int) -> tuple[list[set], dict]:
+    # Warm up
+    nlp('This is a test in Paris.')
+
+    latency = Histogram(len(fixtures) * iterations)
+    predicted = []
+
+    for i in range(iterations):
+        for fixture in fixtures:
+            tic = time.perf_counter()
+            entities = get_entities(nlp, lang, fixture['text'])
+            latency.observe((time.perf_counter() - tic) * 1000)
+
+            if i == 0:
+                predicted.append(entities)
+
+    return predicted, latency.to_dict()
+
+
+def load_pipeline(lang: str):
+    rss_before = get_rss_bytes()
+    nlp = spacy.load(spacy_model_mapping[lang]['model'], exclude=spacy_model_mapping[lang]['exclude'])
+
+    return nlp, get_rss_bytes() - rss_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description='spaCy CPU optimization accuracy/latency report')
+    parser.add_argument('lang', nargs='?', default='en', choices=list(spacy_model_mapping))
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help='PyTorch intra-op threads, 0 for the default')
+    parser.add_argument('--interop-threads', type=int, default=0)
+    parser.add_argument('--no-quantize', dest='quantize', action='store_false')
+    parser.add_argument('--json', dest='json_output', help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    with open(FIXTURES_PATH, encoding='utf-8') as f:
+        fixtures = json.load(f)[args.lang]
+    expected = [{tuple(entity) for entity in fixture['entities']} for fixture in fixtures]
+
+    stock_nlp, stock_rss = load_pipeline(args.lang)
+    stock_predicted, stock_latency = evaluate(stock_nlp, args.lang, fixtures, args.iterations)
+    del stock_nlp
+
+    optimized_nlp, optimized_rss = load_pipeline(args.lang)
+    optimizations = optimize_for_cpu(optimized_nlp, {
+        'quantize': args.quantize,
+        'threads': args.threads,
+        'interop_threads': args.interop_threads
+    })
+    optimized_predicted, optimized_latency = evaluate(optimized_nlp, args.lang, fixtures, args.iterations)
+
+    report = {
+        'model': spacy_model_mapping[args.lang]['model'],
+        'utterancesCount': len(fixtures),
+        'optimizations': optimizations,
+        'stock': {
+            'accuracy': get_scores(stock_predicted, expected),
+            'latency': stock_latency,
+            'rssBytes': stock_rss
+        },
+        'optimized': {
+            'accuracy': get_scores(optimized_predicted, expected),
+            'latency': optimized_latency,
+            'rssBytes': optimized_rss
+        },
+        # The stock predictions as reference
+        'agreement': get_scores(optimized_predicted, stock_predicted),
+        'changedUtterances': [
+            {
+                'text': fixture['text'],
+                'stock': sorted(stock_entities),
+                'optimized': sorted(optimized_entities)
+            }
+            for fixture, stock_entities, optimized_entities in zip(fixtures, stock_predicted, optimized_predicted)
+            if stock_entities != optimized_entities
+        ]
+    }
+
+    print(f"{report['model']} on {len(fixtures)} utterances, optimizations: {', '.join(optimizations) or 'none'}")
+    print()
+    print(f"{'':<12}{'precision':>10}{'recall':>10}{'f1':>10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name in ('stock', 'optimized'):
+        accuracy = report[name]['accuracy']
+        latency = report[name]['latency']
+        print(f"{name:<12}{accuracy['precision']:>10}{accuracy['recall']:>10}{accuracy['f1']:>10}"
+              f"{latency['p50']:>10}{latency['p95']:>10}{latency['mean']:>10}")
+    print()
+    print(f"Agreement with the stock pipeline: F1 {report['agreement']['f1']}, "
+          f"{len(report['changedUtterances'])} utterance(s) with different entities")
+    for changed_utterance in report['changedUtterances']:
+        print(f"  {changed_utterance['text']}: {changed_utterance['stock']} -> {changed_utterance['optimized']}")
+
+    if args.json_output:
+        with open(args.json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
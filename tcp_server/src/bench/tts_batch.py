@@ -0,0 +1,137 @@
+"""
+Real-time factor of the TTS (synthesis duration / audio duration) depending on the number
+of sentence pieces synthesized in one forward pass (the "tts.batch_size" setting).
+Lower is faster, under 1 means faster than real time.
+
+Usage (from the root of the project):
+    python tcp_server/src/bench/tts_batch.py --batch-sizes 1,2,4,8 --iterations 3 --threads 4 --lookahead 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import torch  # noqa: E402
+
+from lib.constants import TTS_MODEL_CONFIG_PATH, TTS_MODEL_FOLDER_PATH  # noqa: E402
+from lib.metrics import Histogram  # noqa: E402
+from lib.tts.api import TTS  # noqa: E402
+from lib.utils import get_settings  # noqa: E402
+
+# Several KB so the largest batch sizes get full batches (see the pieces count in the report)
+DEFAULT_TEXT = ('Good morning! It is sunny in Paris today, with a high of twenty-four degrees. '
+                'The wind will pick up in the afternoon, and a few showers are expected after seven in the evening, '
+                'so you may want to take an umbrella if you go out for dinner. '
+                'You have three meetings on your calendar, the first one starts at nine thirty. '
+                'It is the weekly review with the product team, and Julia asked you to prepare the figures of last '
+                'month before the meeting. '
+                'The second one is a lunch with Thomas at the Italian restaurant near the office, at half past twelve. '
+                'The last one is a call with the support team at four, it should not last more than half an hour. '
+                'Do not forget to call your mother, it is her birthday. '
+                'She will be sixty-two, and the flowers you ordered on Monday will be delivered to her place before '
+                'noon. '
+                'The package you ordered last week should be delivered this afternoon. '
+                'The delivery company said it would arrive between two and five, and someone has to sign for it. '
+                'I also added milk and eggs to your shopping list. '
+                'There are now eleven items on it, including the coffee beans you wanted to try and the batteries for '
+                'the remote control. '
+                'Your train to Lyon on Friday leaves at eight fifteen from the Gare de Lyon, platform numbers are '
+                'usually displayed twenty minutes before the departure. '
+                'The hotel confirmed your reservation for two nights, breakfast is included and the check-in starts at '
+                'three in the afternoon. '
+                'In the news this morning, the city announced that the new tramway line will open next spring, a few '
+                'months later than planned. '
+                'The museum of modern art extends its opening hours on Thursdays until ten in the evening, starting '
+                'this week. '
+                'Your favorite football team won yesterday evening, two goals to one, thanks to a late goal in the '
+                'last minutes of the game. '
+                'On the technology side, a new version of your favorite code editor has been released, with faster '
+                'startup and better search. '
+                'Your electricity bill is due on the fifteenth, the amount is a bit lower than last month because of '
+                'the warmer weather. '
+                'You walked eight thousand steps yesterday, which is close to your daily goal of ten thousand steps. '
+                'You slept seven hours and twenty minutes, a bit more than your weekly average. '
+                'The book you borrowed from the library has to be returned before next Tuesday, you can renew it online '
+                'if you have not finished it yet. '
+                'Your friend Maria shared a few photos of her trip to Lisbon, and she asked whether you are available '
+                'for a dinner next weekend. '
+                'Finally, remember that the plumber comes on Saturday morning between nine and eleven to fix the '
+                'kitchen sink. '
+                'That is all for this morning. '
+                'Have a great day!')
+SPEAKER = 'EN-Leon-V1_1'
+
+
+def run(tts: TTS, text: str, batch_size: int, lookahead: int, iterations: int) -> dict:
+    rtf = Histogram(iterations)
+    first_audio_latency = Histogram(iterations)
+    sampling_rate = tts.hps.data.sampling_rate
+
+    for _ in range(iterations):
+        tic = time.perf_counter()
+        samples_count = 0
+        for audio in tts.tts_iter(text, tts.hps.data.spk2id[SPEAKER], quiet=True, stream=True,
+                                  batch_size=batch_size, lookahead=lookahead):
+            if not samples_count:
+                first_audio_latency.observe((time.perf_counter() - tic) * 1000)
+            samples_count += len(audio)
+
+        rtf.observe((time.perf_counter() - tic) / (samples_count / sampling_rate))
+
+    return {
+        'batchSize': batch_size,
+        'rtf': rtf.to_dict(),
+        'firstAudioLatency': first_audio_latency.to_dict()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TTS real-time factor per batch size on CPU')
+    parser.add_argument('--batch-sizes', default='1,2,4,8', help='Comma-separated batch sizes')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='PyTorch intra-op threads, 0 for the default')
+    parser.add_argument('--lookahead', type=int, default=0,
+                        help='Batches prepared in advance by the frontend thread, 0 runs the stages in turn')
+    parser.add_argument('--text', default=DEFAULT_TEXT)
+    parser.add_argument('--json', dest='json_output', help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    tts = TTS(language='EN',
+              device='cpu',
+              config_path=TTS_MODEL_CONFIG_PATH,
+              ckpt_path=os.path.join(TTS_MODEL_FOLDER_PATH, get_settings('tts')['model_file_name']))
+    tts.warmup()
+
+    # Streamed like the "tts-synthesize" requests, so one piece per sentence
+    pieces_count = len(tts.split_sentences_into_pieces(args.text, tts.language, quiet=True, is_sentence_level=True))
+    report = {
+        'device': 'cpu',
+        'threads': torch.get_num_threads(),
+        'piecesCount': pieces_count,
+        'lookahead': args.lookahead,
+        'results': [run(tts, args.text, int(batch_size), args.lookahead, args.iterations)
+                    for batch_size in args.batch_sizes.split(',')]
+    }
+
+    print(f"{pieces_count} sentence piece(s) ({len(args.text)} characters) on CPU with {report['threads']} thread(s), "
+          f"frontend lookahead {args.lookahead}, {args.iterations} iteration(s)")
+    print()
+    print(f"{'batch size':<12}{'rtf p50':>10}{'rtf mean':>10}{'1st audio p50 ms':>18}")
+    for result in report['results']:
+        print(f"{result['batchSize']:<12}{result['rtf']['p50']:>10}{result['rtf']['mean']:>10}"
+              f"{result['firstAudioLatency']['p50']:>18}")
+
+    if args.json_output:
+        with open(args.json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""
+Compile the compact gazetteer file used to resolve locations (lib/gazetteer.py).
+The TCP server also compiles it on startup when it is missing.
+
+Usage (from the root of the project):
+    python tcp_server/src/build_gazetteer.py
+"""
+
+import time
+
+from lib.constants import GAZETTEER_PATH
+from lib.gazetteer import build_gazetteer, GazetteerFile
+
+if __name__ == '__main__':
+    tic = time.perf_counter()
+    build_gazetteer(GAZETTEER_PATH)
+    toc = time.perf_counter()
+
+    gazetteer = GazetteerFile(GAZETTEER_PATH)
+    print(f'Compiled {GAZETTEER_PATH} in {toc - tic:0.2f} seconds: '
+          f'{gazetteer.countries_count} countries, {gazetteer.cities_count} cities, '
+          f'{gazetteer.city_names_count} city names, {gazetteer.mm.size() / 1024 / 1024:.1f} MB')
+    gazetteer.close()
@@ -5,8 +5,11 @@ import torch
 import numpy as np
 from faster_whisper import WhisperModel
 
-from ..constants import ASR_MODEL_PATH
+from ..constants import ASR_MODEL_PATH, ASR_INPUT, ASR_INPUT_SHM_NAME, SHM_CAPACITY
+from ..shm_ring import SharedMemoryRingBuffer, SharedMemoryAudioInput
 from ..utils import ThrottledCallback, is_macos, get_settings
+from ..settings import settings
+from ..metrics import metrics
 
 
 class ASR:
@@ -59,6 +62,8 @@ class ASR:
         self.is_wake_word_detected = False
         self.is_active_listening_enabled = False
         self.complete_text = ''
+        # When the first voiced frame of the current utterance was captured
+        self.speech_start_time = 0
 
         self.audio_format = pyaudio.paInt16
         self.buffer = bytearray()
@@ -67,6 +72,7 @@ class ASR:
         self.rate = 16000
         self.frames_per_buffer = 1024
         self.rms_threshold = get_settings('asr')['rms_mic_threshold']
+        settings.subscribe('asr', self.on_settings_change)
         # Duration of silence after which the audio data is considered as a new utterance (in seconds)
         self.silence_duration = 1
         """
@@ -76,7 +82,14 @@ class ASR:
         self.base_active_listening_duration = 12
         self.active_listening_duration = self.base_active_listening_duration
 
-        self.audio = pyaudio.PyAudio()
+        self.audio = None
+        self.input_ring = None
+        if ASR_INPUT == 'shm':
+            # PCM (16 kHz, mono, 16-bit) is written by another process, e.g. a remote hotword node
+            self.input_ring = SharedMemoryRingBuffer(ASR_INPUT_SHM_NAME, SHM_CAPACITY, create=True)
+            self.log(f'Reading audio from shared memory "{ASR_INPUT_SHM_NAME}"')
+        else:
+            self.audio = pyaudio.PyAudio()
         self.stream = None
         self.model = None
 
@@ -102,12 +115,15 @@ class ASR:
         silence_threshold = int(self.silence_duration * self.rate / self.frames_per_buffer)
 
         try:
-            self.stream = self.audio.open(format=self.audio_format,
-                                          channels=self.channels,
-                                          rate=self.rate,
-                                          frames_per_buffer=self.frames_per_buffer,
-                                          input=True,
-                                          input_device_index=self.audio.get_default_input_device_info()["index"])  # Use the default input device
+            if self.input_ring:
+                self.stream = SharedMemoryAudioInput(self.input_ring, channels=self.channels)
+            else:
+                self.stream = self.audio.open(format=self.audio_format,
+                                              channels=self.channels,
+                                              rate=self.rate,
+                                              frames_per_buffer=self.frames_per_buffer,
+                                              input=True,
+                                              input_device_index=self.audio.get_default_input_device_info()["index"])  # Use the default input device
             self.log("Recording...")
 
             while self.is_recording:
@@ -121,6 +137,8 @@ class ASR:
 
                     self.interrupt_leon_speech_callback()
 
+                    if len(self.buffer) == 0:
+                        self.speech_start_time = time.perf_counter()
                     self.buffer.extend(data)
                     self.silence_frames_count = 0
                 else:
@@ -146,12 +164,16 @@ class ASR:
                             }
                             if self.device == 'cpu':
                                 transcribe_params['temperature'] = 0
-                            segments, info = self.model.transcribe(audio_data, **transcribe_params)
+                            # Segments are lazily transcribed while iterating
+                            with metrics.timer('asr.transcription'):
+                                segments, info = self.model.transcribe(audio_data, **transcribe_params)
 
-                            for segment in segments:
-                                self.log("[%.2fs -> %.2fs] %s" % (segment.start, segment.end, segment.text))
-                                self.complete_text += segment.text
+                                for segment in segments:
+                                    self.log("[%.2fs -> %.2fs] %s" % (segment.start, segment.end, segment.text))
+                                    self.complete_text += segment.text
 
+                            metrics.observe('asr.capture_to_transcript',
+                                            (time.perf_counter() - self.speech_start_time) * 1000)
                             self.transcribed_callback(self.complete_text)
                             time.sleep(0.1)
                             # Notify the end of the owner's speech
@@ -168,6 +190,12 @@ class ASR:
         except Exception as e:
             self.log('Error:', e)
 
+    def on_settings_change(self, asr_settings, old_asr_settings):
+        # Only applies what can change without reloading the model
+        if asr_settings['rms_mic_threshold'] != self.rms_threshold:
+            self.rms_threshold = asr_settings['rms_mic_threshold']
+            self.log(f'RMS mic threshold set to {self.rms_threshold}')
+
     def stop_recording(self):
         self.is_recording = False
         self.stream.stop_stream()
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class AudioEntry:
+    def __init__(self, audio_id: str, path: str):
+        self.audio_id = audio_id
+        self.path = path
+        self.size = 0
+        self.created_at = time.time()
+
+
+class AudioStore:
+    """Delete generated audio files as soon as the core acknowledges them (played).
+    Files never acknowledged are kept within a size and count budget,
+    and only evicted once they are older than the unacknowledged TTL, oldest first"""
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int, unacknowledged_ttl: float, extension: str = 'wav'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.unacknowledged_ttl = unacknowledged_ttl
+        self.extension = extension
+        self.entries: OrderedDict[str, AudioEntry] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Audio Store]', *args, **kwargs)
+
+    def clean_up(self) -> None:
+        """Delete the files left over by a previous run. Only keep ".gitkeep" file"""
+        deleted_count = 0
+
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(f'.{self.extension}'):
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                    deleted_count += 1
+                except OSError as e:
+                    self.log(f'Failed to delete {file_name}:', e)
+
+        if deleted_count:
+            self.log(f'Deleted {deleted_count} audio file(s) from {self.directory}')
+
+    def get_path(self, audio_id: str) -> str:
+        return os.path.join(self.directory, f'{audio_id}.{self.extension}')
+
+    def add(self, audio_id: str) -> Optional[AudioEntry]:
+        """Register a file once it is written"""
+        path = self.get_path(audio_id)
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+
+        entry = AudioEntry(audio_id, path)
+        entry.size = size
+
+        with self.lock:
+            self.entries[audio_id] = entry
+            self.total_bytes += size
+
+        self.enforce_budget()
+
+        return entry
+
+    def acknowledge(self, audio_id: str) -> bool:
+        """The core played the file, delete it"""
+        with self.lock:
+            entry = self.entries.pop(audio_id, None)
+            if not entry:
+                return False
+
+            self.total_bytes -= entry.size
+
+        self.delete_file(entry)
+
+        return True
+
+    def delete_file(self, entry: AudioEntry) -> None:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.log(f'Failed to delete {entry.path}:', e)
+
+    def is_over_budget(self) -> bool:
+        return self.total_bytes > self.max_bytes or len(self.entries) > self.max_files
+
+    def enforce_budget(self) -> None:
+        with self.lock:
+            if not self.is_over_budget():
+                return
+
+            now = time.time()
+            # Oldest first
+            evictable_entries = [
+                entry for entry in self.entries.values()
+                if now - entry.created_at > self.unacknowledged_ttl
+            ]
+
+            for entry in evictable_entries:
+                if not self.is_over_budget():
+                    break
+
+                del self.entries[entry.audio_id]
+                self.total_bytes -= entry.size
+                self.delete_file(entry)
+
+            if self.is_over_budget():
+                self.log(f'Still over budget with {len(self.entries)} file(s) and {self.total_bytes} bytes '
+                         'waiting for playback acknowledgement')
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'directory': self.directory,
+                'filesCount': len(self.entries),
+                'totalBytes': self.total_bytes
+            }
@@ -12,6 +12,10 @@ if IS_RAN_FROM_BINARY:
 TMP_PATH = os.path.join(LIB_PATH, 'tmp')
 AUDIO_MODELS_PATH = os.path.join(os.getcwd(), 'core', 'data', 'models', 'audio')
 SETTINGS_PATH = os.path.join(os.getcwd(), 'tcp_server', 'settings.json')
+SKILLS_PATH = os.path.join(os.getcwd(), 'skills')
+GLOBAL_DATA_PATH = os.path.join(os.getcwd(), 'core', 'data')
+# Compiled from geonamescache, see build_gazetteer.py
+GAZETTEER_PATH = os.path.join(os.getcwd(), 'core', 'data', 'models', 'gazetteer.bin')
 
 # TTS
 TTS_MODEL_FOLDER_PATH = os.path.join(AUDIO_MODELS_PATH, 'tts')
@@ -23,3 +27,21 @@ IS_TTS_ENABLED = os.environ.get('LEON_TTS', 'true') == 'true'
 # ASR
 ASR_MODEL_PATH = os.path.join(AUDIO_MODELS_PATH, 'asr')
 IS_ASR_ENABLED = os.environ.get('LEON_STT', 'true') == 'true'
+
+# Transports between the core and the TCP server
+# Also listen on this Unix domain socket for control messages when set
+UNIX_SOCKET_PATH = os.environ.get('LEON_PY_TCP_SERVER_UNIX_SOCKET_PATH') or None
+# "socket" to send TTS audio in binary frames, "shm" to write it in a shared memory ring buffer.
+# Only for the clients of "tts-synthesize-stream": the core plays the audio files of "tts-synthesize"
+AUDIO_TRANSPORT = os.environ.get('LEON_PY_TCP_SERVER_AUDIO_TRANSPORT', 'socket')
+TTS_AUDIO_SHM_NAME = os.environ.get('LEON_PY_TCP_SERVER_TTS_SHM_NAME', 'leon_tts_audio')
+# "microphone" to record with PyAudio, "shm" to read PCM written by another process in a shared memory ring buffer
+ASR_INPUT = os.environ.get('LEON_PY_TCP_SERVER_ASR_INPUT', 'microphone')
+ASR_INPUT_SHM_NAME = os.environ.get('LEON_PY_TCP_SERVER_ASR_SHM_NAME', 'leon_asr_input')
+SHM_CAPACITY = int(os.environ.get('LEON_PY_TCP_SERVER_SHM_CAPACITY', 8 * 1024 * 1024))
+
+# Append every received request to this JSON-lines file to replay it with bench/replay.py (optional)
+TRAFFIC_RECORD_PATH = os.environ.get('LEON_PY_TCP_SERVER_RECORD_PATH') or None
+
+# Report the import time of every module and the duration of the startup phases, see lib/startup_profiler.py
+IS_STARTUP_PROFILE_ENABLED = os.environ.get('LEON_PY_TCP_SERVER_PROFILE_STARTUP', 'false') == 'true'
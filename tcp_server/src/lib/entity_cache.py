@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .metrics import metrics
+
+# (language, model, utterance)
+CacheKey = tuple[str, str, str]
+
+
+class EntityCache:
+    """Bounded LRU cache of the spaCy entities per utterance.
+    Entities hold character offsets, so only identical utterances share an entry.
+    Cached entity lists are shared between requests and must not be mutated"""
+
+    def __init__(self, max_size: int, persist_path: Optional[str] = None):
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.entries: OrderedDict[CacheKey, list[dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.is_dirty = False
+        self.lock = threading.Lock()
+        self.autosave_thread = None
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Entity Cache]', *args, **kwargs)
+
+    def get(self, lang: str, model: str, utterance: str) -> Optional[list[dict]]:
+        if self.max_size <= 0:
+            return None
+
+        key = (lang, model, utterance)
+        with self.lock:
+            entities = self.entries.get(key)
+
+            if entities is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+
+        metrics.increment('nlp.entity_cache.misses' if entities is None else 'nlp.entity_cache.hits')
+
+        return entities
+
+    def put(self, lang: str, model: str, utterance: str, entities: list[dict]) -> None:
+        if self.max_size <= 0:
+            return
+
+        key = (lang, model, utterance)
+        with self.lock:
+            self.entries[key] = entities
+            self.entries.move_to_end(key)
+            self.is_dirty = True
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, lang: str, model: str) -> None:
+        """Drop the entries computed by another model for this language"""
+        with self.lock:
+            stale_keys = [key for key in self.entries if key[0] == lang and key[1] != model]
+            for key in stale_keys:
+                del self.entries[key]
+
+            if stale_keys:
+                self.is_dirty = True
+
+        if stale_keys:
+            self.log(f'Invalidated {len(stale_keys)} entry(ies) computed by another {lang} model than {model}')
+
+    def load(self) -> None:
+        if self.max_size <= 0 or not self.persist_path or not os.path.exists(self.persist_path):
+            return
+
+        try:
+            with open(self.persist_path, encoding='utf-8') as f:
+                persisted_entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log(f'Failed to load {self.persist_path}:', e)
+            return
+
+        with self.lock:
+            # Least recently used first
+            for lang, model, utterance, entities in persisted_entries[-self.max_size:]:
+                self.entries[(lang, model, utterance)] = entities
+
+        self.log(f'Loaded {len(self.entries)} entry(ies) from {self.persist_path}')
+
+    def save(self) -> None:
+        if not self.persist_path or not self.is_dirty:
+            return
+
+        with self.lock:
+            persisted_entries = [[*key, entities] for key, entities in self.entries.items()]
+            self.is_dirty = False
+
+        tmp_path = f'{self.persist_path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(persisted_entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            self.is_dirty = True
+            self.log(f'Failed to save {self.persist_path}:', e)
+
+    def start_autosave(self, interval: float) -> None:
+        if not self.persist_path or self.autosave_thread:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.save()
+
+        self.autosave_thread = threading.Thread(target=run, name='entity-cache-autosave', daemon=True)
+        self.autosave_thread.start()
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
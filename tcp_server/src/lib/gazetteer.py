@@ -0,0 +1,389 @@
+import json
+import mmap
+import os
+import struct
+from typing import Optional
+
+"""
+Compact gazetteer file layout (little-endian), compiled once with compile_gazetteer() and memory-mapped at runtime:
+    header
+    country records      fixed width, see COUNTRY_RECORD, with a reference to the resolution payload
+    city records         fixed width, see CITY_RECORD, with a reference to the resolution payload
+    country names table  sorted by casefolded UTF-8 name -> country index
+    country ISO table    sorted by ISO code -> country index
+    city names table     sorted by casefolded UTF-8 name or alternate name -> range of candidates
+    candidates           city indexes, most populated first for every name
+    string pool          UTF-8 strings referenced by (offset, length), resolution payloads are serialized as JSON
+"""
+
+MAGIC = b'LGAZ'
+FORMAT_VERSION = 2
+# Magic, format version, source version, records and tables counts, string pool offset
+HEADER = struct.Struct('<4sI16sIIIIIII')
+# (offset, length) in the string pool
+STRING_REF_FORMAT = 'IH'
+COUNTRY_STRING_FIELDS = (
+    'name', 'iso', 'iso3', 'fips', 'continentcode', 'capital', 'tld', 'currencycode',
+    'currencyname', 'phone', 'postalcoderegex', 'languages', 'neighbours'
+)
+COUNTRY_RECORD = struct.Struct('<IIII' + STRING_REF_FORMAT * (len(COUNTRY_STRING_FIELDS) + 1))
+CITY_STRING_FIELDS = ('name', 'countrycode', 'timezone', 'admin1code')
+CITY_RECORD = struct.Struct('<IIdd' + STRING_REF_FORMAT * (len(CITY_STRING_FIELDS) + 1))
+# Fields exported in the location entities resolution, in the geonamescache order
+COUNTRY_RESOLUTION_FIELDS = (
+    'name', 'iso', 'isonumeric', 'continentcode', 'capital', 'population', 'tld', 'currencycode', 'phone'
+)
+CITY_RESOLUTION_FIELDS = ('name', 'latitude', 'longitude', 'countrycode', 'population', 'timezone')
+# Key, country index
+COUNTRY_KEY_ENTRY = struct.Struct('<' + STRING_REF_FORMAT + 'I')
+# Key, first candidate, candidates count
+CITY_KEY_ENTRY = struct.Struct('<' + STRING_REF_FORMAT + 'II')
+CANDIDATE = struct.Struct('<I')
+
+
+class Gazetteer:
+    """Hash indexes over the geonamescache countries and cities.
+    Used to compile the gazetteer file, see GazetteerFile for the runtime lookups"""
+
+    def __init__(self, countries: dict, cities: dict):
+        self.countries_by_name: dict[str, dict] = {}
+        self.countries_by_iso: dict[str, dict] = {}
+        # Casefolded name or alternate name -> cities sorted by population (descending)
+        self.cities_by_name: dict[str, list[dict]] = {}
+
+        for country in countries.values():
+            # Keep the first match like a scan would do
+            self.countries_by_name.setdefault(country['name'].casefold(), country)
+            self.countries_by_iso.setdefault(country['iso'], country)
+
+        for city in cities.values():
+            names = {city['name'].casefold()}
+            names.update(name.casefold() for name in city['alternatenames'])
+
+            for name in names:
+                self.cities_by_name.setdefault(name, []).append(city)
+
+        for candidates in self.cities_by_name.values():
+            # Stable sort, so cities with the same population keep their original order
+            candidates.sort(key=lambda candidate: candidate['population'], reverse=True)
+
+    def find_country(self, name: str) -> Optional[dict]:
+        return self.countries_by_name.get(name.casefold())
+
+    def find_country_by_iso(self, iso: str) -> Optional[dict]:
+        return self.countries_by_iso.get(iso)
+
+    def find_cities(self, name: str) -> list[dict]:
+        """:return: The cities matching the name or one of their alternate names, most populated first"""
+        return self.cities_by_name.get(name.casefold(), [])
+
+
+class StringPool:
+    def __init__(self):
+        self.data = bytearray()
+        self.refs: dict[bytes, tuple[int, int]] = {}
+
+    def add(self, value: str) -> tuple[int, int]:
+        encoded = value.encode('utf-8')
+        ref = self.refs.get(encoded)
+
+        if ref is None:
+            ref = (len(self.data), len(encoded))
+            self.refs[encoded] = ref
+            self.data += encoded
+
+        return ref
+
+
+def project_country_resolution(country: dict) -> dict:
+    return {field: country[field] for field in COUNTRY_RESOLUTION_FIELDS}
+
+
+def project_city_resolution(city: dict, country: Optional[dict]) -> dict:
+    resolution = {field: city[field] for field in CITY_RESOLUTION_FIELDS}
+    if country:
+        resolution['country'] = project_country_resolution(country)
+
+    return resolution
+
+
+def serialize_resolution(resolution: dict) -> str:
+    return json.dumps(resolution, ensure_ascii=False, separators=(',', ':'))
+
+
+def compile_gazetteer(countries: dict, cities: dict, output_path: str, source_version: str = '') -> None:
+    """Compile the geonamescache countries and cities into the compact gazetteer file"""
+    index = Gazetteer(countries, cities)
+    pool = StringPool()
+
+    country_list = list(countries.values())
+    city_list = list(cities.values())
+    country_indexes = {id(country): i for i, country in enumerate(country_list)}
+    city_indexes = {id(city): i for i, city in enumerate(city_list)}
+
+    country_records = bytearray()
+    for country in country_list:
+        refs = [value for field in COUNTRY_STRING_FIELDS for value in pool.add(country[field])]
+        refs += pool.add(serialize_resolution(project_country_resolution(country)))
+        country_records += COUNTRY_RECORD.pack(
+            country['geonameid'], country['isonumeric'], country['areakm2'], country['population'], *refs
+        )
+
+    city_records = bytearray()
+    for city in city_list:
+        refs = [value for field in CITY_STRING_FIELDS for value in pool.add(city[field])]
+        city_country = index.find_country_by_iso(city['countrycode'])
+        refs += pool.add(serialize_resolution(project_city_resolution(city, city_country)))
+        city_records += CITY_RECORD.pack(
+            city['geonameid'], city['population'], city['latitude'], city['longitude'], *refs
+        )
+
+    def build_country_table(countries_by_key: dict[str, dict]) -> bytearray:
+        table = bytearray()
+        # Sort by bytes so the runtime binary search compares raw UTF-8 slices
+        for key in sorted(countries_by_key, key=lambda key: key.encode('utf-8')):
+            table += COUNTRY_KEY_ENTRY.pack(*pool.add(key), country_indexes[id(countries_by_key[key])])
+        return table
+
+    country_names_table = build_country_table(index.countries_by_name)
+    country_iso_table = build_country_table(index.countries_by_iso)
+
+    city_names_table = bytearray()
+    candidates = bytearray()
+    candidates_count = 0
+    for name in sorted(index.cities_by_name, key=lambda key: key.encode('utf-8')):
+        matching_cities = index.cities_by_name[name]
+        city_names_table += CITY_KEY_ENTRY.pack(*pool.add(name), candidates_count, len(matching_cities))
+        for city in matching_cities:
+            candidates += CANDIDATE.pack(city_indexes[id(city)])
+        candidates_count += len(matching_cities)
+
+    sections = [country_records, city_records, country_names_table, country_iso_table, city_names_table, candidates]
+    string_pool_offset = HEADER.size + sum(len(section) for section in sections)
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        source_version.encode('utf-8')[:16],
+        len(country_list),
+        len(city_list),
+        len(index.countries_by_name),
+        len(index.countries_by_iso),
+        len(index.cities_by_name),
+        candidates_count,
+        string_pool_offset
+    )
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    # Write then rename so a process never maps a partially written file
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+        f.write(pool.data)
+    os.replace(tmp_path, output_path)
+
+
+class GazetteerFile:
+    """Read-only lookups in a compiled gazetteer file.
+    The file is memory-mapped, so its pages are shared between processes and records are only decoded when they match"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            version,
+            source_version,
+            self.countries_count,
+            self.cities_count,
+            self.country_names_count,
+            self.country_isos_count,
+            self.city_names_count,
+            self.candidates_count,
+            self.string_pool_offset
+        ) = HEADER.unpack_from(self.mm, 0)
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.mm.close()
+            raise ValueError(f'{path} is not a gazetteer file of version {FORMAT_VERSION}')
+
+        self.source_version = source_version.rstrip(b'\0').decode('utf-8')
+
+        self.countries_offset = HEADER.size
+        self.cities_offset = self.countries_offset + self.countries_count * COUNTRY_RECORD.size
+        self.country_names_offset = self.cities_offset + self.cities_count * CITY_RECORD.size
+        self.country_isos_offset = self.country_names_offset + self.country_names_count * COUNTRY_KEY_ENTRY.size
+        self.city_names_offset = self.country_isos_offset + self.country_isos_count * COUNTRY_KEY_ENTRY.size
+        self.candidates_offset = self.city_names_offset + self.city_names_count * CITY_KEY_ENTRY.size
+
+        # Record index -> resolution payload, decoded once then shared
+        self.country_resolutions: dict[int, dict] = {}
+        self.city_resolutions: dict[int, dict] = {}
+
+    def get_string(self, offset: int, length: int) -> str:
+        start = self.string_pool_offset + offset
+        return self.mm[start:start + length].decode('utf-8')
+
+    def search(self, table_offset: int, count: int, entry: struct.Struct, key: str) -> Optional[tuple]:
+        """Binary search of a sorted key table
+        :return: The unpacked table entry or None if the key is not found"""
+        encoded_key = key.encode('utf-8')
+        low, high = 0, count
+
+        while low < high:
+            middle = (low + high) // 2
+            fields = entry.unpack_from(self.mm, table_offset + middle * entry.size)
+            start = self.string_pool_offset + fields[0]
+            middle_key = self.mm[start:start + fields[1]]
+
+            if middle_key == encoded_key:
+                return fields
+            if middle_key < encoded_key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def get_country(self, index: int) -> dict:
+        fields = COUNTRY_RECORD.unpack_from(self.mm, self.countries_offset + index * COUNTRY_RECORD.size)
+        geonameid, isonumeric, areakm2, population = fields[:4]
+        strings = fields[4:]
+        country = {
+            field: self.get_string(strings[i * 2], strings[i * 2 + 1])
+            for i, field in enumerate(COUNTRY_STRING_FIELDS)
+        }
+        country.update({
+            'geonameid': geonameid,
+            'isonumeric': isonumeric,
+            'areakm2': areakm2,
+            'population': population
+        })
+
+        return country
+
+    def get_city(self, index: int) -> dict:
+        fields = CITY_RECORD.unpack_from(self.mm, self.cities_offset + index * CITY_RECORD.size)
+        geonameid, population, latitude, longitude = fields[:4]
+        strings = fields[4:]
+        city = {
+            field: self.get_string(strings[i * 2], strings[i * 2 + 1])
+            for i, field in enumerate(CITY_STRING_FIELDS)
+        }
+        city.update({
+            'geonameid': geonameid,
+            'population': population,
+            'latitude': latitude,
+            'longitude': longitude
+        })
+
+        return city
+
+    def get_country_resolution(self, index: int) -> dict:
+        resolution = self.country_resolutions.get(index)
+
+        if resolution is None:
+            fields = COUNTRY_RECORD.unpack_from(self.mm, self.countries_offset + index * COUNTRY_RECORD.size)
+            resolution = json.loads(self.get_string(fields[-2], fields[-1]))
+            self.country_resolutions[index] = resolution
+
+        return resolution
+
+    def get_city_resolution(self, index: int) -> dict:
+        resolution = self.city_resolutions.get(index)
+
+        if resolution is None:
+            fields = CITY_RECORD.unpack_from(self.mm, self.cities_offset + index * CITY_RECORD.size)
+            resolution = json.loads(self.get_string(fields[-2], fields[-1]))
+            self.city_resolutions[index] = resolution
+
+        return resolution
+
+    def find_country_resolution(self, name: str) -> Optional[dict]:
+        """
+        :return: The resolution payload of the country. It is shared between calls so it must not be mutated
+        """
+        entry = self.search(self.country_names_offset, self.country_names_count, COUNTRY_KEY_ENTRY, name.casefold())
+        return self.get_country_resolution(entry[2]) if entry else None
+
+    def find_city_resolution(self, name: str) -> Optional[tuple[int, dict]]:
+        """
+        :return: The population and the resolution payload of the most populated matching city.
+        The payload is shared between calls so it must not be mutated
+        """
+        entry = self.search(self.city_names_offset, self.city_names_count, CITY_KEY_ENTRY, name.casefold())
+        if not entry:
+            return None
+
+        index = CANDIDATE.unpack_from(self.mm, self.candidates_offset + entry[2] * CANDIDATE.size)[0]
+        population = CITY_RECORD.unpack_from(self.mm, self.cities_offset + index * CITY_RECORD.size)[1]
+
+        return population, self.get_city_resolution(index)
+
+    def is_location_name(self, name: str) -> bool:
+        """
+        :return: Whether the name is the name of a country or of the most populated city it matches.
+        Unlike the lookups, alternate names do not count as many of them are common words (e.g. "Tell", "Set")
+        """
+        if self.find_country_resolution(name):
+            return True
+
+        city_match = self.find_city_resolution(name)
+
+        return bool(city_match) and city_match[1]['name'].casefold() == name.casefold()
+
+    def find_country(self, name: str) -> Optional[dict]:
+        entry = self.search(self.country_names_offset, self.country_names_count, COUNTRY_KEY_ENTRY, name.casefold())
+        return self.get_country(entry[2]) if entry else None
+
+    def find_country_by_iso(self, iso: str) -> Optional[dict]:
+        entry = self.search(self.country_isos_offset, self.country_isos_count, COUNTRY_KEY_ENTRY, iso)
+        return self.get_country(entry[2]) if entry else None
+
+    def find_cities(self, name: str) -> list[dict]:
+        """:return: The cities matching the name or one of their alternate names, most populated first"""
+        entry = self.search(self.city_names_offset, self.city_names_count, CITY_KEY_ENTRY, name.casefold())
+        if not entry:
+            return []
+
+        first_candidate, candidates_count = entry[2], entry[3]
+        offset = self.candidates_offset + first_candidate * CANDIDATE.size
+
+        return [
+            self.get_city(CANDIDATE.unpack_from(self.mm, offset + i * CANDIDATE.size)[0])
+            for i in range(candidates_count)
+        ]
+
+    def close(self) -> None:
+        self.mm.close()
+
+
+def build_gazetteer(output_path: str) -> None:
+    """Compile the gazetteer file from the geonamescache package"""
+    import geonamescache
+    from geonamescache import GeonamesCache
+
+    cache = GeonamesCache()
+    compile_gazetteer(cache.get_countries(), cache.get_cities(), output_path, geonamescache.__version__)
+
+
+def load_gazetteer(path: str) -> GazetteerFile:
+    """Map the gazetteer file, compile it first if it is missing or was compiled from another geonamescache version"""
+    import geonamescache
+
+    try:
+        gazetteer = GazetteerFile(path)
+        if gazetteer.source_version == geonamescache.__version__:
+            return gazetteer
+        gazetteer.close()
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+
+    print('[Gazetteer]', f'Compiling {path}...')
+    build_gazetteer(path)
+
+    return GazetteerFile(path)
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+# Number of most recent samples kept per histogram to compute the percentiles
+HISTOGRAM_RESERVOIR_SIZE = 2048
+
+
+class Histogram:
+    def __init__(self, reservoir_size: int = HISTOGRAM_RESERVOIR_SIZE):
+        self.samples = deque(maxlen=reservoir_size)
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, sorted_samples: list[float], percent: float) -> Optional[float]:
+        if not sorted_samples:
+            return None
+
+        index = min(len(sorted_samples) - 1, int(round(percent / 100 * (len(sorted_samples) - 1))))
+
+        return round(sorted_samples[index], 3)
+
+    def to_dict(self) -> dict:
+        sorted_samples = sorted(self.samples)
+
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'min': round(self.min, 3) if self.min is not None else None,
+            'max': round(self.max, 3) if self.max is not None else None,
+            'p50': self.percentile(sorted_samples, 50),
+            'p95': self.percentile(sorted_samples, 95),
+            'p99': self.percentile(sorted_samples, 99)
+        }
+
+
+class Metrics:
+    """Thread-safe counters, gauges and latency histograms.
+    Durations are recorded in milliseconds"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_to_gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Record the duration of the block in the histogram of the given name
+        :example: with metrics.timer('nlp.spacy_inference'): ...
+        """
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - tic) * 1000)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'timestamp': time.time(),
+                'uptime': round(time.time() - self.started_at, 3),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+            }
+
+
+class MetricsDumper:
+    """Periodically append a metrics snapshot as one JSON line to a file"""
+
+    def __init__(self, metrics_instance: Metrics, dump_path: str, interval: float):
+        self.metrics = metrics_instance
+        self.dump_path = dump_path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='metrics-dumper', daemon=True)
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Metrics]', *args, **kwargs)
+
+    def start(self) -> None:
+        self.log(f'Dumping metrics every {self.interval}s to {self.dump_path}')
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                with open(self.dump_path, 'a') as f:
+                    f.write(json.dumps(self.metrics.snapshot()) + '\n')
+            except OSError as e:
+                self.log('Failed to dump metrics:', e)
+
+
+metrics = Metrics()
@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from .metrics import metrics
+
+
+class MicroBatcher:
+    """Group the items submitted concurrently within a short window, so they share one batched call.
+    The batch is processed on a dedicated thread, callers block until their own result is ready"""
+
+    def __init__(self, name: str, process_batch: Callable[[list], list], window: float, max_size: int):
+        """
+        :param process_batch: Receives the items and returns one result per item, in the same order.
+            An exception instance as a result only fails the caller of that item
+        :param window: How long to wait for more items after the first one (in seconds)
+        """
+        self.name = name
+        self.process_batch = process_batch
+        self.window = window
+        self.max_size = max_size
+        self.queue: queue.Queue[tuple[Any, Future]] = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=f'{name}-micro-batcher', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Micro Batcher]', *args, **kwargs)
+
+    def submit(self, item: Any) -> Any:
+        future = Future()
+        self.queue.put((item, future))
+
+        return future.result()
+
+    def collect_batch(self) -> list[tuple[Any, Future]]:
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.window
+
+        while len(batch) < self.max_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.collect_batch()
+            items = [item for item, _ in batch]
+            metrics.observe(f'{self.name}.micro_batch_size', len(items))
+
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                self.log(f'Failed to process a batch of {len(items)} item(s) for {self.name}:', e)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            # The callers without a result would wait forever
+            if len(results) < len(batch):
+                error = ValueError(f'{self.name} returned {len(results)} result(s) for {len(batch)} item(s)')
+                self.log(error)
+                for _, future in batch[len(results):]:
+                    future.set_exception(error)
@@ -0,0 +1,136 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+MODEL_STATE_PENDING = 'pending'
+MODEL_STATE_LOADING = 'loading'
+MODEL_STATE_WARMING = 'warming'
+MODEL_STATE_READY = 'ready'
+MODEL_STATE_FAILED = 'failed'
+MODEL_STATE_DISABLED = 'disabled'
+FINAL_MODEL_STATES = (MODEL_STATE_READY, MODEL_STATE_FAILED, MODEL_STATE_DISABLED)
+
+
+class ModelNotReadyError(Exception):
+    pass
+
+
+class ManagedModel:
+    def __init__(self, name: str, load: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.load = load
+        self.warmup = warmup
+        self.state = MODEL_STATE_PENDING
+        self.error = None
+        self.load_duration = None
+        self.warmup_duration = None
+        self.ready_event = threading.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            'state': self.state,
+            'error': self.error,
+            'loadDuration': self.load_duration,
+            'warmupDuration': self.warmup_duration
+        }
+
+
+class ModelLoader:
+    """Load all models concurrently and keep track of their state
+    (pending -> loading -> warming -> ready | failed, or disabled)"""
+
+    def __init__(self, on_state_change: Optional[Callable[[str, dict], None]] = None):
+        self.models: dict[str, ManagedModel] = {}
+        self.on_state_change = on_state_change
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Model Loader]', *args, **kwargs)
+
+    def register(self, name: str, load: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None,
+                 is_enabled: bool = True) -> None:
+        """
+        :param load: Load the model and return it. Raise if the model cannot be loaded
+        :param warmup: Run a first inference on the loaded model
+        """
+        self.models[name] = ManagedModel(name, load, warmup)
+
+        if not is_enabled:
+            self.set_state(name, MODEL_STATE_DISABLED)
+
+    def set_state(self, name: str, state: str, error: Optional[str] = None) -> None:
+        model = self.models[name]
+
+        with self.lock:
+            model.state = state
+            model.error = error
+
+        if state in FINAL_MODEL_STATES:
+            model.ready_event.set()
+        else:
+            # E.g. the model is reloaded, requests wait for it again
+            model.ready_event.clear()
+
+        self.log(f'{name}: {state}' + (f' ({error})' if error else ''), flush=True)
+
+        if self.on_state_change:
+            self.on_state_change(name, model.to_dict())
+
+    def load_model(self, name: str) -> None:
+        model = self.models[name]
+
+        try:
+            self.set_state(name, MODEL_STATE_LOADING)
+            tic = time.perf_counter()
+            loaded_model = model.load()
+            model.load_duration = round(time.perf_counter() - tic, 4)
+
+            if model.warmup:
+                self.set_state(name, MODEL_STATE_WARMING)
+                tic = time.perf_counter()
+                model.warmup(loaded_model)
+                model.warmup_duration = round(time.perf_counter() - tic, 4)
+
+            self.set_state(name, MODEL_STATE_READY)
+        except Exception as e:
+            self.set_state(name, MODEL_STATE_FAILED, str(e))
+
+    def load_all(self) -> list[threading.Thread]:
+        """Start loading every pending model on its own thread and return the threads"""
+        threads = []
+
+        for name, model in self.models.items():
+            if model.state != MODEL_STATE_PENDING:
+                continue
+
+            thread = threading.Thread(target=self.load_model, args=(name,), name=f'{name}-loader', daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        return threads
+
+    def wait_until_ready(self, name: str, timeout: Optional[float] = None) -> None:
+        """Block until the model is ready. Raise if it is disabled, failed or took too long"""
+        model = self.models[name]
+
+        if not model.ready_event.is_set():
+            self.log(f'Waiting for {name} to be ready...')
+
+        if not model.ready_event.wait(timeout):
+            raise ModelNotReadyError(f'{name} is not ready after {timeout} seconds (state: {model.state})')
+        if model.state != MODEL_STATE_READY:
+            raise ModelNotReadyError(f'{name} is {model.state}' + (f': {model.error}' if model.error else ''))
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {name: model.to_dict() for name, model in self.models.items()}
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether every enabled model is ready, failed models are reported by failed_models"""
+        return all(model.state in (MODEL_STATE_READY, MODEL_STATE_DISABLED) for model in self.models.values())
+
+    @property
+    def failed_models(self) -> list[str]:
+        return [name for name, model in self.models.items() if model.state == MODEL_STATE_FAILED]
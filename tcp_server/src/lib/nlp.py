@@ -1,15 +1,25 @@
-import copy
 from sys import argv
-import spacy
+import gc
+import string
+import threading
 import time
-from geonamescache import GeonamesCache
+from typing import Optional
 
-lang = argv[1] or 'en'
-spacy_nlp = None
+from .constants import GAZETTEER_PATH
+from .metrics import metrics
+from .gazetteer import load_gazetteer
+from .nlp_optimization import optimize_for_cpu
+from .utils import get_settings, get_rss_bytes
+
+# Loaded at startup and never evicted, other languages are loaded on first use
+default_lang = argv[1] if len(argv) > 1 and argv[1] else 'en'
+cascade_settings = None
 spacy_model_mapping = {
     'en': {
         'model': 'en_core_web_trf',
         'exclude': ['tagger', 'parser', 'attribute_ruler', 'lemmatizer'],
+        'screen_model': 'en_core_web_sm',
+        'screen_exclude': ['parser', 'lemmatizer'],
         'entity_mapping': {
             'PERSON': 'person',
             'GPE': 'location',
@@ -19,6 +29,8 @@ spacy_model_mapping = {
     'fr': {
         'model': 'fr_core_news_md',
         'exclude': ['tok2vec', 'morphologizer', 'parser', 'senter', 'attribute_ruler', 'lemmatizer'],
+        'screen_model': 'fr_core_news_sm',
+        'screen_exclude': ['parser', 'senter', 'lemmatizer'],
         'entity_mapping': {
             'PER': 'person',
             'LOC': 'location',
@@ -27,86 +39,331 @@ spacy_model_mapping = {
     }
 }
 
-geonamescache = GeonamesCache()
-countries = geonamescache.get_countries()
-cities = geonamescache.get_cities()
+gazetteer = load_gazetteer(GAZETTEER_PATH)
+# Longest location name (in words) looked up by the gazetteer screen
+SCREEN_MAX_NGRAM = 3
+cascade_stats = {
+    'screened': 0,
+    'escalated': 0,
+    'full_inference_count': 0,
+    'full_inference_total': 0.
+}
+cascade_stats_lock = threading.Lock()
 
-"""
-Functions called from TCPServer class
-"""
 
+class Pipeline:
+    def __init__(self, lang: str, nlp, screen_nlp, memory_bytes: int, optimizations: list[str]):
+        self.lang = lang
+        self.nlp = nlp
+        # Lightweight pipeline screening the utterances in cascade mode
+        self.screen_nlp = screen_nlp
+        # Estimated from the RSS growth while loading
+        self.memory_bytes = memory_bytes
+        self.last_used_at = time.time()
+
+        meta = nlp.meta
+        # Name and version of the model, to tell apart results computed by another model
+        self.model_id = f"{meta['lang']}_{meta['name']}-{meta['version']}"
+        # E.g. int8 quantization changes the results slightly
+        self.model_id += ''.join(f'+{optimization}' for optimization in optimizations)
+        if cascade_settings:
+            # The screen can skip utterances the full model would find entities in
+            self.model_id += f"+{screen_nlp.meta['name'] if screen_nlp else 'gazetteer'}-screen"
+
+    def to_dict(self) -> dict:
+        return {
+            'modelId': self.model_id,
+            'memoryBytes': self.memory_bytes,
+            'idleDuration': round(time.time() - self.last_used_at, 3)
+        }
+
+
+class PipelineRegistry:
+    """Load the spaCy pipelines per language on first use.
+    Idle pipelines are evicted after the idle timeout, least recently used first when over the memory budget.
+    The pipeline of the default language is never evicted"""
+
+    def __init__(self):
+        self.pipelines: dict[str, Pipeline] = {}
+        self.load_locks = {lang: threading.Lock() for lang in spacy_model_mapping}
+        self.lock = threading.Lock()
+
+    def get(self, lang: Optional[str] = None) -> Pipeline:
+        lang = lang or default_lang
+        if lang not in spacy_model_mapping:
+            raise ValueError(f'Unsupported language: {lang}')
+
+        pipeline = self.pipelines.get(lang)
+        if pipeline is None:
+            with self.load_locks[lang]:
+                pipeline = self.pipelines.get(lang)
+                if pipeline is None:
+                    pipeline = load_pipeline(lang)
+                    with self.lock:
+                        self.pipelines[lang] = pipeline
+
+        pipeline.last_used_at = time.time()
+        self.evict(keep_lang=lang)
+
+        return pipeline
+
+    def evict(self, keep_lang: str) -> None:
+        registry_settings = get_settings('nlp')['registry']
+        memory_budget = registry_settings['memory_budget']
+        idle_timeout = registry_settings['idle_timeout']
+        now = time.time()
+        evicted_pipelines = []
+
+        with self.lock:
+            total_memory = sum(pipeline.memory_bytes for pipeline in self.pipelines.values())
+            evictable_pipelines = sorted(
+                (pipeline for pipeline in self.pipelines.values() if pipeline.lang not in (keep_lang, default_lang)),
+                key=lambda pipeline: pipeline.last_used_at
+            )
+
+            for pipeline in evictable_pipelines:
+                is_idle = idle_timeout and now - pipeline.last_used_at > idle_timeout
+                is_over_budget = memory_budget and total_memory > memory_budget
+
+                if is_idle or is_over_budget:
+                    del self.pipelines[pipeline.lang]
+                    total_memory -= pipeline.memory_bytes
+                    evicted_pipelines.append(pipeline)
+
+        for pipeline in evicted_pipelines:
+            metrics.increment('nlp.registry.evictions')
+            log(f'Evicted the {pipeline.lang} pipeline (idle for {now - pipeline.last_used_at:.0f}s)')
+
+        if evicted_pipelines:
+            del evicted_pipelines
+            gc.collect()
 
-def load_spacy_model() -> None:
-    global spacy_nlp
+    def get_status(self) -> dict:
+        with self.lock:
+            return {lang: pipeline.to_dict() for lang, pipeline in self.pipelines.items()}
+
+
+def load_pipeline(lang: str) -> Pipeline:
+    # Not at the top, the TCP server does not need spaCy when NER runs in the worker process
+    import spacy
 
     model = spacy_model_mapping[lang]['model']
     exclude = spacy_model_mapping[lang]['exclude']
 
+    rss_before = get_rss_bytes()
     tic = time.perf_counter()
     log(f'Loading {model} spaCy model...')
-    spacy_nlp = spacy.load(model, exclude=exclude)
+    nlp = spacy.load(model, exclude=exclude)
     log('spaCy model loaded')
     toc = time.perf_counter()
     log(f"Time taken to load spaCy model: {toc - tic:0.4f} seconds")
 
+    optimizations = []
+    cpu_optimization_settings = get_settings('nlp')['cpu_optimization']
+    if cpu_optimization_settings['enabled']:
+        optimizations = optimize_for_cpu(nlp, cpu_optimization_settings)
+
+    screen_nlp = load_screen(lang) if cascade_settings else None
+    metrics.increment('nlp.registry.loads')
+
+    return Pipeline(lang, nlp, screen_nlp, max(0, get_rss_bytes() - rss_before), optimizations)
+
+
+def load_screen(lang: str):
+    if cascade_settings['screen'] != 'model':
+        log('Cascade mode: the gazetteer screens the utterances')
+        return None
 
-def delete_unneeded_country_data(data: dict) -> None:
+    import spacy
+
+    model = spacy_model_mapping[lang]['screen_model']
     try:
-        del data['geonameid']
-        del data['neighbours']
-        del data['languages']
-        del data['iso3']
-        del data['fips']
-        del data['currencyname']
-        del data['postalcoderegex']
-        del data['areakm2']
-    except BaseException:
-        pass
-
-
-def extract_spacy_entities(utterance: str) -> list[dict]:
-    doc = spacy_nlp(utterance)
+        screen_nlp = spacy.load(model, exclude=spacy_model_mapping[lang]['screen_exclude'])
+        log(f'Cascade mode: {model} screens the utterances')
+
+        return screen_nlp
+    except OSError as e:
+        log(f'Failed to load the {model} screen model, falling back to the gazetteer screen:', e)
+
+        return None
+
+
+registry = PipelineRegistry()
+
+"""
+Functions called from TCPServer class
+"""
+
+
+def load_spacy_model():
+    """Load the pipeline of the default language"""
+    global cascade_settings
+
+    if get_settings('nlp')['cascade']['enabled']:
+        cascade_settings = get_settings('nlp')['cascade']
+
+    return registry.get(default_lang).nlp
+
+
+def get_model_id(lang: Optional[str] = None) -> str:
+    return registry.get(lang).model_id
+
+
+def get_registry_status() -> dict:
+    return registry.get_status()
+
+
+def warmup_spacy_model(model) -> None:
+    model('This is a test in Paris.')
+
+
+def resolve_location(text: str) -> tuple[str, Optional[dict]]:
+    """
+    Resolve a location to a country and/or the most populated city of this name
+    :return: The entity suffix (":country", ":city" or both) and the resolution data.
+    The data is shared between utterances so it must not be mutated
+    """
+    entity_suffix = ''
+    data = None
+
+    country = gazetteer.find_country_resolution(text)
+    if country:
+        entity_suffix += ':country'
+        data = country
+
+    city_match = gazetteer.find_city_resolution(text)
+    if city_match:
+        entity_suffix += ':city'
+        population, city = city_match
+
+        if population > 0:
+            data = city
+
+    return entity_suffix, data
+
+
+def screen_with_gazetteer(utterance: str) -> bool:
+    """Rule-based screen: capitalized words are proper noun candidates,
+    except the first word of the utterance that has to be a known location"""
+    words = [word.strip(string.punctuation) for word in utterance.split()]
+    words = [word for word in words if word]
+
+    for i, word in enumerate(words):
+        if word[:1].isupper():
+            if i > 0:
+                return True
+
+            for n in range(1, min(SCREEN_MAX_NGRAM, len(words)) + 1):
+                if gazetteer.is_location_name(' '.join(words[:n])):
+                    return True
+
+    return False
+
+
+def screen_with_model(utterance: str, pipeline: Pipeline) -> bool:
+    doc = pipeline.screen_nlp(utterance)
+    entity_mapping = spacy_model_mapping[pipeline.lang]['entity_mapping']
+
+    return (any(ent.label_ in entity_mapping for ent in doc.ents)
+            # Low confidence: a proper noun the small model did not recognize as an entity
+            or any(token.pos_ == 'PROPN' for token in doc))
+
+
+def needs_full_model(utterance: str, pipeline: Pipeline) -> bool:
+    """:return: Whether the utterance may hold entities, so the full model must run on it"""
+    tic = time.perf_counter()
+
+    if not any(char.isalpha() for char in utterance):
+        is_escalated = False
+    elif cascade_settings['escalate_lowercase'] and not any(char.isupper() for char in utterance):
+        # Capitalization is what both screens rely on the most, they cannot tell for lowercased utterances
+        is_escalated = True
+    elif pipeline.screen_nlp:
+        is_escalated = screen_with_model(utterance, pipeline)
+    else:
+        is_escalated = screen_with_gazetteer(utterance)
+
+    screen_duration = (time.perf_counter() - tic) * 1000
+    metrics.observe('nlp.cascade.screen', screen_duration)
+    metrics.increment('nlp.cascade.escalated' if is_escalated else 'nlp.cascade.skipped')
+
+    with cascade_stats_lock:
+        cascade_stats['screened'] += 1
+        if is_escalated:
+            cascade_stats['escalated'] += 1
+        escalation_rate = cascade_stats['escalated'] / cascade_stats['screened']
+        full_inference_count = cascade_stats['full_inference_count']
+        full_inference_mean = cascade_stats['full_inference_total'] / full_inference_count if full_inference_count else 0
+
+    metrics.set_gauge('nlp.cascade.escalation_rate', round(escalation_rate, 4))
+    if not is_escalated and full_inference_mean > screen_duration:
+        # Estimated from the mean duration of the full model
+        metrics.add_to_gauge('nlp.cascade.saved_ms', full_inference_mean - screen_duration)
+
+    return is_escalated
+
+
+def record_full_inference(duration: float, utterances_count: int = 1) -> None:
+    with cascade_stats_lock:
+        cascade_stats['full_inference_count'] += utterances_count
+        cascade_stats['full_inference_total'] += duration
+
+
+def extract_spacy_entities(utterance: str, lang: Optional[str] = None) -> list[dict]:
+    pipeline = registry.get(lang)
+
+    if cascade_settings and not needs_full_model(utterance, pipeline):
+        return []
+
+    tic = time.perf_counter()
+    doc = pipeline.nlp(utterance)
+    duration = (time.perf_counter() - tic) * 1000
+    metrics.observe('nlp.spacy_inference', duration)
+    record_full_inference(duration)
+
+    return get_doc_entities(doc, pipeline.lang)
+
+
+def extract_spacy_entities_batch(utterances: list[str], batch_size: int, n_process: int = 1,
+                                 lang: Optional[str] = None) -> list[list[dict]]:
+    """Run the utterances through the pipeline in batches, which is much faster for transformer pipelines
+    :return: The entities of every utterance, in the same order"""
+    pipeline = registry.get(lang)
+    escalated_indexes = [
+        i for i, utterance in enumerate(utterances)
+        if not cascade_settings or needs_full_model(utterance, pipeline)
+    ]
+    entities: list[list[dict]] = [[] for _ in utterances]
+
+    if escalated_indexes:
+        tic = time.perf_counter()
+        docs = pipeline.nlp.pipe([utterances[i] for i in escalated_indexes], batch_size=batch_size, n_process=n_process)
+        for i, doc in zip(escalated_indexes, docs):
+            entities[i] = get_doc_entities(doc, pipeline.lang)
+        duration = (time.perf_counter() - tic) * 1000
+        metrics.observe('nlp.spacy_batch_inference', duration)
+        record_full_inference(duration, len(escalated_indexes))
+
+    return entities
+
+
+def get_doc_entities(doc, lang: str) -> list[dict]:
     entities: list[dict] = []
+    entity_mapping = spacy_model_mapping[lang]['entity_mapping']
 
     for ent in doc.ents:
-        if ent.label_ in spacy_model_mapping[lang]['entity_mapping']:
-            entity = spacy_model_mapping[lang]['entity_mapping'][ent.label_]
+        if ent.label_ in entity_mapping:
+            entity = entity_mapping[ent.label_]
             resolution = {
                 'value': ent.text
             }
 
             if entity == 'location':
-                for country in countries:
-                    if countries[country]['name'].casefold() == ent.text.casefold():
-                        entity += ':country'
-                        resolution['data'] = copy.deepcopy(countries[country])
-                        delete_unneeded_country_data(resolution['data'])
-                        break
-
-                city_population = 0
-                for city in cities:
-                    alternatenames = [name.casefold() for name in cities[city]['alternatenames']]
-                    if cities[city]['name'].casefold() == ent.text.casefold() or ent.text.casefold() in alternatenames:
-                        if city_population == 0:
-                            entity += ':city'
-
-                        if cities[city]['population'] > city_population:
-                            resolution['data'] = copy.deepcopy(cities[city])
-                            city_population = cities[city]['population']
-
-                            for country in countries:
-                                if countries[country]['iso'] == cities[city]['countrycode']:
-                                    resolution['data']['country'] = copy.deepcopy(countries[country])
-                                    break
-                            try:
-                                del resolution['data']['geonameid']
-                                del resolution['data']['alternatenames']
-                                del resolution['data']['admin1code']
-                                delete_unneeded_country_data(resolution['data']['country'])
-                            except BaseException:
-                                pass
-                        else:
-                            continue
+                with metrics.timer('nlp.gazetteer_lookup'):
+                    entity_suffix, data = resolve_location(ent.text)
+                entity += entity_suffix
+                if data:
+                    resolution['data'] = data
 
             entities.append({
                 'start': ent.start_char,
@@ -0,0 +1,94 @@
+"""
+CPU inference optimizations for the spaCy pipelines, see the "nlp.cpu_optimization" settings
+and bench/spacy_cpu.py for the accuracy/latency report
+"""
+
+# Components named entity recognition depends on: the shared embedding layers and the recognizer itself
+NER_COMPONENTS = ('transformer', 'tok2vec', 'ner')
+
+
+def log(*args, **kwargs):
+    print('[NLP Optimization]', *args, **kwargs)
+
+
+def disable_unneeded_components(nlp) -> list[str]:
+    """Disable every component left after the "exclude" list of the model mapping that NER does not need
+    :return: The disabled components"""
+    disabled_components = [name for name in nlp.pipe_names if name not in NER_COMPONENTS]
+
+    if disabled_components:
+        nlp.select_pipes(disable=disabled_components)
+
+    return disabled_components
+
+
+def set_torch_threads(threads: int, interop_threads: int) -> None:
+    """0 keeps the PyTorch default (one thread per physical core)"""
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op parallel work has started
+            log('Failed to set the inter-op threads:', e)
+
+
+def quantize_transformer(nlp) -> int:
+    """Replace the linear layers of the PyTorch models wrapped by the pipeline with dynamic int8 ones.
+    Models on GPU are left untouched
+    :return: The number of quantized models"""
+    import torch
+
+    quantized_count = 0
+
+    for _, component in nlp.pipeline:
+        model = getattr(component, 'model', None)
+        if model is None or not hasattr(model, 'walk'):
+            continue
+
+        for node in model.walk():
+            for shim in node.shims:
+                torch_model = getattr(shim, '_model', None)
+                if not isinstance(torch_model, torch.nn.Module):
+                    continue
+
+                parameter = next(torch_model.parameters(), None)
+                if parameter is not None and parameter.device.type != 'cpu':
+                    continue
+
+                shim._model = torch.quantization.quantize_dynamic(torch_model, {torch.nn.Linear}, dtype=torch.qint8)
+                quantized_count += 1
+
+    return quantized_count
+
+
+def optimize_for_cpu(nlp, settings: dict) -> list[str]:
+    """
+    Apply the optimizations enabled in the settings to a loaded pipeline
+    :return: Names of the applied optimizations, part of the model ID so results of another mode are not reused
+    """
+    applied_optimizations = []
+
+    disabled_components = disable_unneeded_components(nlp)
+    if disabled_components:
+        log(f'Disabled components: {", ".join(disabled_components)}')
+
+    try:
+        import torch  # noqa: F401
+    except ImportError:
+        # E.g. pipelines without transformer (fr_core_news_md) in an environment without PyTorch
+        return applied_optimizations
+
+    set_torch_threads(settings['threads'], settings['interop_threads'])
+
+    if settings['quantize']:
+        quantized_count = quantize_transformer(nlp)
+        if quantized_count:
+            log(f'Quantized {quantized_count} PyTorch model(s) to int8')
+            applied_optimizations.append('int8')
+
+    return applied_optimizations
@@ -0,0 +1,232 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from .metrics import metrics
+
+# Functions of the nlp module that can be called in the worker process
+WORKER_METHODS = {'extract_spacy_entities', 'extract_spacy_entities_batch', 'get_model_id', 'get_registry_status'}
+# The metrics recorded in the worker process (e.g. spaCy inference, cascade) are only visible through this call
+METRICS_METHOD = 'get_metrics_snapshot'
+MESSAGE_READY = 'ready'
+MESSAGE_FAILED = 'failed'
+
+
+class NLPWorkerError(Exception):
+    pass
+
+
+def run_worker(connection, default_lang: str, cpu_affinity: list[int]) -> None:
+    """Entry point of the worker process: load the spaCy model and the gazetteer, then serve calls one by one"""
+    if cpu_affinity and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpu_affinity)
+
+    try:
+        from . import nlp
+
+        # The nlp module reads it from the command line, which is not the server's one in a frozen worker
+        # (e.g. "--multiprocessing-fork")
+        nlp.default_lang = default_lang
+        model = nlp.load_spacy_model()
+        nlp.warmup_spacy_model(model)
+    except Exception as e:
+        connection.send((MESSAGE_FAILED, str(e)))
+        return
+
+    methods = {method_name: getattr(nlp, method_name) for method_name in WORKER_METHODS}
+    methods[METRICS_METHOD] = metrics.snapshot
+    connection.send((MESSAGE_READY, nlp.get_model_id()))
+
+    while True:
+        try:
+            call_id, method_name, args = connection.recv()
+        except (EOFError, OSError):
+            # The TCP server is gone
+            break
+
+        try:
+            if method_name not in methods:
+                raise NLPWorkerError(f'Unknown method: {method_name}')
+
+            connection.send((call_id, True, methods[method_name](*args)))
+        except Exception as e:
+            connection.send((call_id, False, f'{type(e).__name__}: {e}'))
+
+
+class NLPWorker:
+    """Host the spaCy pipeline and the gazetteer in a dedicated process, so NER does not contend
+    for the GIL with ASR and TTS. Calls go through a pipe and the process is restarted if it crashes.
+    Exposes the same functions as the nlp module"""
+
+    def __init__(self, default_lang: str, cpu_affinity: list[int], restart_delay: float, call_timeout: float,
+                 on_crash: Optional[Callable[[str], None]] = None,
+                 on_restart: Optional[Callable[[], None]] = None):
+        """:param call_timeout: A worker that does not answer in time is considered stuck and restarted (in seconds)"""
+        self.default_lang = default_lang
+        self.cpu_affinity = cpu_affinity
+        self.restart_delay = restart_delay
+        self.call_timeout = call_timeout
+        self.on_crash = on_crash
+        self.on_restart = on_restart
+        # Spawn rather than fork, the TCP server has threads and CUDA state that must not be inherited
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.connection = None
+        # Of the default language
+        self.model_id = None
+        # Language -> model ID of the pipelines loaded on first use
+        self.model_ids: dict[str, str] = {}
+        self.call_ids = itertools.count(1)
+        self.pending: dict[int, Future] = {}
+        self.lock = threading.Lock()
+        self.reader_thread = None
+        self.is_closed = False
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[NLP Worker]', *args, **kwargs)
+
+    def start(self) -> 'NLPWorker':
+        """Start the worker process and block until its model is loaded"""
+        connection, child_connection = self.context.Pipe()
+        process = self.context.Process(target=run_worker,
+                                       args=(child_connection, self.default_lang, self.cpu_affinity),
+                                       name='leon-nlp-worker', daemon=True)
+        process.start()
+        child_connection.close()
+
+        while not connection.poll(0.5):
+            if not process.is_alive():
+                raise NLPWorkerError(f'NLP worker exited with code {process.exitcode} while loading')
+
+        message_type, value = connection.recv()
+        if message_type == MESSAGE_FAILED:
+            process.join()
+            raise NLPWorkerError(f'NLP worker failed to load: {value}')
+
+        self.process = process
+        self.connection = connection
+        self.model_id = value
+        self.log(f'Started process {process.pid} with {value}'
+                 + (f' on CPU(s) {self.cpu_affinity}' if self.cpu_affinity else ''))
+
+        self.reader_thread = threading.Thread(target=self.read_results, args=(connection,),
+                                              name='nlp-worker-reader', daemon=True)
+        self.reader_thread.start()
+
+        return self
+
+    def read_results(self, connection) -> None:
+        while True:
+            try:
+                call_id, is_success, result = connection.recv()
+            except (EOFError, OSError):
+                break
+
+            with self.lock:
+                future = self.pending.pop(call_id, None)
+
+            if future:
+                if is_success:
+                    future.set_result(result)
+                else:
+                    future.set_exception(NLPWorkerError(result))
+
+        if not self.is_closed:
+            self.handle_crash()
+
+    def handle_crash(self) -> None:
+        self.process.join(timeout=1)
+        error = f'NLP worker process {self.process.pid} exited with code {self.process.exitcode}'
+        self.log(f'{error}, restarting it...')
+
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.model_id = None
+            self.model_ids.clear()
+
+        for future in pending:
+            future.set_exception(NLPWorkerError(error))
+
+        if self.on_crash:
+            self.on_crash(error)
+
+        while not self.is_closed:
+            time.sleep(self.restart_delay)
+
+            try:
+                self.start()
+            except Exception as e:
+                self.log('Failed to restart:', e)
+                continue
+
+            metrics.increment('nlp.worker.restarts')
+            if self.on_restart:
+                self.on_restart()
+            break
+
+    def call(self, method_name: str, *args) -> Any:
+        future = Future()
+
+        with self.lock:
+            if self.model_id is None:
+                raise NLPWorkerError('NLP worker is not running')
+
+            call_id = next(self.call_ids)
+            self.pending[call_id] = future
+            process = self.process
+            # Connection.send() is not thread-safe
+            self.connection.send((call_id, method_name, args))
+
+        with metrics.timer('nlp.worker.call'):
+            try:
+                return future.result(timeout=self.call_timeout)
+            except TimeoutError:
+                pass
+
+        with self.lock:
+            self.pending.pop(call_id, None)
+
+        error = f'NLP worker process {process.pid} did not answer {method_name} within {self.call_timeout} seconds'
+        self.log(f'{error}, killing it...')
+        metrics.increment('nlp.worker.timeouts')
+        # Closes the pipe, so the reader thread restarts the worker like after a crash
+        process.terminate()
+
+        raise NLPWorkerError(error)
+
+    def get_model_id(self, lang: Optional[str] = None) -> Optional[str]:
+        """None for the default language while the worker restarts"""
+        if not lang or lang == self.default_lang:
+            return self.model_id
+
+        model_id = self.model_ids.get(lang)
+        if model_id is None:
+            model_id = self.call('get_model_id', lang)
+            self.model_ids[lang] = model_id
+
+        return model_id
+
+    def get_registry_status(self) -> dict:
+        return self.call('get_registry_status')
+
+    def extract_spacy_entities(self, utterance: str, lang: Optional[str] = None) -> list[dict]:
+        return self.call('extract_spacy_entities', utterance, lang)
+
+    def extract_spacy_entities_batch(self, utterances: list[str], batch_size: int, n_process: int = 1,
+                                     lang: Optional[str] = None) -> list[list[dict]]:
+        return self.call('extract_spacy_entities_batch', utterances, batch_size, n_process, lang)
+
+    def get_metrics_snapshot(self) -> dict:
+        return self.call(METRICS_METHOD)
+
+    def close(self) -> None:
+        self.is_closed = True
+
+        if self.process:
+            self.process.terminate()
@@ -0,0 +1,106 @@
+import json
+import struct
+from typing import NamedTuple, Union
+
+"""
+Wire protocol between the core and the TCP server.
+
+Every message is a frame made of a fixed-size header followed by the payload:
+
+    | payload length (uint32) | request id (uint32) | message type (uint8) | payload |
+
+All header fields are big-endian. The request id is chosen by the client and is
+echoed back on every reply, so several requests can be in flight on one connection.
+Messages that are not a reply to a request (e.g. ASR events) use the request id 0
+"""
+
+HEADER_FORMAT = '!IIB'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# Refuse frames bigger than this to avoid buffering garbage forever on a desynced stream
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+MESSAGE_TYPE_JSON = 1
+MESSAGE_TYPE_BINARY = 2
+
+UNSOLICITED_REQUEST_ID = 0
+# Progress messages sent with the request id before the final reply of a request,
+# the client must not settle the request on them. Keep in sync with server/src/core/tcp-client.ts
+INTERMEDIATE_TOPICS = {
+    'tts-job-queued',
+    'tts-stream-started',
+    'tts-audio-chunk-written'
+}
+
+"""
+Binary audio chunks (e.g. streamed TTS) carry their own small header before the PCM data:
+
+    | sequence number (uint32) | flags (uint8) | PCM data |
+
+The last chunk of a stream has the end-of-stream flag set and may have no PCM data
+"""
+AUDIO_CHUNK_HEADER_FORMAT = '!IB'
+AUDIO_CHUNK_HEADER_SIZE = struct.calcsize(AUDIO_CHUNK_HEADER_FORMAT)
+AUDIO_CHUNK_FLAG_END_OF_STREAM = 1
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Frame(NamedTuple):
+    request_id: int
+    message_type: int
+    payload: bytes
+
+    def json(self) -> dict:
+        return json.loads(self.payload)
+
+
+def encode_frame(payload: bytes, request_id: int = UNSOLICITED_REQUEST_ID,
+                 message_type: int = MESSAGE_TYPE_BINARY) -> bytes:
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f'Payload of {len(payload)} bytes exceeds the maximum of {MAX_PAYLOAD_SIZE} bytes')
+
+    return struct.pack(HEADER_FORMAT, len(payload), request_id, message_type) + payload
+
+
+def encode_json_frame(data: Union[dict, list], request_id: int = UNSOLICITED_REQUEST_ID) -> bytes:
+    return encode_frame(json.dumps(data).encode('utf-8'), request_id, MESSAGE_TYPE_JSON)
+
+
+def encode_audio_chunk(sequence: int, pcm: bytes = b'', is_end_of_stream: bool = False) -> bytes:
+    flags = AUDIO_CHUNK_FLAG_END_OF_STREAM if is_end_of_stream else 0
+
+    return struct.pack(AUDIO_CHUNK_HEADER_FORMAT, sequence, flags) + pcm
+
+
+class FrameDecoder:
+    """Incrementally decode frames from a byte stream.
+    Handle partial reads (a frame split across several recv calls)
+    and coalesced frames (several frames in one recv call)"""
+
+    def __init__(self, max_payload_size: int = MAX_PAYLOAD_SIZE):
+        self.max_payload_size = max_payload_size
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[Frame]:
+        self.buffer.extend(data)
+        frames: list[Frame] = []
+
+        while len(self.buffer) >= HEADER_SIZE:
+            payload_size, request_id, message_type = struct.unpack_from(HEADER_FORMAT, self.buffer)
+
+            if payload_size > self.max_payload_size:
+                raise ProtocolError(f'Frame of {payload_size} bytes exceeds the maximum of {self.max_payload_size} bytes')
+            if message_type not in (MESSAGE_TYPE_JSON, MESSAGE_TYPE_BINARY):
+                raise ProtocolError(f'Unknown message type: {message_type}')
+
+            frame_size = HEADER_SIZE + payload_size
+            if len(self.buffer) < frame_size:
+                break
+
+            payload = bytes(self.buffer[HEADER_SIZE:frame_size])
+            del self.buffer[:frame_size]
+            frames.append(Frame(request_id, message_type, payload))
+
+        return frames
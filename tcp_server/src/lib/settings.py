@@ -0,0 +1,313 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from .constants import SETTINGS_PATH
+
+NUMBER = (int, float)
+OPTIONAL_STRING = (str, type(None))
+
+"""
+Expected shape of settings.json.
+A dict describes a nested object, a type (or tuple of types) describes a value
+"""
+SETTINGS_SCHEMA = {
+    'tcp_server': {
+        'model_ready_timeout': NUMBER,
+        'metrics': {
+            'dump_path': OPTIONAL_STRING,
+            'dump_interval': NUMBER
+        },
+        'executors': dict,
+        'topic_concurrency': dict
+    },
+    'nlp': {
+        'batch_size': int,
+        'n_process': int,
+        'micro_batching': {
+            'window': NUMBER,
+            'max_size': int
+        },
+        'entity_cache': {
+            'max_size': int,
+            'persist_path': OPTIONAL_STRING,
+            'save_interval': NUMBER
+        },
+        'cascade': {
+            'enabled': bool,
+            'screen': str,
+            'escalate_lowercase': bool
+        },
+        'cpu_optimization': {
+            'enabled': bool,
+            'quantize': bool,
+            'threads': int,
+            'interop_threads': int
+        },
+        'registry': {
+            'memory_budget': int,
+            'idle_timeout': NUMBER
+        },
+        'worker': {
+            'enabled': bool,
+            'cpu_affinity': list,
+            'restart_delay': NUMBER,
+            'call_timeout': NUMBER
+        }
+    },
+    'asr': {
+        'rms_mic_threshold': NUMBER,
+        'device': str
+    },
+    'tts': {
+        'model_file_name': str,
+        'device': str,
+        'batch_size': int,
+        'frontend_lookahead': int,
+        'phrase_cache': {
+            'enabled': bool,
+            'memory_max_bytes': int,
+            'directory': OPTIONAL_STRING,
+            'disk_max_bytes': int
+        },
+        'presynthesis': {
+            'enabled': bool,
+            'delay': NUMBER
+        },
+        'worker_pool': {
+            'enabled': bool,
+            'size': int,
+            'threads_per_worker': int,
+            'min_pieces': int
+        },
+        'audio_store': {
+            'directory': OPTIONAL_STRING,
+            'max_bytes': int,
+            'max_files': int,
+            'unacknowledged_ttl': NUMBER
+        }
+    },
+    'wake_word': dict
+}
+"""
+Values of the keys missing from settings.json, e.g. a settings file of a previous version.
+Keep in sync with settings.json
+"""
+DEFAULT_SETTINGS = {
+    'tcp_server': {
+        'model_ready_timeout': 120,
+        'metrics': {
+            'dump_path': None,
+            'dump_interval': 60
+        },
+        'executors': {
+            'nlp': 8,
+            'tts': 4,
+            'asr': 1,
+            'control': 1
+        },
+        'topic_concurrency': {
+            'get-spacy-entities': 8,
+            'get-spacy-entities-batch': 1,
+            'tts-synthesize': 2,
+            'tts-synthesize-stream': 2,
+            'asr-start-recording': 1,
+            'leon-speech-audio-ended': 4
+        }
+    },
+    'nlp': {
+        'batch_size': 32,
+        'n_process': 1,
+        'micro_batching': {
+            'window': 0,
+            'max_size': 8
+        },
+        'entity_cache': {
+            'max_size': 2048,
+            'persist_path': None,
+            'save_interval': 300
+        },
+        'cascade': {
+            'enabled': False,
+            'screen': 'model',
+            'escalate_lowercase': True
+        },
+        'cpu_optimization': {
+            'enabled': False,
+            'quantize': True,
+            'threads': 0,
+            'interop_threads': 0
+        },
+        'registry': {
+            'memory_budget': 0,
+            'idle_timeout': 1800
+        },
+        'worker': {
+            'enabled': False,
+            'cpu_affinity': [],
+            'restart_delay': 1,
+            'call_timeout': 60
+        }
+    },
+    'asr': {
+        'rms_mic_threshold': 196,
+        'device': 'auto'
+    },
+    'tts': {
+        'model_file_name': 'EN-Leon-V1_1-G_600000.pth',
+        'device': 'auto',
+        'batch_size': 1,
+        'frontend_lookahead': 2,
+        'phrase_cache': {
+            'enabled': False,
+            'memory_max_bytes': 67108864,
+            'directory': None,
+            'disk_max_bytes': 536870912
+        },
+        'presynthesis': {
+            'enabled': False,
+            'delay': 30
+        },
+        'worker_pool': {
+            'enabled': False,
+            'size': 2,
+            'threads_per_worker': 0,
+            'min_pieces': 4
+        },
+        'audio_store': {
+            'directory': None,
+            'max_bytes': 268435456,
+            'max_files': 256,
+            'unacknowledged_ttl': 600
+        }
+    },
+    'wake_word': {}
+}
+# How often the settings file is checked for changes (in seconds)
+WATCH_INTERVAL = 2
+
+
+class SettingsValidationError(Exception):
+    pass
+
+
+def merge_settings(defaults: Any, settings: Any) -> Any:
+    """The settings over the defaults, object by object"""
+    if not isinstance(defaults, dict) or not isinstance(settings, dict):
+        return settings
+
+    merged_settings = dict(defaults)
+    for key, value in settings.items():
+        merged_settings[key] = merge_settings(defaults.get(key), value)
+
+    return merged_settings
+
+
+def validate_settings(settings: Any, schema: Any, path: str = 'settings') -> None:
+    if isinstance(schema, dict):
+        if not isinstance(settings, dict):
+            raise SettingsValidationError(f'{path} must be an object')
+
+        for key, value_schema in schema.items():
+            if key not in settings:
+                raise SettingsValidationError(f'{path}.{key} is missing')
+            validate_settings(settings[key], value_schema, f'{path}.{key}')
+    # bool is a subclass of int, but e.g. true is not a valid size
+    elif not isinstance(settings, schema) or (isinstance(settings, bool) and not is_bool_allowed(schema)):
+        raise SettingsValidationError(f'{path} has an invalid type: {type(settings).__name__}')
+
+
+def is_bool_allowed(schema: Any) -> bool:
+    return schema is bool or (isinstance(schema, tuple) and bool in schema)
+
+
+class Settings:
+    """Parse and validate the settings file once, then only reload it when it changes on disk.
+    Subscribers are notified with the new and old values of the section they subscribed to"""
+
+    def __init__(self, path: str, schema: dict, defaults: dict):
+        self.path = path
+        self.schema = schema
+        self.defaults = defaults
+        self.lock = threading.Lock()
+        self.subscribers: dict[str, list[Callable[[Any, Any], None]]] = {}
+        self.watcher_thread = None
+        self.mtime = None
+        self.settings = {}
+        self.load()
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Settings]', *args, **kwargs)
+
+    def load(self) -> dict:
+        mtime = os.path.getmtime(self.path)
+
+        with open(self.path) as f:
+            settings = merge_settings(self.defaults, json.load(f))
+
+        validate_settings(settings, self.schema)
+
+        with self.lock:
+            self.mtime = mtime
+            self.settings = settings
+
+        return settings
+
+    def get(self, key: str) -> Any:
+        return self.settings[key]
+
+    def subscribe(self, key: str, callback: Callable[[Any, Any], None]) -> None:
+        with self.lock:
+            self.subscribers.setdefault(key, []).append(callback)
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            self.log('Failed to check settings:', e)
+            return False
+
+        if mtime == self.mtime:
+            return False
+
+        old_settings = self.settings
+        try:
+            new_settings = self.load()
+        except (OSError, ValueError, SettingsValidationError) as e:
+            # Keep the previous settings (e.g. the file is being edited) and wait for the next change
+            self.log('Failed to reload settings:', e)
+            self.mtime = mtime
+            return False
+
+        self.log('Settings reloaded')
+
+        with self.lock:
+            subscribers = {key: list(callbacks) for key, callbacks in self.subscribers.items()}
+
+        for key, callbacks in subscribers.items():
+            if new_settings.get(key) != old_settings.get(key):
+                for callback in callbacks:
+                    try:
+                        callback(new_settings.get(key), old_settings.get(key))
+                    except Exception as e:
+                        self.log(f'Failed to notify subscriber of "{key}":', e)
+
+        return True
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        if self.watcher_thread:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.reload_if_changed()
+
+        self.watcher_thread = threading.Thread(target=run, name='settings-watcher', daemon=True)
+        self.watcher_thread.start()
+
+
+settings = Settings(SETTINGS_PATH, SETTINGS_SCHEMA, DEFAULT_SETTINGS)
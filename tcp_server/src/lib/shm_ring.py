@@ -0,0 +1,146 @@
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+"""
+Single-producer single-consumer byte ring buffer in shared memory,
+used to move PCM between the core and the TCP server without going through a socket or the filesystem.
+
+Layout of the shared memory block:
+
+    | capacity (uint64) | write position (uint64) | read position (uint64) | data (capacity bytes) |
+
+Header fields are little-endian. Positions are monotonic: the physical index is position % capacity.
+Only the producer moves the write position and only the consumer moves the read position.
+On Linux the block is also reachable as /dev/shm/<name> for consumers that cannot map POSIX shared memory
+"""
+
+HEADER_FORMAT = '<QQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+WRITE_POSITION_OFFSET = 8
+READ_POSITION_OFFSET = 16
+
+
+class RingBufferFullError(Exception):
+    pass
+
+
+class SharedMemoryRingBuffer:
+    def __init__(self, name: str, capacity: int = 0, create: bool = False):
+        """
+        :param name: Shared memory block name
+        :param capacity: Size of the data area in bytes. Only needed when creating the block
+        :param create: Create the block (owner side) or attach to an existing one
+        """
+        if create:
+            try:
+                # Remove a block left over by a previous run that did not exit cleanly
+                stale_block = shared_memory.SharedMemory(name=name)
+                stale_block.close()
+                stale_block.unlink()
+            except FileNotFoundError:
+                pass
+
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity)
+            struct.pack_into(HEADER_FORMAT, self.shm.buf, 0, capacity, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.name = name
+        self.is_owner = create
+        # Read from the header because the OS may round the block size up to a page size
+        self.capacity = struct.unpack_from('<Q', self.shm.buf, 0)[0]
+
+    @property
+    def write_position(self) -> int:
+        return struct.unpack_from('<Q', self.shm.buf, WRITE_POSITION_OFFSET)[0]
+
+    @property
+    def read_position(self) -> int:
+        return struct.unpack_from('<Q', self.shm.buf, READ_POSITION_OFFSET)[0]
+
+    @property
+    def available(self) -> int:
+        """Number of bytes written and not read yet"""
+        return self.write_position - self.read_position
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+    def write(self, data: bytes) -> int:
+        """
+        Write all the data or nothing
+        :return: The position of the first written byte, to tell the consumer where to read from
+        """
+        size = len(data)
+        if size > self.free:
+            raise RingBufferFullError(f'{size} bytes to write but only {self.free} bytes free')
+
+        position = self.write_position
+        start = position % self.capacity
+        first_part_size = min(size, self.capacity - start)
+
+        self.shm.buf[HEADER_SIZE + start:HEADER_SIZE + start + first_part_size] = data[:first_part_size]
+        if first_part_size < size:
+            self.shm.buf[HEADER_SIZE:HEADER_SIZE + size - first_part_size] = data[first_part_size:]
+
+        # Publish the data only once it is fully copied
+        struct.pack_into('<Q', self.shm.buf, WRITE_POSITION_OFFSET, position + size)
+
+        return position
+
+    def read(self, max_size: int) -> bytes:
+        size = min(max_size, self.available)
+        position = self.read_position
+        start = position % self.capacity
+        first_part_size = min(size, self.capacity - start)
+
+        data = bytes(self.shm.buf[HEADER_SIZE + start:HEADER_SIZE + start + first_part_size])
+        if first_part_size < size:
+            data += bytes(self.shm.buf[HEADER_SIZE:HEADER_SIZE + size - first_part_size])
+
+        struct.pack_into('<Q', self.shm.buf, READ_POSITION_OFFSET, position + size)
+
+        return data
+
+    def read_exactly(self, size: int, poll_interval: float = 0.005, timeout: Optional[float] = None) -> bytes:
+        """Block until the given number of bytes is available"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        while self.available < size:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'Only {self.available} of {size} bytes available')
+            time.sleep(poll_interval)
+
+        return self.read(size)
+
+    def close(self) -> None:
+        self.shm.close()
+
+        if self.is_owner:
+            self.shm.unlink()
+
+
+class SharedMemoryAudioInput:
+    """Drop-in replacement for a PyAudio input stream reading PCM written by another process in a ring buffer"""
+
+    def __init__(self, ring_buffer: SharedMemoryRingBuffer, sample_width: int = 2, channels: int = 1):
+        self.ring_buffer = ring_buffer
+        self.frame_size = sample_width * channels
+
+    def read(self, frames_count: int, exception_on_overflow: bool = True) -> bytes:
+        size = frames_count * self.frame_size
+
+        try:
+            return self.ring_buffer.read_exactly(size, timeout=0.5)
+        except TimeoutError:
+            # Nothing written by the producer, consider it as silence so the recording loop keeps going
+            return bytes(size)
+
+    def stop_stream(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
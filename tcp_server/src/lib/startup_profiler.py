@@ -0,0 +1,152 @@
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class StartupProfiler:
+    """Time the first import of every module (like "python -X importtime") and the startup phases.
+    Installed by main.py when LEON_PY_TCP_SERVER_PROFILE_STARTUP=true, so it costs nothing otherwise.
+    Only "import" statements are seen: modules loaded with importlib (e.g. spaCy model packages)
+    count in the time of the importing module or phase"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.is_enabled = False
+        self.original_import = None
+        # Module name -> [inclusive duration, self duration, thread name] (ms)
+        self.imports: dict[str, list] = {}
+        # (phase name, start offset, duration) (ms)
+        self.phases: list[tuple[str, float, float]] = []
+        self.lock = threading.Lock()
+        # Per thread stack of the time spent in nested imports, to compute the self durations
+        self.local = threading.local()
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Startup Profiler]', *args, **kwargs)
+
+    def enable(self) -> None:
+        if self.is_enabled:
+            return
+
+        self.is_enabled = True
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.profiled_import
+
+    def disable(self) -> None:
+        if self.is_enabled:
+            builtins.__import__ = self.original_import
+            self.is_enabled = False
+
+    def profiled_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        try:
+            module_name = importlib.util.resolve_name('.' * level + name, globals['__package__']) if level else name
+        except (ImportError, KeyError, TypeError, ValueError):
+            module_name = name
+
+        # E.g. "from . import nlp" imports the submodule through the fromlist
+        submodule_names = [f'{module_name}.{item}' for item in fromlist or () if item != '*']
+        is_new = module_name not in sys.modules
+        new_submodule_names = [submodule_name for submodule_name in submodule_names
+                               if submodule_name not in sys.modules]
+
+        if not is_new and not new_submodule_names:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        stack.append(0.)
+        tic = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            duration = (time.perf_counter() - tic) * 1000
+            nested_duration = stack.pop()
+            if stack:
+                stack[-1] += duration
+
+            if not is_new:
+                # Only keep the submodules, not the names imported from the module
+                new_submodule_names = [submodule_name for submodule_name in new_submodule_names
+                                       if submodule_name in sys.modules]
+            label = module_name if is_new else ', '.join(new_submodule_names) or module_name
+
+            with self.lock:
+                self.imports.setdefault(label, [duration, duration - nested_duration,
+                                                threading.current_thread().name])
+
+    @contextmanager
+    def phase(self, name: str):
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, tic, time.perf_counter())
+
+    def add_phase(self, name: str, start: float, end: float) -> None:
+        with self.lock:
+            self.phases.append((name,
+                                round((start - self.started_at) * 1000, 1),
+                                round((end - start) * 1000, 1)))
+
+    def get_report(self, models_status: Optional[dict] = None, limit: int = 20) -> dict:
+        with self.lock:
+            imports = [
+                {
+                    'module': module_name,
+                    'inclusive': round(inclusive_duration, 1),
+                    'self': round(self_duration, 1),
+                    'thread': thread_name
+                }
+                for module_name, (inclusive_duration, self_duration, thread_name) in self.imports.items()
+            ]
+            phases = list(self.phases)
+
+        return {
+            'totalDuration': round((time.perf_counter() - self.started_at) * 1000, 1),
+            'importsCount': len(imports),
+            'phases': [{'name': name, 'start': start, 'duration': duration} for name, start, duration in phases],
+            'models': {
+                name: {
+                    'state': status['state'],
+                    'loadDuration': round(status['loadDuration'] * 1000, 1) if status['loadDuration'] else None,
+                    'warmupDuration': round(status['warmupDuration'] * 1000, 1) if status['warmupDuration'] else None
+                }
+                for name, status in (models_status or {}).items()
+            },
+            'slowestImports': sorted(imports, key=lambda i: i['inclusive'], reverse=True)[:limit],
+            'slowestSelfImports': sorted(imports, key=lambda i: i['self'], reverse=True)[:limit]
+        }
+
+    def print_report(self, models_status: Optional[dict] = None, limit: int = 20) -> dict:
+        report = self.get_report(models_status, limit)
+
+        lines = [f"Startup took {report['totalDuration']} ms, {report['importsCount']} module(s) imported", 'Phases:']
+        for phase in report['phases']:
+            lines.append(f"  {phase['name']:<32}{phase['duration']:>10} ms (at {phase['start']} ms)")
+
+        lines.append('Models:')
+        for name, status in report['models'].items():
+            lines.append(f"  {name:<32}{status['state']:<10} load: {status['loadDuration']} ms, "
+                         f"warmup: {status['warmupDuration']} ms")
+
+        lines.append('Slowest imports (self ms, inclusive ms, thread):')
+        for module in report['slowestImports']:
+            lines.append(f"  {module['module']:<48}{module['self']:>10}{module['inclusive']:>10}  {module['thread']}")
+
+        lines.append('Slowest imports by self duration (self ms, inclusive ms, thread):')
+        for module in report['slowestSelfImports']:
+            lines.append(f"  {module['module']:<48}{module['self']:>10}{module['inclusive']:>10}  {module['thread']}")
+
+        self.log('\n'.join(lines), flush=True)
+
+        return report
+
+
+startup_profiler = StartupProfiler()
@@ -1,73 +1,483 @@
-import socket
-import json
+import asyncio
+import contextvars
 import os
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Union
 import time
 import re
 import string
 import threading
+from typing import TYPE_CHECKING
 
 import lib.nlp as nlp
-from .utils import get_settings
-from .asr.api import ASR
-from .tts.api import TTS
+from .utils import get_settings, get_rss_bytes
+from .settings import settings
+from .protocol import (
+    FrameDecoder,
+    ProtocolError,
+    MESSAGE_TYPE_JSON,
+    UNSOLICITED_REQUEST_ID,
+    encode_frame,
+    encode_json_frame,
+    encode_audio_chunk
+)
+from .metrics import metrics, MetricsDumper
+from .model_loader import ModelLoader, MODEL_STATE_LOADING, MODEL_STATE_READY
+from .traffic_recorder import TrafficRecorder
+from .audio_store import AudioStore
+from .micro_batcher import MicroBatcher
+from .entity_cache import EntityCache
+from .nlp_worker import NLPWorker, NLPWorkerError
+from .shm_ring import SharedMemoryRingBuffer, RingBufferFullError
+from .tts.jobs import TTSJobQueue, PRIORITIES, PRIORITY_NORMAL
 from .constants import (
     TTS_MODEL_CONFIG_PATH,
     TTS_MODEL_FOLDER_PATH,
     IS_TTS_ENABLED,
     TMP_PATH,
-    IS_ASR_ENABLED
+    SKILLS_PATH,
+    GLOBAL_DATA_PATH,
+    IS_ASR_ENABLED,
+    UNIX_SOCKET_PATH,
+    AUDIO_TRANSPORT,
+    TTS_AUDIO_SHM_NAME,
+    SHM_CAPACITY,
+    TRAFFIC_RECORD_PATH
 )
 
+if TYPE_CHECKING:
+    # Imported when their model loads, so a disabled ASR or TTS does not import PyTorch, Whisper, etc.
+    from .asr.api import ASR
+    from .tts.api import TTS
+    from .tts.phrase_cache import PhraseCache
+    from .tts.worker_pool import TTSWorkerPool
+
 TTS_MODEL_PATH = os.path.join(TTS_MODEL_FOLDER_PATH, get_settings('tts')['model_file_name'])
 
+"""
+Each topic runs on the executor of its subsystem,
+so a slow model (e.g. TTS) does not stall the others (e.g. NLP)
+"""
+# The topics clients can call, other methods of the server must not be reachable from the socket
+TOPIC_SUBSYSTEMS = {
+    'get_spacy_entities': 'nlp',
+    'get_spacy_entities_batch': 'nlp',
+    'tts_synthesize': 'tts',
+    'tts_synthesize_stream': 'tts',
+    # Must never wait behind synthesis requests
+    'tts_cancel': 'control',
+    'tts_audio_acknowledged': 'control',
+    'server_status': 'control',
+    'server_metrics': 'control',
+    'asr_start_recording': 'asr',
+    'leon_speech_audio_ended': 'asr'
+}
+
+
+class Request(NamedTuple):
+    request_id: int
+    writer: asyncio.StreamWriter
+
+
+# Request being handled, for topic handlers that need to send more than one reply (e.g. streaming)
+current_request: contextvars.ContextVar[Request] = contextvars.ContextVar('current_request')
+
 
 class TCPServer:
     def __init__(self, host: str, port: Union[str, int]):
         self.host = host
         self.port = port
-        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn = None
-        self.addr = None
+        self.loop = None
+        self.clients = set()
+        self.sessions_count = 0
+        self.traffic_recorder = TrafficRecorder(TRAFFIC_RECORD_PATH) if TRAFFIC_RECORD_PATH else None
+        self.executors = {}
+        self.topic_semaphores = {}
         self.tts = None
+        self.tts_phrase_cache = None
+        self.tts_presynthesizer = None
+        self.tts_worker_pool = None
+        self.tts_jobs = TTSJobQueue()
+        self.tts_audio_ring = None
+        # The ring has a single reader position, so only one stream at a time can use it
+        self.tts_audio_ring_lock = threading.Lock()
+        self.audio_store = self.init_audio_store()
+        # The nlp module itself, or an NLPWorker exposing the same functions from another process
+        self.nlp_backend = nlp
+        self.nlp_worker = None
+        self.spacy_batcher = self.init_spacy_batcher(get_settings('nlp')['micro_batching'])
+        settings.subscribe('nlp', self.on_nlp_settings_change)
+        self.entity_cache = self.init_entity_cache()
         self.asr = None
         self.asr_recording_thread = None
+        self.model_loader = ModelLoader(self.on_model_state_change)
 
     @staticmethod
     def log(*args, **kwargs):
         print('[TCP Server]', *args, **kwargs)
 
-    def send_tcp_message(self, data: dict):
-        if not self.conn:
+    def send_tcp_message(self, data: dict, request_id: int = UNSOLICITED_REQUEST_ID, writer=None):
+        """Send a message to one client, or broadcast it to all clients if none is given.
+        Safe to call from any thread (ASR callbacks, executors)"""
+        if not self.loop or not self.clients:
             self.log('No client connection found. Cannot send message')
             return
 
-        self.conn.sendall(json.dumps(data).encode('utf-8'))
+        frame = encode_json_frame(data, request_id)
+        self.loop.call_soon_threadsafe(self.write_frame, frame, writer)
 
-    def init_tts(self):
-        if not IS_TTS_ENABLED:
-            self.log('TTS is disabled')
+    def send_binary_message(self, payload: bytes, request_id: int = UNSOLICITED_REQUEST_ID, writer=None):
+        if not self.loop or not self.clients:
+            self.log('No client connection found. Cannot send message')
             return
 
-        if not os.path.exists(TTS_MODEL_CONFIG_PATH):
-            self.log(f'TTS model config not found at {TTS_MODEL_CONFIG_PATH}')
+        frame = encode_frame(payload, request_id)
+        self.loop.call_soon_threadsafe(self.write_frame, frame, writer)
+
+    def write_frame(self, frame: bytes, writer=None) -> None:
+        writers = [writer] if writer else list(self.clients)
+
+        for client_writer in writers:
+            if not client_writer.is_closing():
+                client_writer.write(frame)
+
+    def init_audio_store(self) -> AudioStore:
+        audio_store_settings = get_settings('tts')['audio_store']
+        # Can be set to a tmpfs directory (e.g. /dev/shm/leon) to keep audio files off the disk
+        audio_store = AudioStore(audio_store_settings['directory'] or TMP_PATH,
+                                 max_bytes=audio_store_settings['max_bytes'],
+                                 max_files=audio_store_settings['max_files'],
+                                 unacknowledged_ttl=audio_store_settings['unacknowledged_ttl'])
+        audio_store.clean_up()
+
+        return audio_store
+
+    def init_entity_cache(self) -> EntityCache:
+        entity_cache_settings = get_settings('nlp')['entity_cache']
+        entity_cache = EntityCache(entity_cache_settings['max_size'], entity_cache_settings['persist_path'])
+        entity_cache.load()
+        entity_cache.start_autosave(entity_cache_settings['save_interval'])
+
+        return entity_cache
+
+    def init_spacy_batcher(self, micro_batching_settings: dict) -> Union[MicroBatcher, None]:
+        """Concurrent "get-spacy-entities" requests arriving within the window share one forward pass.
+        Disabled when the window is 0 (the default): every request would wait for the window, and a single thread
+        would run all the NER instead of the NLP executor threads. Can be enabled without restarting"""
+        if not micro_batching_settings['window']:
+            return None
+
+        return MicroBatcher('nlp', self.extract_spacy_entities_micro_batch,
+                            window=micro_batching_settings['window'],
+                            max_size=micro_batching_settings['max_size'])
+
+    def on_nlp_settings_change(self, nlp_settings, old_nlp_settings) -> None:
+        micro_batching_settings = nlp_settings['micro_batching']
+
+        if self.spacy_batcher:
+            # A window of 0 bypasses the batcher, its thread then stays idle until it is enabled again
+            self.spacy_batcher.window = micro_batching_settings['window']
+            self.spacy_batcher.max_size = micro_batching_settings['max_size']
+        elif micro_batching_settings['window']:
+            self.spacy_batcher = self.init_spacy_batcher(micro_batching_settings)
+
+    def extract_spacy_entities_micro_batch(self, requests: list[tuple[str, str]]) -> list[list[dict]]:
+        """:param requests: (utterance, language) pairs"""
+        if len(requests) == 1:
+            utterance, lang = requests[0]
+            return [self.nlp_backend.extract_spacy_entities(utterance, lang)]
+
+        entities: list[Union[list[dict], Exception]] = [[] for _ in requests]
+        # One pipeline per language
+        for lang in {lang for _, lang in requests}:
+            indexes = [i for i, (_, request_lang) in enumerate(requests) if request_lang == lang]
+            try:
+                lang_entities = self.nlp_backend.extract_spacy_entities_batch([requests[i][0] for i in indexes],
+                                                                              get_settings('nlp')['batch_size'],
+                                                                              lang=lang)
+            except Exception as e:
+                # E.g. an unsupported language, only fail the requests of this language
+                lang_entities = [e] * len(indexes)
+
+            for i, utterance_entities in zip(indexes, lang_entities):
+                entities[i] = utterance_entities
+
+        return entities
+
+    def init_executors(self) -> None:
+        tcp_server_settings = get_settings('tcp_server')
+
+        for subsystem, max_workers in tcp_server_settings['executors'].items():
+            self.executors[subsystem] = ThreadPoolExecutor(max_workers=max_workers,
+                                                           thread_name_prefix=f'{subsystem}-executor')
+
+        for topic, limit in tcp_server_settings['topic_concurrency'].items():
+            self.topic_semaphores[topic.lower().replace('-', '_')] = asyncio.Semaphore(limit)
+
+    def init_metrics_dumper(self) -> None:
+        metrics_settings = get_settings('tcp_server')['metrics']
+
+        if metrics_settings['dump_path']:
+            MetricsDumper(metrics, metrics_settings['dump_path'], metrics_settings['dump_interval']).start()
+
+    @staticmethod
+    def get_error_message(topic: Union[str, None], message: str) -> dict:
+        """Reply to a request that failed, the client rejects its pending request with it"""
+        return {
+            'topic': 'tcp-server-error',
+            'data': {
+                'topic': topic,
+                'message': message
+            }
+        }
+
+    async def dispatch_frame(self, frame, writer, session_id: int = 0) -> None:
+        if frame.message_type != MESSAGE_TYPE_JSON:
+            self.log(f'Ignoring unsupported message type {frame.message_type} (request {frame.request_id})')
             return
 
-        if not os.path.exists(TTS_MODEL_PATH):
-            self.log(f'TTS model not found at {TTS_MODEL_PATH}')
+        try:
+            data_dict = frame.json()
+            if not isinstance(data_dict, dict) or not isinstance(data_dict.get('topic'), str):
+                raise ValueError('the message must be an object with a "topic" string')
+        except ValueError as e:
+            # Reply anyway, the client waits for the request to settle
+            self.log(f'Invalid request {frame.request_id}:', e)
+            self.send_tcp_message(self.get_error_message(None, f'Invalid request: {e}'), frame.request_id, writer)
+            return
+
+        if self.traffic_recorder:
+            try:
+                self.traffic_recorder.record(session_id, data_dict)
+            except Exception as e:
+                # Recording must never prevent the request from being handled
+                self.log('Failed to record the request:', e)
+
+        # Verify the received topic can execute the method
+        method_name = data_dict['topic'].lower().replace('-', '_')
+        if method_name not in TOPIC_SUBSYSTEMS:
+            self.log(f'Unknown topic: {data_dict["topic"]}')
+            self.send_tcp_message(self.get_error_message(data_dict['topic'], 'Unknown topic'),
+                                  frame.request_id, writer)
             return
 
+        method = getattr(self, method_name)
+        executor = self.executors[TOPIC_SUBSYSTEMS[method_name]]
+        semaphore = self.topic_semaphores.get(method_name)
+        topic = data_dict['topic']
+
+        # Each dispatch runs in its own task, hence its own context
+        current_request.set(Request(frame.request_id, writer))
+        context = contextvars.copy_context()
+
+        metrics.increment(f'topic.{topic}.count')
+        metrics.add_to_gauge(f'topic.{topic}.in_flight', 1)
+        tic = time.perf_counter()
+
+        try:
+            if semaphore:
+                async with semaphore:
+                    res = await self.loop.run_in_executor(executor, context.run, method, data_dict.get('data'))
+            else:
+                res = await self.loop.run_in_executor(executor, context.run, method, data_dict.get('data'))
+        except Exception as e:
+            self.log(f'Failed to handle topic {data_dict["topic"]}:', e)
+            metrics.increment(f'topic.{topic}.errors')
+            res = self.get_error_message(data_dict['topic'], str(e))
+        finally:
+            # Includes the time spent waiting for a concurrency slot
+            metrics.observe(f'topic.{topic}.latency', (time.perf_counter() - tic) * 1000)
+            metrics.add_to_gauge(f'topic.{topic}.in_flight', -1)
+
+        try:
+            self.send_tcp_message(res, frame.request_id, writer)
+        except (TypeError, ValueError, ProtocolError) as e:
+            # E.g. the reply is not JSON-serializable or is too big, the client still waits for the request to settle
+            self.log(f'Failed to reply to topic {topic}:', e)
+            metrics.increment(f'topic.{topic}.errors')
+            self.send_tcp_message(self.get_error_message(topic, f'Invalid reply: {e}'), frame.request_id, writer)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        addr = writer.get_extra_info('peername')
+        decoder = FrameDecoder()
+        tasks = set()
+        self.sessions_count += 1
+        session_id = self.sessions_count
+
+        self.clients.add(writer)
+        self.log(f'Client connected: {addr}', flush=True)
+
+        try:
+            while True:
+                socket_data = await reader.read(65536)
+
+                if not socket_data:
+                    break
+
+                # One read can hold a partial frame or several coalesced frames
+                for frame in decoder.feed(socket_data):
+                    # Do not await so requests of the same client are handled concurrently
+                    task = asyncio.create_task(self.dispatch_frame(frame, writer, session_id))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except ProtocolError as e:
+            self.log(f'Protocol error, dropping client: {e}')
+        except ConnectionError as e:
+            self.log(f'Connection error: {e}')
+        finally:
+            self.log(f'Client disconnected: {addr}', flush=True)
+            self.clients.discard(writer)
+            writer.close()
+
+    def load_models(self) -> list[threading.Thread]:
+        """Load spaCy, ASR and TTS concurrently without blocking.
+        Requests that need a model wait for it to be ready, see the "server-status" topic
+        :return: The loader threads"""
+        if get_settings('nlp')['worker']['enabled']:
+            # Loaded and warmed up in the worker process
+            self.model_loader.register('spacy', self.start_nlp_worker)
+        else:
+            self.model_loader.register('spacy', self.load_spacy_model, nlp.warmup_spacy_model)
+        self.model_loader.register('asr', self.init_asr, is_enabled=IS_ASR_ENABLED)
+        self.model_loader.register('tts', self.init_tts, self.warmup_tts, is_enabled=IS_TTS_ENABLED)
+
+        return self.model_loader.load_all()
+
+    def load_spacy_model(self):
+        model = nlp.load_spacy_model()
+        # Results persisted by a previous run may come from another model version
+        self.entity_cache.invalidate(nlp.default_lang, nlp.get_model_id())
+
+        return model
+
+    def start_nlp_worker(self) -> NLPWorker:
+        worker_settings = get_settings('nlp')['worker']
+
+        def on_crash(error: str) -> None:
+            self.model_loader.set_state('spacy', MODEL_STATE_LOADING, error)
+
+        def on_restart() -> None:
+            self.entity_cache.invalidate(nlp.default_lang, self.nlp_worker.get_model_id())
+            self.model_loader.set_state('spacy', MODEL_STATE_READY)
+
+        self.nlp_worker = NLPWorker(nlp.default_lang, worker_settings['cpu_affinity'],
+                                    worker_settings['restart_delay'], worker_settings['call_timeout'],
+                                    on_crash=on_crash, on_restart=on_restart)
+        self.nlp_worker.start()
+        self.nlp_backend = self.nlp_worker
+        self.entity_cache.invalidate(nlp.default_lang, self.nlp_worker.get_model_id())
+
+        return self.nlp_worker
+
+    def wait_for_model(self, name: str) -> None:
+        self.model_loader.wait_until_ready(name, get_settings('tcp_server')['model_ready_timeout'])
+
+    def on_model_state_change(self, name: str, status: dict) -> None:
+        if self.loop and self.clients:
+            self.send_tcp_message({
+                'topic': 'server-status-changed',
+                'data': {
+                    'model': name,
+                    **status,
+                    'isReady': self.model_loader.is_ready,
+                    'failedModels': self.model_loader.failed_models
+                }
+            })
+
+    def init_tts(self) -> 'TTS':
+        from .tts.api import TTS
+
+        if not os.path.exists(TTS_MODEL_CONFIG_PATH):
+            raise FileNotFoundError(f'TTS model config not found at {TTS_MODEL_CONFIG_PATH}')
+
+        if not os.path.exists(TTS_MODEL_PATH):
+            raise FileNotFoundError(f'TTS model not found at {TTS_MODEL_PATH}')
+
         self.tts = TTS(language='EN',
                        device=get_settings('tts')['device'],
                        config_path=TTS_MODEL_CONFIG_PATH,
                        ckpt_path=TTS_MODEL_PATH
                        )
+        self.tts.phrase_cache = self.init_tts_phrase_cache()
+        self.tts.worker_pool = self.init_tts_worker_pool()
+
+        return self.tts
+
+    def init_tts_worker_pool(self) -> Union['TTSWorkerPool', None]:
+        """Long texts are synthesized by several processes in parallel, see the "tts.worker_pool" settings"""
+        worker_pool_settings = get_settings('tts')['worker_pool']
+        if not worker_pool_settings['enabled']:
+            return None
+
+        if self.tts.device != 'cpu':
+            self.log(f'The TTS worker pool is only used on CPU, the TTS runs on {self.tts.device}')
+            return None
+
+        from .tts.worker_pool import TTSWorkerPool, get_threads_per_worker
+
+        size = worker_pool_settings['size']
+        self.tts_worker_pool = TTSWorkerPool(size,
+                                             get_threads_per_worker(size, worker_pool_settings['threads_per_worker']),
+                                             worker_pool_settings['min_pieces'],
+                                             language=self.tts.language,
+                                             config_path=TTS_MODEL_CONFIG_PATH,
+                                             ckpt_path=TTS_MODEL_PATH)
+
+        return self.tts_worker_pool.start()
+
+    def warmup_tts(self, tts: 'TTS') -> None:
+        tts.warmup()
+        self.start_tts_presynthesis()
+
+    def start_tts_presynthesis(self) -> None:
+        """Fill the phrase cache with the static answers of the skills in the background"""
+        if not get_settings('tts')['presynthesis']['enabled']:
+            return
 
-    def init_asr(self):
-        if not IS_ASR_ENABLED:
-            self.log('ASR is disabled')
+        if not self.tts_phrase_cache:
+            self.log('TTS presynthesis needs the phrase cache, enable "tts.phrase_cache" in the settings')
             return
 
+        from .tts.presynthesis import TTSPresynthesizer, find_static_texts, get_answers_paths
+
+        speaker_id = self.tts.hps.data.spk2id['EN-Leon-V1_1']
+        texts = find_static_texts(get_answers_paths(SKILLS_PATH, GLOBAL_DATA_PATH, nlp.default_lang),
+                                  self.format_speech,
+                                  # Sentence by sentence like the synthesis with the phrase cache,
+                                  # so the static sentences of the answers with placeholders are covered too
+                                  lambda speech: self.tts.split_sentences_into_pieces(speech, self.tts.language,
+                                                                                      quiet=True,
+                                                                                      is_sentence_level=True))
+
+        def synthesize(text, is_cancelled):
+            # Same parameters as the "tts-synthesize" requests so the cache keys match
+            self.tts.tts_to_file(text, speaker_id, speed=1, quiet=True, is_cancelled=is_cancelled,
+                                 batch_size=get_settings('tts')['batch_size'],
+                                 lookahead=get_settings('tts')['frontend_lookahead'])
+
+        self.tts_presynthesizer = TTSPresynthesizer(texts, synthesize, self.tts_jobs,
+                                                    get_settings('tts')['presynthesis']['delay'])
+        self.tts_presynthesizer.start()
+
+    def init_tts_phrase_cache(self) -> Union['PhraseCache', None]:
+        phrase_cache_settings = get_settings('tts')['phrase_cache']
+        if not phrase_cache_settings['enabled']:
+            return None
+
+        from .tts.phrase_cache import PhraseCache, get_checkpoint_id
+
+        # The checkpoint is part of the keys, and the disk tier is emptied when it changes
+        self.tts_phrase_cache = PhraseCache(get_checkpoint_id(TTS_MODEL_PATH),
+                                            memory_max_bytes=phrase_cache_settings['memory_max_bytes'],
+                                            directory=phrase_cache_settings['directory']
+                                            or os.path.join(TMP_PATH, 'tts_phrase_cache'),
+                                            disk_max_bytes=phrase_cache_settings['disk_max_bytes'])
+
+        return self.tts_phrase_cache
+
+    def init_asr(self) -> 'ASR':
+        from .asr.api import ASR
+
         def clean_up_speech(text: str) -> str:
             """Remove everything before the wake word if there is (included), remove punctuation right after it, trim and
             capitalize the first letter"""
@@ -99,6 +509,8 @@ class TCPServer:
 
         def interrupt_leon_speech_callback():
             self.log('Interrupting Leon speech because owner started speaking')
+            # Free the CPU for the transcription of the owner speech
+            self.tts_jobs.cancel_all()
             self.send_tcp_message({
                 'topic': 'asr-interrupt-leon-speech',
                 'data': {}
@@ -129,57 +541,115 @@ class TCPServer:
                        end_of_owner_speech_callback=end_of_owner_speech_callback,
                        active_listening_disabled_callback=active_listening_disabled_callback)
 
-    def init(self):
-        try:
-            # Make sure to establish TCP connection by reusing the address so it does not conflict with port already in use
-            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.tcp_socket.bind((self.host, int(self.port)))
-            self.tcp_socket.listen()
-        except OSError as e:
-            # If the port is already in use, close the connection and retry
-            if 'Address already in use' in str(e):
-                self.log(f'Port {self.port} is already in use. Disconnecting client and retrying...')
-                if self.conn:
-                    self.conn.close()
-                # Wait for a moment before retrying
-                time.sleep(1)
-                self.init()
-            else:
-                raise
+        return self.asr
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.init_executors()
+        self.init_metrics_dumper()
 
         while True:
-            # Flush buffered output to make it IPC friendly (readable on stdout)
-            self.log('Waiting for connection...', flush=True)
+            try:
+                server = await asyncio.start_server(self.handle_client, self.host, int(self.port), reuse_address=True)
+                break
+            except OSError as e:
+                # If the port is already in use, wait for a moment before retrying
+                if 'Address already in use' in str(e):
+                    self.log(f'Port {self.port} is already in use. Retrying...')
+                    await asyncio.sleep(1)
+                else:
+                    raise
+
+        servers = [server]
+
+        if UNIX_SOCKET_PATH:
+            # Remove the socket file left over by a previous run
+            if os.path.exists(UNIX_SOCKET_PATH):
+                os.remove(UNIX_SOCKET_PATH)
+            servers.append(await asyncio.start_unix_server(self.handle_client, UNIX_SOCKET_PATH))
+            self.log(f'Listening on Unix socket {UNIX_SOCKET_PATH}')
+
+        if AUDIO_TRANSPORT == 'shm':
+            self.tts_audio_ring = SharedMemoryRingBuffer(TTS_AUDIO_SHM_NAME, SHM_CAPACITY, create=True)
+            self.log(f'TTS audio goes through shared memory "{TTS_AUDIO_SHM_NAME}" ({SHM_CAPACITY} bytes)')
+
+        # Flush buffered output to make it IPC friendly (readable on stdout)
+        self.log('Waiting for connection...', flush=True)
+
+        if self.traffic_recorder:
+            self.log(f'Recording traffic to {TRAFFIC_RECORD_PATH}')
 
-            # Our TCP server only needs to support one connection
-            self.conn, self.addr = self.tcp_socket.accept()
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        finally:
+            if self.tts_audio_ring:
+                self.tts_audio_ring.close()
+            if self.traffic_recorder:
+                self.traffic_recorder.close()
+            self.entity_cache.save()
+            if self.nlp_worker:
+                self.nlp_worker.close()
+            if self.tts_worker_pool:
+                self.tts_worker_pool.close()
 
-            try:
-                self.log(f'Client connected: {self.addr}')
+    def init(self):
+        asyncio.run(self.serve())
 
-                while True:
-                    # socket_data = self.conn.recv(1024)
-                    socket_data = self.conn.recv(8096)
+    def server_status(self, data=None) -> dict:
+        return {
+            'topic': 'server-status-received',
+            'data': {
+                'models': self.model_loader.get_status(),
+                'isReady': self.model_loader.is_ready,
+                'failedModels': self.model_loader.failed_models,
+                'audioStore': self.audio_store.get_status(),
+                'entityCache': self.entity_cache.get_status(),
+                'ttsPhraseCache': self.tts_phrase_cache.get_status() if self.tts_phrase_cache else None,
+                'ttsPresynthesis': self.tts_presynthesizer.get_status() if self.tts_presynthesizer else None,
+                'ttsWorkerPool': self.tts_worker_pool.get_status() if self.tts_worker_pool else None,
+                'nlpPipelines': self.get_nlp_pipelines_status()
+            }
+        }
+
+    def get_nlp_pipelines_status(self) -> dict:
+        try:
+            return self.nlp_backend.get_registry_status()
+        except NLPWorkerError:
+            return {}
+
+    def server_metrics(self, data=None) -> dict:
+        metrics.set_gauge('process.rss_bytes', get_rss_bytes())
+        snapshot = metrics.snapshot()
 
-                    if not socket_data:
-                        break
+        if self.nlp_worker:
+            try:
+                snapshot['nlpWorker'] = self.nlp_worker.get_metrics_snapshot()
+            except NLPWorkerError as e:
+                self.log('Failed to get the NLP worker metrics:', e)
 
-                    data_dict = json.loads(socket_data)
+        return {
+            'topic': 'server-metrics-received',
+            'data': snapshot
+        }
 
-                    # Verify the received topic can execute the method
-                    method = data_dict['topic'].lower().replace('-', '_')
-                    if hasattr(self.__class__, method) and callable(getattr(self.__class__, method)):
-                        data = data_dict['data']
-                        method = getattr(self, method)
-                        res = method(data)
+    def get_spacy_entities(self, data: Union[str, dict]) -> dict:
+        """:param data: The utterance, or {utterance, lang} to route it to the pipeline of another language"""
+        self.wait_for_model('spacy')
 
-                        self.send_tcp_message(res)
-            finally:
-                self.log(f'Client disconnected: {self.addr}')
-                self.conn.close()
+        utterance, lang = self.parse_nlp_request(data, 'utterance')
+        # Loads the pipeline of the language on first use
+        model_id = self.nlp_backend.get_model_id(lang)
+        # Unknown while the NLP worker restarts, the entities of different models must not share a key
+        is_cacheable = model_id is not None
+        entities = self.entity_cache.get(lang, model_id, utterance) if is_cacheable else None
 
-    def get_spacy_entities(self, utterance: str) -> dict:
-        entities = nlp.extract_spacy_entities(utterance)
+        if entities is None:
+            if self.spacy_batcher and self.spacy_batcher.window:
+                entities = self.spacy_batcher.submit((utterance, lang))
+            else:
+                entities = self.nlp_backend.extract_spacy_entities(utterance, lang)
+            if is_cacheable:
+                self.entity_cache.put(lang, model_id, utterance, entities)
 
         return {
             'topic': 'spacy-entities-received',
@@ -188,11 +658,42 @@ class TCPServer:
             }
         }
 
+    def get_spacy_entities_batch(self, data: Union[list, dict]) -> dict:
+        """:param data: The utterances, or {utterances, lang}"""
+        self.wait_for_model('spacy')
+
+        utterances, lang = self.parse_nlp_request(data, 'utterances')
+        nlp_settings = get_settings('nlp')
+        model_id = self.nlp_backend.get_model_id(lang)
+        # Unknown while the NLP worker restarts, see get_spacy_entities()
+        is_cacheable = model_id is not None
+        entities = [self.entity_cache.get(lang, model_id, utterance) if is_cacheable else None
+                    for utterance in utterances]
+        # Only run the pipeline on the utterances that are not cached
+        missing_indexes = [i for i, utterance_entities in enumerate(entities) if utterance_entities is None]
+
+        if missing_indexes:
+            missing_entities = self.nlp_backend.extract_spacy_entities_batch(
+                [utterances[i] for i in missing_indexes],
+                batch_size=nlp_settings['batch_size'],
+                n_process=nlp_settings['n_process'],
+                lang=lang
+            )
+            for i, utterance_entities in zip(missing_indexes, missing_entities):
+                entities[i] = utterance_entities
+                if is_cacheable:
+                    self.entity_cache.put(lang, model_id, utterances[i], utterance_entities)
+
+        return {
+            'topic': 'spacy-entities-batch-received',
+            'data': {
+                # Same order as the utterances
+                'spacyEntities': entities
+            }
+        }
+
     def asr_start_recording(self, extra=None) -> dict:
-        # If ASR is not initialized yet, then wait for 2 seconds before starting recording
-        if not self.asr:
-            self.log('ASR is not initialized yet. Waiting for 2 seconds before starting recording...')
-            time.sleep(2)
+        self.wait_for_model('asr')
 
         self.asr_recording_thread = threading.Thread(target=self.asr.start_recording)
         self.asr_recording_thread.start()
@@ -202,11 +703,10 @@ class TCPServer:
             'data': {}
         }
 
-    def tts_synthesize(self, speech: str) -> dict:
-        # If TTS is not initialized yet, then wait for 2 seconds before synthesizing
-        if not self.tts:
-            self.log('TTS is not initialized yet. Waiting for 2 seconds before synthesizing...')
-            time.sleep(2)
+    def tts_synthesize(self, data: Union[str, dict]) -> dict:
+        speech, priority = self.parse_tts_request(data)
+
+        self.wait_for_model('tts')
 
         """
         TODO:
@@ -214,29 +714,53 @@ class TCPServer:
         - Need to train a new model with default voice speaker and other speakers with different styles
         - EN-Leon-Joyful-V1; EN-Leon-Sad-V1; etc.
         """
+        request = current_request.get()
         speaker_ids = self.tts.hps.data.spk2id
         # Random file name to avoid conflicts
-        audio_id = f'{int(time.time())}_{os.urandom(2).hex()}'
-        output_file_name = f'{audio_id}.wav'
-        output_path = os.path.join(TMP_PATH, output_file_name)
+        audio_id = self.generate_audio_id()
+        output_path = self.audio_store.get_path(audio_id)
         speed = 1
 
-        formatted_speech = speech.replace(' - ', '.').replace(',', '.').replace(': ', '. ')
-        # Clean up emojis
-        formatted_speech = re.sub(r'[\U00010000-\U0010ffff]', '', formatted_speech)
-        formatted_speech = formatted_speech.strip()
-        # formatted_speech = speech.replace(',', '.').replace('.', '...')
+        def synthesize(is_cancelled):
+            return self.tts.tts_to_file(
+                self.format_speech(speech),
+                speaker_ids['EN-Leon-V1_1'],
+                output_path=output_path,
+                speed=speed,
+                quiet=True,
+                format='wav',
+                stream=False,
+                is_cancelled=is_cancelled,
+                batch_size=get_settings('tts')['batch_size'],
+                lookahead=get_settings('tts')['frontend_lookahead']
+            )
+
+        job = self.tts_jobs.submit(synthesize, priority)
+        self.send_tcp_message({
+            'topic': 'tts-job-queued',
+            'data': {
+                'jobId': job.job_id
+            }
+        }, request.request_id, request.writer)
+        result_path = job.wait()
+
+        if job.is_cancelled:
+            # The audio may be partially written
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+            return {
+                'topic': 'tts-job-cancelled',
+                'data': {
+                    'jobId': job.job_id
+                }
+            }
 
-        # TODO: should not wait to finish for streaming support
-        self.tts.tts_to_file(
-            formatted_speech,
-            speaker_ids['EN-Leon-V1_1'],
-            output_path=output_path,
-            speed=speed,
-            quiet=True,
-            format='wav',
-            stream=False
-        )
+        # No audio file is written when there is nothing to say, e.g. only emojis
+        if not result_path:
+            raise ValueError('Nothing to synthesize')
+
+        self.audio_store.add(audio_id)
 
         return {
             'topic': 'tts-audio-streaming',
@@ -246,6 +770,154 @@ class TCPServer:
             }
         }
 
+    def tts_synthesize_stream(self, data: Union[str, dict]) -> dict:
+        """Send the audio of each sentence as soon as it is synthesized.
+        The client receives a "tts-stream-started" message with the audio format,
+        then binary audio chunks (see protocol.encode_audio_chunk), then the end-of-stream chunk,
+        then the "tts-stream-ended" reply"""
+        speech, priority = self.parse_tts_request(data)
+
+        self.wait_for_model('tts')
+
+        request = current_request.get()
+        speaker_ids = self.tts.hps.data.spk2id
+        audio_id = self.generate_audio_id()
+        # Sent with the stream start, before the job is submitted
+        job_id = self.tts_jobs.generate_job_id()
+        speed = 1
+
+        chunks_count = 0
+        # The other streams fall back to socket frames while the ring is used
+        audio_ring = self.tts_audio_ring if self.tts_audio_ring and self.tts_audio_ring_lock.acquire(False) else None
+
+        def synthesize(is_cancelled):
+            nonlocal chunks_count
+            for audio in self.tts.tts_iter(
+                self.format_speech(speech),
+                speaker_ids['EN-Leon-V1_1'],
+                speed=speed,
+                quiet=True,
+                stream=True,
+                is_cancelled=is_cancelled,
+                batch_size=get_settings('tts')['batch_size'],
+                lookahead=get_settings('tts')['frontend_lookahead']
+            ):
+                self.send_audio_chunk(chunks_count, self.tts.audio_to_pcm16(audio), request, audio_ring)
+                chunks_count += 1
+
+        self.send_tcp_message({
+            'topic': 'tts-stream-started',
+            'data': {
+                'audioId': audio_id,
+                'jobId': job_id,
+                'sampleRate': self.tts.hps.data.sampling_rate,
+                'channels': 1,
+                'sampleFormat': 's16le',
+                'transport': 'shm' if audio_ring else 'socket',
+                'shmName': audio_ring.name if audio_ring else None,
+                'shmCapacity': audio_ring.capacity if audio_ring else None
+            }
+        }, request.request_id, request.writer)
+
+        job = self.tts_jobs.submit(synthesize, priority, job_id)
+        try:
+            job.wait()
+        finally:
+            # Also when the job failed or was cancelled, even before it started, so the client stops waiting for audio
+            self.send_binary_message(encode_audio_chunk(chunks_count, is_end_of_stream=True),
+                                     request.request_id,
+                                     request.writer)
+            if audio_ring:
+                self.tts_audio_ring_lock.release()
+
+        return {
+            'topic': 'tts-stream-ended',
+            'data': {
+                'audioId': audio_id,
+                'chunksCount': chunks_count,
+                'isCancelled': job.is_cancelled
+            }
+        }
+
+    def send_audio_chunk(self, sequence: int, pcm: bytes, request: Request,
+                         audio_ring: Union[SharedMemoryRingBuffer, None] = None) -> None:
+        """Write the PCM in shared memory and only send its position, or send it in a binary frame
+        when shared memory is not used by this stream or the consumer is lagging behind"""
+        if audio_ring:
+            try:
+                position = audio_ring.write(pcm)
+                self.send_tcp_message({
+                    'topic': 'tts-audio-chunk-written',
+                    'data': {
+                        'sequence': sequence,
+                        'position': position,
+                        'length': len(pcm)
+                    }
+                }, request.request_id, request.writer)
+                return
+            except RingBufferFullError as e:
+                self.log(f'Falling back to socket for audio chunk {sequence}: {e}')
+
+        self.send_binary_message(encode_audio_chunk(sequence, pcm), request.request_id, request.writer)
+
+    def tts_audio_acknowledged(self, data: dict) -> dict:
+        """The core played the audio file, delete it from the audio store"""
+        is_acknowledged = self.audio_store.acknowledge(data['audioId'])
+
+        return {
+            'topic': 'tts-audio-acknowledgement-received',
+            'data': {
+                'audioId': data['audioId'],
+                'isAcknowledged': is_acknowledged
+            }
+        }
+
+    def tts_cancel(self, data: Union[dict, None] = None) -> dict:
+        """Cancel one TTS job by its ID, or all of them if no ID is given"""
+        job_id = data.get('jobId') if isinstance(data, dict) else None
+
+        if job_id:
+            cancelled_job_ids = [job_id] if self.tts_jobs.cancel(job_id) else []
+        else:
+            cancelled_job_ids = self.tts_jobs.cancel_all()
+
+        return {
+            'topic': 'tts-cancelled',
+            'data': {
+                'jobIds': cancelled_job_ids
+            }
+        }
+
+    @staticmethod
+    def parse_nlp_request(data: Union[str, list, dict], key: str) -> tuple:
+        """:return: The utterance(s) and the language, the default one when not given"""
+        if isinstance(data, dict):
+            return data[key], data.get('lang') or nlp.default_lang
+
+        return data, nlp.default_lang
+
+    @staticmethod
+    def parse_tts_request(data: Union[str, dict]) -> tuple[str, int]:
+        """The speech can be sent as is or as {"speech": "...", "priority": "high" | "normal" | "low"}"""
+        if isinstance(data, dict):
+            return data['speech'], PRIORITIES.get(data.get('priority'), PRIORITY_NORMAL)
+
+        return data, PRIORITY_NORMAL
+
+    @staticmethod
+    def generate_audio_id() -> str:
+        return f'{int(time.time())}_{os.urandom(2).hex()}'
+
+    @staticmethod
+    def format_speech(speech: str) -> str:
+        formatted_speech = speech.replace(' - ', '.').replace(',', '.').replace(': ', '. ')
+        # Clean up emojis
+        formatted_speech = re.sub(r'[\U00010000-\U0010ffff]', '', formatted_speech)
+        formatted_speech = formatted_speech.strip()
+        # formatted_speech = speech.replace(',', '.').replace('.', '...')
+
+        return formatted_speech
+
     def leon_speech_audio_ended(self, audio_duration: float) -> dict:
         if self.asr:
             if not audio_duration:
@@ -0,0 +1,40 @@
+import json
+import threading
+import time
+
+# Monitoring topics are not part of the workload
+IGNORED_TOPICS = {'server-status', 'server-metrics'}
+
+
+class TrafficRecorder:
+    """Append every request received by the server as one JSON line so it can be replayed later,
+    see bench/replay.py"""
+
+    def __init__(self, record_path: str):
+        self.record_path = record_path
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+        self.file = open(record_path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[Traffic Recorder]', *args, **kwargs)
+
+    def record(self, session_id: int, request: dict) -> None:
+        if request['topic'] in IGNORED_TOPICS:
+            return
+
+        line = json.dumps({
+            'time': round(time.perf_counter() - self.started_at, 6),
+            'session': session_id,
+            'topic': request['topic'],
+            'data': request.get('data')
+        })
+
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
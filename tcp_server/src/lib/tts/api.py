@@ -1,4 +1,6 @@
 import re
+import queue
+import threading
 import soundfile
 import numpy as np
 import torch.nn as nn
@@ -11,10 +13,17 @@ import os
 from . import utils
 from .models import SynthesizerTrn
 from .split_utils import split_sentence
+from .worker_pool import TTSWorkerPoolError
 from ..utils import is_macos
+from ..metrics import metrics
 
 # torch.backends.cudnn.enabled = False
 
+FRONTEND_PREPARED = 'prepared'
+FRONTEND_FAILED = 'failed'
+FRONTEND_DONE = 'done'
+
+
 class TTS(nn.Module):
     def __init__(self,
                 language,
@@ -22,7 +31,9 @@ class TTS(nn.Module):
                 device='auto',
                 use_hf=True,
                 config_path=None,
-                ckpt_path=None):
+                ckpt_path=None,
+                # Map the checkpoint file instead of copying the weights, so processes share them (CPU only)
+                mmap_weights=False):
         super().__init__()
 
         tic = time.perf_counter()
@@ -69,13 +80,27 @@ class TTS(nn.Module):
 
         model.eval()
         self.model = model
+        # The decoder (vocoder) is timed apart from the rest of the inference (acoustic model)
+        self.vocoder_tic = 0
+        self.vocoder_duration = 0
+        self.model.dec.register_forward_pre_hook(self.start_vocoder_timer)
+        self.model.dec.register_forward_hook(self.stop_vocoder_timer)
         self.symbol_to_id = {s: i for i, s in enumerate(symbols)}
         self.hps = hps
         self.device = device
+        # Optional PhraseCache of the audio per sentence piece, set by the TCP server
+        self.phrase_cache = None
+        # Optional TTSWorkerPool synthesizing the pieces of long texts in parallel, set by the TCP server
+        self.worker_pool = None
 
         # load state_dict
-        checkpoint_dict = torch.load(ckpt_path, map_location=device)
-        self.model.load_state_dict(checkpoint_dict['model'], strict=True)
+        if mmap_weights and device == 'cpu':
+            checkpoint_dict = torch.load(ckpt_path, map_location=device, mmap=True)
+            # The parameters become the memory-mapped tensors instead of copies of them
+            self.model.load_state_dict(checkpoint_dict['model'], strict=True, assign=True)
+        else:
+            checkpoint_dict = torch.load(ckpt_path, map_location=device)
+            self.model.load_state_dict(checkpoint_dict['model'], strict=True)
 
         language = language.split('_')[0]
         self.language = 'ZH_MIX_EN' if language == 'ZH' else language # we support a ZH_MIX_EN model
@@ -85,11 +110,19 @@ class TTS(nn.Module):
 
         self.log(f"Time taken to load model: {toc - tic:0.4f} seconds")
 
+    def warmup(self):
         self.log('Warming up model...')
         speaker_ids = self.hps.data.spk2id
         self.tts_to_file('This is a test.', speaker_ids['EN-Leon-V1_1'], quiet=True, format='wav')
         self.log('Model warmed up')
 
+    def start_vocoder_timer(self, module, inputs):
+        self.vocoder_tic = time.perf_counter()
+
+    def stop_vocoder_timer(self, module, inputs, output):
+        self.vocoder_duration = time.perf_counter() - self.vocoder_tic
+        metrics.observe('tts.vocoder', self.vocoder_duration * 1000)
+
     @staticmethod
     def audio_numpy_concat(segment_data_list, sr, speed=1.):
         audio_segments = []
@@ -99,76 +132,316 @@ class TTS(nn.Module):
         audio_segments = np.array(audio_segments).astype(np.float32)
         return audio_segments
 
+    def add_silence(self, audio, speed):
+        """Append the pause between two sentence pieces"""
+        audio_segments = []
+        audio_segments += audio.reshape(-1).tolist()
+        audio_segments += [0] * int((self.hps.data.sampling_rate * 0.05) / speed)
+        audio_segments = np.array(audio_segments).astype(np.float32)
+
+        return audio_segments
+
+    @staticmethod
+    def audio_to_pcm16(audio):
+        """Convert float audio in [-1, 1] to 16-bit little-endian PCM bytes"""
+        return (np.clip(audio, -1., 1.) * 32767).astype('<i2').tobytes()
+
     @staticmethod
-    def split_sentences_into_pieces(text, language, quiet=False):
-        texts = split_sentence(text, language_str=language)
+    def split_sentences_into_pieces(text, language, quiet=False, is_sentence_level=False):
+        texts = split_sentence(text, language_str=language, is_sentence_level=is_sentence_level)
         if not quiet:
             print(" > Text split to sentences.")
             print('\n'.join(texts))
             print(" > ===========================")
         return texts
 
-    def tts_iter(self, text, speaker_id, sdp_ratio=0.2, noise_scale=0.6, noise_scale_w=0.8, speed=1.0, pbar=None, position=None, quiet=False, stream=False):
+    def get_batches(self, texts, batch_size, stream=False):
+        """Group consecutive sentence pieces, in order.
+        When streaming, the first piece is synthesized alone so its audio starts playing as soon as possible"""
+        if stream and batch_size > 1 and texts:
+            yield texts[:1]
+            texts = texts[1:]
+
+        for i in range(0, len(texts), max(1, batch_size)):
+            yield texts[i:i + batch_size]
+
+    def prepare_batch(self, texts):
+        """
+        Text frontend of several sentence pieces: normalization, g2p and BERT features.
+        The inputs are right-padded to the longest piece
+        :return: (phones, tones, language IDs, BERT, JA BERT, lengths)
+        """
+        language = self.language
+        inputs = []
+        # Thread-local, the frontend can run on its own thread
+        with torch.no_grad():
+            for t in texts:
+                if language in ['EN', 'ZH_MIX_EN']:
+                    t = re.sub(r'([a-z])([A-Z])', r'\1 \2', t)
+                inputs.append(utils.get_text_for_tts_infer(t, language, self.hps, self.device, self.symbol_to_id))
+
+            batch_size = len(inputs)
+            lengths = [phones.size(0) for _, _, phones, _, _ in inputs]
+            max_length = max(lengths)
+            x_tst = torch.zeros(batch_size, max_length, dtype=torch.long)
+            tones = torch.zeros(batch_size, max_length, dtype=torch.long)
+            lang_ids = torch.zeros(batch_size, max_length, dtype=torch.long)
+            bert = torch.zeros(batch_size, inputs[0][0].size(0), max_length)
+            ja_bert = torch.zeros(batch_size, inputs[0][1].size(0), max_length)
+            for i, (piece_bert, piece_ja_bert, piece_phones, piece_tones, piece_lang_ids) in enumerate(inputs):
+                length = lengths[i]
+                x_tst[i, :length] = piece_phones
+                tones[i, :length] = piece_tones
+                lang_ids[i, :length] = piece_lang_ids
+                bert[i, :, :length] = piece_bert
+                ja_bert[i, :, :length] = piece_ja_bert
+
+        return x_tst, tones, lang_ids, bert, ja_bert, lengths
+
+    def infer_prepared(self, inputs, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed):
+        """
+        Acoustic model and vocoder of the pieces prepared by prepare_batch(), in one forward pass.
+        x_lengths masks the padding in the model and y_mask gives the number of frames of each waveform
+        :return: The waveform of each piece, in order
+        """
+        device = self.device
+        x_tst, tones, lang_ids, bert, ja_bert, lengths = inputs
+        batch_size = len(lengths)
+
+        with torch.no_grad():
+            x_tst = x_tst.to(device)
+            tones = tones.to(device)
+            lang_ids = lang_ids.to(device)
+            bert = bert.to(device)
+            ja_bert = ja_bert.to(device)
+            x_tst_lengths = torch.LongTensor(lengths).to(device)
+            speakers = torch.LongTensor([speaker_id] * batch_size).to(device)
+            infer_tic = time.perf_counter()
+            audio, _, y_mask, _ = self.model.infer(
+                    x_tst,
+                    x_tst_lengths,
+                    speakers,
+                    tones,
+                    lang_ids,
+                    bert,
+                    ja_bert,
+                    sdp_ratio=sdp_ratio,
+                    noise_scale=noise_scale,
+                    noise_scale_w=noise_scale_w,
+                    length_scale=1. / speed,
+                )
+            metrics.observe('tts.acoustic_model', (time.perf_counter() - infer_tic - self.vocoder_duration) * 1000)
+            del x_tst, tones, lang_ids, bert, ja_bert, x_tst_lengths, speakers
+
+            # The vocoder upsamples every frame to the same number of samples (the hop length)
+            samples_per_frame = audio.size(-1) // y_mask.size(-1)
+            y_lengths = (y_mask.sum(dim=(1, 2)).long() * samples_per_frame).tolist()
+            audio = audio[:, 0].data.cpu().float().numpy()
+
+        return [audio[i, :y_lengths[i]] for i in range(batch_size)]
+
+    def infer_batch(self, texts, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed):
+        """Synthesize several sentence pieces in one forward pass"""
+        return self.infer_prepared(self.prepare_batch(texts), speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed)
+
+    def iter_prepared_batches(self, batches, prepare, lookahead, is_cancelled=None):
+        """
+        Run the frontend of the upcoming batches on a worker thread while the caller runs the inference
+        of the current one. At most "lookahead" batches are prepared in advance, 0 runs both stages in turn
+        """
+        if lookahead <= 0:
+            for batch in batches:
+                yield prepare(batch)
+            return
+
+        prepared_queue = queue.Queue(maxsize=lookahead)
+        stop_event = threading.Event()
+
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    prepared_queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def run_frontend():
+            try:
+                for batch in batches:
+                    if stop_event.is_set() or (is_cancelled and is_cancelled()):
+                        break
+                    put((FRONTEND_PREPARED, prepare(batch)))
+            except Exception as e:
+                put((FRONTEND_FAILED, e))
+            finally:
+                put((FRONTEND_DONE, None))
+
+        frontend_thread = threading.Thread(target=run_frontend, name='tts-frontend', daemon=True)
+        frontend_thread.start()
+
+        try:
+            while True:
+                wait_tic = time.perf_counter()
+                item_type, value = prepared_queue.get()
+                # Close to 0 when the frontend keeps ahead of the inference
+                metrics.observe('tts.frontend_wait', (time.perf_counter() - wait_tic) * 1000)
+
+                if item_type == FRONTEND_FAILED:
+                    raise value
+                if item_type == FRONTEND_DONE:
+                    break
+
+                yield value
+        finally:
+            # E.g. cancelled, or the caller stopped iterating
+            stop_event.set()
+
+    def tts_iter(self, text, speaker_id, sdp_ratio=0.2, noise_scale=0.6, noise_scale_w=0.8, speed=1.0, pbar=None, position=None, quiet=False, stream=False, is_cancelled=None, batch_size=1, lookahead=0):
+        """
+        :param stream: The caller plays each piece as soon as it is yielded
+        :param batch_size: Number of sentence pieces synthesized in one forward pass, see bench/tts_batch.py
+        :param lookahead: Number of batches the frontend prepares in advance on a worker thread, 0 to disable
+        """
         tic = time.perf_counter()
         self.log(f"Generating audio for:\n{text}")
         language = self.language
 
-        texts = self.split_sentences_into_pieces(text, language, quiet)
+        # The pieces of 256 to 512 characters would delay the first audio until most of the text is synthesized,
+        # and would rarely be cached since most answers would be one piece including the dynamic parts
+        texts = self.split_sentences_into_pieces(text, language, quiet,
+                                                 is_sentence_level=stream or self.phrase_cache is not None)
 
-        if pbar:
-            tx = pbar(texts)
+        if self.worker_pool and len(texts) >= self.worker_pool.min_pieces:
+            yield from self.iter_parallel(texts, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed, is_cancelled)
         else:
-            if position:
-                tx = tqdm(texts, position=position)
-            elif quiet:
-                tx = texts
-            else:
-                tx = tqdm(texts)
-        for t in tx:
-            if language in ['EN', 'ZH_MIX_EN']:
-                t = re.sub(r'([a-z])([A-Z])', r'\1 \2', t)
-            device = self.device
-            bert, ja_bert, phones, tones, lang_ids = utils.get_text_for_tts_infer(t, language, self.hps, device, self.symbol_to_id)
-            with torch.no_grad():
-                x_tst = phones.to(device).unsqueeze(0)
-                tones = tones.to(device).unsqueeze(0)
-                lang_ids = lang_ids.to(device).unsqueeze(0)
-                bert = bert.to(device).unsqueeze(0)
-                ja_bert = ja_bert.to(device).unsqueeze(0)
-                x_tst_lengths = torch.LongTensor([phones.size(0)]).to(device)
-                del phones
-                speakers = torch.LongTensor([speaker_id]).to(device)
-                audio = self.model.infer(
-                        x_tst,
-                        x_tst_lengths,
-                        speakers,
-                        tones,
-                        lang_ids,
-                        bert,
-                        ja_bert,
-                        sdp_ratio=sdp_ratio,
-                        noise_scale=noise_scale,
-                        noise_scale_w=noise_scale_w,
-                        length_scale=1. / speed,
-                    )[0][0, 0].data.cpu().float().numpy()
-                del x_tst, tones, lang_ids, bert, ja_bert, x_tst_lengths, speakers
-
-                audio_segments = []
-                audio_segments += audio.reshape(-1).tolist()
-                audio_segments += [0] * int((self.hps.data.sampling_rate * 0.05) / speed)
-                audio_segments = np.array(audio_segments).astype(np.float32)
-
-                yield audio_segments
+            yield from self.iter_pipelined(texts, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed, pbar,
+                                           position, quiet, stream, is_cancelled, batch_size, lookahead)
 
         toc = time.perf_counter()
         self.log(f"Time taken to generate audio: {toc - tic:0.4f} seconds")
+        metrics.observe('tts.synthesis', (toc - tic) * 1000)
 
         if self.device == 'cuda':
             torch.cuda.empty_cache()
         if self.device == 'mps':
             torch.mps.empty_cache()
 
-    def tts_to_file(self, text, speaker_id, output_path=None, sdp_ratio=0.2, noise_scale=0.6, noise_scale_w=0.8, speed=1.0, pbar=None, format=None, position=None, quiet=False, stream=False):
+    def iter_parallel(self, texts, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed, is_cancelled):
+        """Long texts: the worker pool synthesizes the pieces that are not cached, several at a time"""
+        cached_audios = [None] * len(texts)
+        cache_keys = []
+        if self.phrase_cache:
+            cache_keys = [self.phrase_cache.get_key(t, speaker_id, speed, sdp_ratio, noise_scale, noise_scale_w)
+                          for t in texts]
+            cached_audios = [self.phrase_cache.get(cache_key) for cache_key in cache_keys]
+
+        missing_texts = [t for t, cached_audio in zip(texts, cached_audios) if cached_audio is None]
+        parameters = {
+            'speaker_id': speaker_id,
+            'sdp_ratio': sdp_ratio,
+            'noise_scale': noise_scale,
+            'noise_scale_w': noise_scale_w,
+            'speed': speed
+        }
+        synthesized_audios = self.worker_pool.synthesize_iter(missing_texts, parameters, is_cancelled)
+        synthesized_count = 0
+
+        try:
+            for i, audio in enumerate(cached_audios):
+                if audio is None:
+                    try:
+                        audio = next(synthesized_audios, None)
+                    except TTSWorkerPoolError as e:
+                        # The pool must not make the synthesis fail, the model of this process can do it
+                        self.log('Worker pool failed, synthesizing the remaining pieces in process:', e)
+                        metrics.increment('tts.worker_pool.fallbacks')
+                        synthesized_audios = self.iter_in_process(missing_texts[synthesized_count:], parameters,
+                                                                  is_cancelled)
+                        audio = next(synthesized_audios, None)
+                    synthesized_count += 1
+                    if audio is None:
+                        self.log('Generation cancelled')
+                        break
+                    if self.phrase_cache:
+                        self.phrase_cache.put(cache_keys[i], audio)
+
+                yield self.add_silence(audio, speed)
+        finally:
+            # Drain the pieces being synthesized when cancelled, or when the consumer stops early
+            synthesized_audios.close()
+
+    def iter_in_process(self, texts, parameters, is_cancelled):
+        """Fallback of the worker pool, one piece at a time"""
+        for text in texts:
+            if is_cancelled and is_cancelled():
+                return
+            yield self.infer_batch([text], **parameters)[0]
+
+    def iter_pipelined(self, texts, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed, pbar, position, quiet,
+                       stream, is_cancelled, batch_size, lookahead):
+        tic = time.perf_counter()
+        batches = list(self.get_batches(texts, batch_size, stream))
+        stage_durations = {'frontend': 0., 'inference': 0.}
+
+        def prepare(batch):
+            frontend_tic = time.perf_counter()
+            cached_audios = [None] * len(batch)
+            cache_keys = []
+            if self.phrase_cache:
+                cache_keys = [self.phrase_cache.get_key(t, speaker_id, speed, sdp_ratio, noise_scale, noise_scale_w)
+                              for t in batch]
+                cached_audios = [self.phrase_cache.get(cache_key) for cache_key in cache_keys]
+
+            # Only the pieces that are not cached are synthesized
+            missing_texts = [t for t, cached_audio in zip(batch, cached_audios) if cached_audio is None]
+            inputs = self.prepare_batch(missing_texts) if missing_texts else None
+
+            frontend_duration = time.perf_counter() - frontend_tic
+            stage_durations['frontend'] += frontend_duration
+            metrics.observe('tts.frontend', frontend_duration * 1000)
+
+            return cache_keys, cached_audios, inputs
+
+        prepared_batches = self.iter_prepared_batches(batches, prepare, lookahead, is_cancelled)
+
+        if pbar:
+            tx = pbar(prepared_batches)
+        else:
+            if position:
+                tx = tqdm(prepared_batches, total=len(batches), position=position)
+            elif quiet:
+                tx = prepared_batches
+            else:
+                tx = tqdm(prepared_batches, total=len(batches))
+        try:
+            for cache_keys, cached_audios, inputs in tx:
+                # Cooperative cancellation at batch boundaries (e.g. the owner interrupted Leon)
+                if is_cancelled and is_cancelled():
+                    self.log('Generation cancelled')
+                    break
+                inference_tic = time.perf_counter()
+                synthesized_audios = iter(
+                    self.infer_prepared(inputs, speaker_id, sdp_ratio, noise_scale, noise_scale_w, speed)
+                    if inputs else []
+                )
+                stage_durations['inference'] += time.perf_counter() - inference_tic
+                for i, audio in enumerate(cached_audios):
+                    if audio is None:
+                        audio = next(synthesized_audios)
+                        if self.phrase_cache:
+                            self.phrase_cache.put(cache_keys[i], audio)
+
+                    yield self.add_silence(audio, speed)
+        finally:
+            # Stop the frontend thread when cancelled, or when the consumer stops early
+            prepared_batches.close()
+
+        # The stages overlap when the frontend runs ahead
+        self.log(f"Frontend: {stage_durations['frontend']:0.4f} seconds, "
+                 f"inference: {stage_durations['inference']:0.4f} seconds, "
+                 f"overlap: {max(0., sum(stage_durations.values()) - (time.perf_counter() - tic)):0.4f} seconds")
+
+    def tts_to_file(self, text, speaker_id, output_path=None, sdp_ratio=0.2, noise_scale=0.6, noise_scale_w=0.8, speed=1.0, pbar=None, format=None, position=None, quiet=False, stream=False, is_cancelled=None, batch_size=1, lookahead=0):
         audio_list = []
         for audio in self.tts_iter(
             text=text,
@@ -180,10 +453,17 @@ class TTS(nn.Module):
             pbar=pbar,
             position=position,
             quiet=quiet,
-            stream=stream
+            stream=stream,
+            is_cancelled=is_cancelled,
+            batch_size=batch_size,
+            lookahead=lookahead
         ):
             audio_list.append(audio)
 
+        # Cancelled before the first sentence, or nothing to say (e.g. only emojis)
+        if not audio_list:
+            return None
+
         audio = np.concatenate(audio_list)
 
         if output_path is None:
@@ -194,6 +474,8 @@ class TTS(nn.Module):
             else:
                 soundfile.write(output_path, audio, self.hps.data.sampling_rate)
 
+            return output_path
+
     @staticmethod
     def log(*args, **kwargs):
         print('[TTS]', *args, **kwargs)
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+from typing import Any, Callable, Optional
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = {
+    'high': PRIORITY_HIGH,
+    'normal': PRIORITY_NORMAL,
+    'low': PRIORITY_LOW
+}
+
+
+class TTSJob:
+    """A synthesis unit of work.
+    The run function receives the is_cancelled callable and is expected to check it at sentence boundaries
+    so a cancelled job frees the CPU as soon as possible"""
+
+    def __init__(self, job_id: str, priority: int, run: Callable[[Callable[[], bool]], Any]):
+        self.job_id = job_id
+        self.priority = priority
+        self.run = run
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def is_done(self) -> bool:
+        return self.done_event.is_set()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        self.done_event.wait(timeout)
+
+        if self.error:
+            raise self.error
+
+        return self.result
+
+
+class TTSJobQueue:
+    """Run TTS jobs one at a time on a dedicated thread, highest priority first, then FIFO"""
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        # Unique for the lifetime of the process, unlike the audio IDs that can collide within a second
+        self.job_ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.jobs: dict[str, TTSJob] = {}
+        self.current_job: Optional[TTSJob] = None
+        self.worker_thread = None
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[TTS Jobs]', *args, **kwargs)
+
+    def generate_job_id(self) -> str:
+        """To know the job ID before submitting the job"""
+        return str(next(self.job_ids))
+
+    def submit(self, run: Callable[[Callable[[], bool]], Any], priority: int = PRIORITY_NORMAL,
+               job_id: Optional[str] = None) -> TTSJob:
+        """:param job_id: From generate_job_id(), a new one by default"""
+        job = TTSJob(job_id or self.generate_job_id(), priority, run)
+
+        with self.condition:
+            if not self.worker_thread:
+                self.worker_thread = threading.Thread(target=self.work, daemon=True)
+                self.worker_thread.start()
+
+            self.jobs[job.job_id] = job
+            heapq.heappush(self.heap, (priority, next(self.counter), job))
+            self.condition.notify()
+
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        with self.condition:
+            job = self.jobs.get(job_id)
+
+        if not job:
+            return False
+
+        job.cancel()
+        self.log(f'Job {job_id} cancelled')
+
+        return True
+
+    def cancel_all(self) -> list[str]:
+        """Cancel the running job and every pending job"""
+        with self.condition:
+            jobs = list(self.jobs.values())
+
+        for job in jobs:
+            job.cancel()
+
+        if jobs:
+            self.log(f'{len(jobs)} job(s) cancelled')
+
+        return [job.job_id for job in jobs]
+
+    def work(self) -> None:
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+
+                _, _, job = heapq.heappop(self.heap)
+                self.current_job = job
+
+            try:
+                # Cancelled while pending, no need to start it
+                if not job.is_cancelled:
+                    job.result = job.run(lambda: job.is_cancelled)
+            except Exception as e:
+                self.log(f'Job {job.job_id} failed:', e)
+                job.error = e
+            finally:
+                with self.condition:
+                    self.current_job = None
+                    self.jobs.pop(job.job_id, None)
+                job.done_event.set()
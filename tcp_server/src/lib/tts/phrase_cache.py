@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from ..metrics import metrics
+
+# Written in the disk tier directory, the cached audio of another checkpoint is deleted when it differs
+CHECKPOINT_FILE_NAME = 'checkpoint'
+EXTENSION = 'f32'
+
+
+def get_checkpoint_id(ckpt_path: str) -> str:
+    """Cheap fingerprint of the checkpoint file, hashing the whole file would slow down the startup"""
+    stat = os.stat(ckpt_path)
+
+    return f'{os.path.basename(ckpt_path)}-{stat.st_size}-{int(stat.st_mtime)}'
+
+
+class PhraseCache:
+    """Content-addressed cache of the synthesized audio per sentence piece, with a memory LRU tier
+    and a disk tier, both bounded in bytes (0 disables a tier).
+    The synthesis draws random noise, so a cached piece always sounds the same: opt-in with "tts.phrase_cache"
+    """
+
+    def __init__(self, checkpoint_id: str, memory_max_bytes: int, directory: str, disk_max_bytes: int):
+        self.checkpoint_id = checkpoint_id
+        self.memory_max_bytes = memory_max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.memory_bytes = 0
+        # Key -> size in bytes, least recently used first
+        self.disk_entries: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.disk_max_bytes > 0:
+            self.load_disk_index()
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[TTS Phrase Cache]', *args, **kwargs)
+
+    def get_key(self, text: str, speaker_id: int, speed: float, sdp_ratio: float, noise_scale: float,
+                noise_scale_w: float) -> str:
+        normalized_text = re.sub(r'\s+', ' ', text).strip()
+        # float() so e.g. a speed of 1 and 1.0 share the key
+        parameters = [self.checkpoint_id, normalized_text, int(speaker_id),
+                      *(float(parameter) for parameter in (speed, sdp_ratio, noise_scale, noise_scale_w))]
+
+        return hashlib.sha256(json.dumps(parameters, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.{EXTENSION}')
+
+    def load_disk_index(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE_NAME)
+
+        try:
+            with open(checkpoint_path, encoding='utf-8') as f:
+                cached_checkpoint_id = f.read().strip()
+        except OSError:
+            cached_checkpoint_id = None
+
+        files = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(f'.{EXTENSION}'):
+                path = os.path.join(self.directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, file_name[:-len(EXTENSION) - 1], stat.st_size, path))
+
+        if cached_checkpoint_id != self.checkpoint_id:
+            for _, _, _, path in files:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    self.log(f'Failed to delete {path}:', e)
+            if files:
+                self.log(f'Deleted {len(files)} audio file(s) synthesized by another checkpoint')
+
+            with open(checkpoint_path, 'w', encoding='utf-8') as f:
+                f.write(self.checkpoint_id)
+            return
+
+        # The modification time is updated on hit, so the oldest is the least recently used
+        for _, key, size, _ in sorted(files):
+            self.disk_entries[key] = size
+            self.disk_bytes += size
+
+        self.log(f'{len(self.disk_entries)} cached audio file(s) in {self.directory}')
+        self.enforce_disk_budget()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Cached audio is shared and must not be mutated"""
+        with self.lock:
+            audio = self.memory_entries.get(key)
+            if audio is not None:
+                self.memory_entries.move_to_end(key)
+                self.memory_hits += 1
+            is_on_disk = audio is None and key in self.disk_entries
+
+        if audio is not None:
+            metrics.increment('tts.phrase_cache.memory_hits')
+            return audio
+
+        if is_on_disk:
+            path = self.get_path(key)
+            try:
+                audio = np.fromfile(path, dtype=np.float32)
+                os.utime(path)
+            except OSError as e:
+                self.log(f'Failed to read {path}:', e)
+                with self.lock:
+                    size = self.disk_entries.pop(key, 0)
+                    self.disk_bytes -= size
+
+        if audio is not None:
+            with self.lock:
+                self.disk_hits += 1
+                if key in self.disk_entries:
+                    self.disk_entries.move_to_end(key)
+            metrics.increment('tts.phrase_cache.disk_hits')
+            self.put_in_memory(key, audio)
+
+            return audio
+
+        with self.lock:
+            self.misses += 1
+        metrics.increment('tts.phrase_cache.misses')
+
+        return None
+
+    def put(self, key: str, audio: np.ndarray) -> None:
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        self.put_in_memory(key, audio)
+
+        if self.disk_max_bytes <= 0 or audio.nbytes > self.disk_max_bytes:
+            return
+
+        path = self.get_path(key)
+        tmp_path = f'{path}.tmp'
+        try:
+            audio.tofile(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.log(f'Failed to write {path}:', e)
+            return
+
+        with self.lock:
+            self.disk_bytes += audio.nbytes - self.disk_entries.get(key, 0)
+            self.disk_entries[key] = audio.nbytes
+            self.disk_entries.move_to_end(key)
+
+        self.enforce_disk_budget()
+
+    def put_in_memory(self, key: str, audio: np.ndarray) -> None:
+        if audio.nbytes > self.memory_max_bytes:
+            return
+
+        with self.lock:
+            previous_audio = self.memory_entries.get(key)
+            if previous_audio is not None:
+                self.memory_bytes -= previous_audio.nbytes
+            self.memory_entries[key] = audio
+            self.memory_entries.move_to_end(key)
+            self.memory_bytes += audio.nbytes
+
+            while self.memory_bytes > self.memory_max_bytes:
+                _, evicted_audio = self.memory_entries.popitem(last=False)
+                self.memory_bytes -= evicted_audio.nbytes
+
+    def enforce_disk_budget(self) -> None:
+        evicted_keys = []
+
+        with self.lock:
+            while self.disk_bytes > self.disk_max_bytes and self.disk_entries:
+                key, size = self.disk_entries.popitem(last=False)
+                self.disk_bytes -= size
+                evicted_keys.append(key)
+
+        for key in evicted_keys:
+            try:
+                os.remove(self.get_path(key))
+            except OSError as e:
+                self.log(f'Failed to delete {key}:', e)
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'memoryEntries': len(self.memory_entries),
+                'memoryBytes': self.memory_bytes,
+                'diskEntries': len(self.disk_entries),
+                'diskBytes': self.disk_bytes,
+                'memoryHits': self.memory_hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses
+            }
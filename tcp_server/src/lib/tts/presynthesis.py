@@ -0,0 +1,129 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable
+
+from .jobs import TTSJobQueue, PRIORITY_LOW
+from ..metrics import metrics
+
+# E.g. "%skill_name%", filled by the skill at runtime
+PLACEHOLDER_PATTERN = re.compile(r'%[^%\s]+%')
+# The core replaces the HTML tags of the answers with a whitespace before sending the speech (see brain.ts)
+HTML_TAG_PATTERN = re.compile(r'<(?:.|\n)*?>')
+
+
+def get_answer_speeches(answers: Any) -> list[str]:
+    """Flatten the answers of a skill config or of the global answers file.
+    Answers can be strings, lists of answers, {text, speech} objects or nested groups"""
+    if isinstance(answers, str):
+        return [answers]
+
+    if isinstance(answers, list):
+        return [speech for answer in answers for speech in get_answer_speeches(answer)]
+
+    if isinstance(answers, dict):
+        if 'speech' in answers or 'text' in answers:
+            speech = answers.get('speech') or answers.get('text')
+            return [speech] if isinstance(speech, str) else []
+
+        return [speech for answer in answers.values() for speech in get_answer_speeches(answer)]
+
+    return []
+
+
+def find_static_texts(answers_paths: list[str], format_speech: Callable[[str], str],
+                      split_sentences: Callable[[str], list[str]]) -> list[str]:
+    """
+    The sentence pieces of the answers that are known before runtime:
+    every piece of an answer without placeholder, and the pieces of the other answers that have no placeholder.
+    split_sentences must split at the sentence level, otherwise a placeholder excludes the whole answer
+    """
+    texts = []
+    seen_texts = set()
+
+    for answers_path in answers_paths:
+        try:
+            with open(answers_path, encoding='utf-8') as f:
+                answers = json.load(f).get('answers', {})
+        except (OSError, ValueError) as e:
+            TTSPresynthesizer.log(f'Failed to read {answers_path}:', e)
+            continue
+
+        for speech in get_answer_speeches(answers):
+            formatted_speech = format_speech(HTML_TAG_PATTERN.sub(' ', speech))
+
+            for text in split_sentences(formatted_speech):
+                if text and text not in seen_texts and not PLACEHOLDER_PATTERN.search(text):
+                    seen_texts.add(text)
+                    texts.append(text)
+
+    return texts
+
+
+def get_answers_paths(skills_path: str, global_data_path: str, lang: str) -> list[str]:
+    return [
+        os.path.join(global_data_path, lang, 'answers.json'),
+        *sorted(glob.glob(os.path.join(skills_path, '*', '*', 'config', f'{lang}.json')))
+    ]
+
+
+class TTSPresynthesizer:
+    """Synthesize the static answers in the background so the phrase cache has them before they are spoken.
+    One low priority job at a time, so requests only wait for the current sentence piece at most"""
+
+    def __init__(self, texts: list[str], synthesize: Callable[[str, Callable[[], bool]], Any],
+                 tts_jobs: TTSJobQueue, delay: float):
+        self.texts = texts
+        self.synthesize = synthesize
+        self.tts_jobs = tts_jobs
+        self.delay = delay
+        self.synthesized_count = 0
+        self.is_running = False
+        self.thread = None
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[TTS Presynthesis]', *args, **kwargs)
+
+    def start(self) -> None:
+        if self.thread or not self.texts:
+            return
+
+        self.thread = threading.Thread(target=self.run, name='tts-presynthesis', daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        # Let the startup traffic go first
+        time.sleep(self.delay)
+
+        self.is_running = True
+        self.log(f'Synthesizing {len(self.texts)} static answer piece(s)...')
+        tic = time.perf_counter()
+
+        for text in self.texts:
+            job = self.tts_jobs.submit(lambda is_cancelled, text=text: self.synthesize(text, is_cancelled),
+                                       PRIORITY_LOW)
+            try:
+                job.wait()
+            except Exception as e:
+                self.log(f'Failed to synthesize "{text}":', e)
+                continue
+
+            # E.g. cancelled along with the other jobs when the owner starts speaking
+            if not job.is_cancelled:
+                self.synthesized_count += 1
+                metrics.increment('tts.presynthesis.pieces')
+
+        self.is_running = False
+        self.log(f'{self.synthesized_count}/{len(self.texts)} static answer piece(s) synthesized '
+                 f'in {time.perf_counter() - tic:0.4f} seconds')
+
+    def get_status(self) -> dict:
+        return {
+            'isRunning': self.is_running,
+            'piecesCount': len(self.texts),
+            'synthesizedCount': self.synthesized_count
+        }
@@ -1,19 +1,26 @@
 import re
 
-def split_sentence(text, min_len=10, language_str='EN'):
+def split_sentence(text, min_len=10, language_str='EN', is_sentence_level=False):
     if language_str in ['EN', 'FR', 'ES', 'SP']:
-        sentences = split_sentences_latin(text, min_len=min_len)
+        sentences = split_sentences_latin(text, min_len=min_len, is_sentence_level=is_sentence_level)
     else:
         sentences = split_sentences_zh(text, min_len=min_len)
     return sentences
 
 
-def split_sentences_latin(text, min_len=10):
+def split_sentences_latin(text, min_len=10, is_sentence_level=False):
+    """
+    :param is_sentence_level: One piece per sentence (sentences of one or two words are merged with the next one)
+    instead of chunks of 256 to 512 characters, e.g. so streaming starts after the first sentence
+    """
     text = re.sub('[。！？；]', '.', text)
     text = re.sub('[，]', ',', text)
     text = re.sub('[“”]', '"', text)
     text = re.sub('[‘’]', "'", text)
     text = re.sub(r"[\<\>\(\)\[\]\"\«\»]+", "", text)
+    if is_sentence_level:
+        # A desired length of 1 splits at every sentence boundary
+        return merge_short_sentences_en([item.strip() for item in txtsplit(text, 1, 512) if item.strip()])
     return [item.strip() for item in txtsplit(text, 256, 512) if item.strip()]
 
 
@@ -8,6 +8,7 @@ import torch
 from lib.tts.text import cleaned_text_to_sequence, get_bert
 from lib.tts.text.cleaner import clean_text
 from lib.tts import commons
+from lib.metrics import metrics
 
 MATPLOTLIB_FLAG = False
 
@@ -16,22 +17,24 @@ logger = logging.getLogger(__name__)
 
 
 def get_text_for_tts_infer(text, language_str, hps, device, symbol_to_id=None):
-    norm_text, phone, tone, word2ph = clean_text(text, language_str)
-    phone, tone, language = cleaned_text_to_sequence(phone, tone, language_str, symbol_to_id)
-
-    if hps.data.add_blank:
-        phone = commons.intersperse(phone, 0)
-        tone = commons.intersperse(tone, 0)
-        language = commons.intersperse(language, 0)
-        for i in range(len(word2ph)):
-            word2ph[i] = word2ph[i] * 2
-        word2ph[0] += 1
+    with metrics.timer('tts.text_frontend'):
+        norm_text, phone, tone, word2ph = clean_text(text, language_str)
+        phone, tone, language = cleaned_text_to_sequence(phone, tone, language_str, symbol_to_id)
+
+        if hps.data.add_blank:
+            phone = commons.intersperse(phone, 0)
+            tone = commons.intersperse(tone, 0)
+            language = commons.intersperse(language, 0)
+            for i in range(len(word2ph)):
+                word2ph[i] = word2ph[i] * 2
+            word2ph[0] += 1
 
     if getattr(hps.data, "disable_bert", False):
         bert = torch.zeros(1024, len(phone))
         ja_bert = torch.zeros(768, len(phone))
     else:
-        bert = get_bert(norm_text, word2ph, language_str, device)
+        with metrics.timer('tts.bert'):
+            bert = get_bert(norm_text, word2ph, language_str, device)
         del word2ph
         assert bert.shape[-1] == len(phone), phone
 
@@ -0,0 +1,261 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Callable, Iterator, Optional
+
+from ..metrics import metrics
+
+MESSAGE_READY = 'ready'
+MESSAGE_FAILED = 'failed'
+# A piece that fails this many times, e.g. on every worker, fails the synthesis
+MAX_PIECE_ATTEMPTS = 2
+
+
+class TTSWorkerPoolError(Exception):
+    pass
+
+
+def get_threads_per_worker(size: int, threads_per_worker: int) -> int:
+    """0 splits the cores evenly between the workers"""
+    if threads_per_worker:
+        return threads_per_worker
+
+    return max(1, (os.cpu_count() or 1) // max(1, size))
+
+
+def run_worker(connection, language: str, config_path: str, ckpt_path: str, threads: int) -> None:
+    """Entry point of a worker process: load the model with memory-mapped weights, then synthesize pieces one by one"""
+    try:
+        import torch
+        from .api import TTS
+
+        if threads:
+            torch.set_num_threads(threads)
+
+        tts = TTS(language=language, device='cpu', config_path=config_path, ckpt_path=ckpt_path, mmap_weights=True)
+    except Exception as e:
+        connection.send((MESSAGE_FAILED, str(e)))
+        return
+
+    connection.send((MESSAGE_READY, None))
+
+    while True:
+        try:
+            call_id, text, parameters = connection.recv()
+        except (EOFError, OSError):
+            # The TCP server is gone
+            break
+
+        try:
+            connection.send((call_id, True, tts.infer_batch([text], **parameters)[0]))
+        except Exception as e:
+            connection.send((call_id, False, f'{type(e).__name__}: {e}'))
+
+
+class TTSWorker:
+    def __init__(self, index: int, process, connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        # (call ID, piece index) of the piece being synthesized
+        self.current_call = None
+
+
+class TTSWorkerPool:
+    """Synthesize the sentence pieces of long texts in parallel, one piece per worker process at a time.
+    Each worker memory-maps the checkpoint, so the weights pages are shared through the page cache.
+    Pieces are yielded in order, each one as soon as it and all the previous ones are done"""
+
+    def __init__(self, size: int, threads_per_worker: int, min_pieces: int, language: str, config_path: str,
+                 ckpt_path: str, restart_delay: float = 1):
+        self.size = size
+        self.threads_per_worker = threads_per_worker
+        # Shorter texts are synthesized in the TCP server process, they do not make up for the IPC
+        self.min_pieces = min_pieces
+        self.language = language
+        self.config_path = config_path
+        self.ckpt_path = ckpt_path
+        self.restart_delay = restart_delay
+        # Spawn rather than fork, the TCP server has threads and PyTorch state that must not be inherited
+        self.context = multiprocessing.get_context('spawn')
+        self.workers: list[Optional[TTSWorker]] = [None] * size
+        self.call_ids = itertools.count(1)
+        # One synthesis at a time, the TTS job queue already runs the jobs one by one
+        self.lock = threading.Lock()
+        self.is_closed = False
+
+    @staticmethod
+    def log(*args, **kwargs):
+        print('[TTS Worker Pool]', *args, **kwargs)
+
+    def start(self) -> 'TTSWorkerPool':
+        """Start the worker processes and block until their models are loaded"""
+        tic = time.perf_counter()
+        processes = [self.spawn_worker_process() for _ in range(self.size)]
+
+        for index, (process, connection) in enumerate(processes):
+            self.workers[index] = self.wait_for_worker(index, process, connection)
+
+        self.log(f'{self.size} worker(s) started with {self.threads_per_worker or "default"} thread(s) each '
+                 f'in {time.perf_counter() - tic:0.4f} seconds')
+
+        return self
+
+    def spawn_worker_process(self):
+        connection, child_connection = self.context.Pipe()
+        process = self.context.Process(target=run_worker,
+                                       args=(child_connection, self.language, self.config_path, self.ckpt_path,
+                                             self.threads_per_worker),
+                                       name='leon-tts-worker', daemon=True)
+        process.start()
+        child_connection.close()
+
+        return process, connection
+
+    def wait_for_worker(self, index: int, process, connection) -> TTSWorker:
+        while not connection.poll(0.5):
+            if not process.is_alive():
+                raise TTSWorkerPoolError(f'TTS worker exited with code {process.exitcode} while loading')
+
+        message_type, value = connection.recv()
+        if message_type == MESSAGE_FAILED:
+            process.join()
+            raise TTSWorkerPoolError(f'TTS worker failed to load: {value}')
+
+        return TTSWorker(index, process, connection)
+
+    def restart_worker(self, index: int) -> None:
+        """Restart a crashed worker in the background, the pool runs with one worker less meanwhile"""
+        def run():
+            while not self.is_closed:
+                time.sleep(self.restart_delay)
+
+                try:
+                    self.workers[index] = self.wait_for_worker(index, *self.spawn_worker_process())
+                except Exception as e:
+                    self.log('Failed to restart a worker:', e)
+                    continue
+
+                metrics.increment('tts.worker_pool.restarts')
+                self.log(f'Worker {index} restarted')
+                break
+
+        threading.Thread(target=run, name='tts-worker-restart', daemon=True).start()
+
+    def synthesize_iter(self, texts: list[str], parameters: dict,
+                        is_cancelled: Optional[Callable[[], bool]] = None) -> Iterator:
+        """
+        A piece whose worker crashed or failed is retried on another worker, up to MAX_PIECE_ATTEMPTS times
+        :param parameters: Keyword arguments of TTS.infer_batch() except the texts
+        :return: The waveform of each piece, in order. Stops early when cancelled
+        """
+        with self.lock:
+            workers = [worker for worker in self.workers if worker]
+            if not workers:
+                raise TTSWorkerPoolError('No TTS worker is running')
+
+            pending_indexes = deque(range(len(texts)))
+            attempts = {}
+            next_yield_index = 0
+            results = {}
+            busy_workers = {}
+
+            def remove_worker(worker: TTSWorker) -> str:
+                worker.process.join(timeout=1)
+                error = f'TTS worker {worker.index} exited with code {worker.process.exitcode}'
+                self.log(f'{error}, restarting it...')
+                workers.remove(worker)
+                self.workers[worker.index] = None
+                self.restart_worker(worker.index)
+
+                return error
+
+            def retry_piece(piece_index: int, error: str) -> None:
+                attempts[piece_index] = attempts.get(piece_index, 1) + 1
+                if attempts[piece_index] > MAX_PIECE_ATTEMPTS:
+                    raise TTSWorkerPoolError(error)
+
+                metrics.increment('tts.worker_pool.retries')
+                # First, the next piece to yield may be this one
+                pending_indexes.appendleft(piece_index)
+
+            try:
+                while next_yield_index < len(texts):
+                    is_stopping = is_cancelled and is_cancelled()
+
+                    # Keep every idle worker busy with the next pieces
+                    for worker in list(workers):
+                        if is_stopping or not pending_indexes:
+                            break
+                        if worker.current_call:
+                            continue
+
+                        piece_index = pending_indexes.popleft()
+                        call_id = next(self.call_ids)
+                        try:
+                            worker.connection.send((call_id, texts[piece_index], parameters))
+                        except OSError:
+                            # Crashed while idle, the piece was never sent
+                            pending_indexes.appendleft(piece_index)
+                            remove_worker(worker)
+                            continue
+
+                        worker.current_call = (call_id, piece_index)
+                        busy_workers[worker.connection] = worker
+
+                    if is_stopping:
+                        break
+                    if not busy_workers:
+                        raise TTSWorkerPoolError('No TTS worker is running')
+
+                    for connection in wait(list(busy_workers)):
+                        worker = busy_workers.pop(connection)
+                        _, piece_index = worker.current_call
+                        worker.current_call = None
+
+                        try:
+                            _, is_success, result = connection.recv()
+                        except (EOFError, OSError):
+                            retry_piece(piece_index, remove_worker(worker))
+                            continue
+
+                        if not is_success:
+                            self.log(f'Failed to synthesize piece {piece_index}:', result)
+                            retry_piece(piece_index, result)
+                            continue
+
+                        results[piece_index] = result
+
+                    # In order, as soon as the previous pieces are done
+                    while next_yield_index in results:
+                        if is_cancelled and is_cancelled():
+                            return
+                        yield results.pop(next_yield_index)
+                        next_yield_index += 1
+            finally:
+                # Drain the pieces still being synthesized, e.g. when cancelled, so the next call starts clean
+                for connection, worker in busy_workers.items():
+                    try:
+                        connection.recv()
+                    except (EOFError, OSError):
+                        pass
+                    worker.current_call = None
+
+    def get_status(self) -> dict:
+        return {
+            'size': self.size,
+            'runningCount': sum(1 for worker in self.workers if worker),
+            'threadsPerWorker': self.threads_per_worker,
+            'minPieces': self.min_pieces
+        }
+
+    def close(self) -> None:
+        self.is_closed = True
+
+        for worker in self.workers:
+            if worker:
+                worker.process.terminate()
@@ -1,7 +1,7 @@
+import os
 import time
 import sys
-import json
-from .constants import SETTINGS_PATH
+from .settings import settings
 
 
 class ThrottledCallback:
@@ -29,8 +29,22 @@ def is_linux():
     return sys.platform == 'linux'
 
 
-def get_settings(key):
-    with open(SETTINGS_PATH) as f:
-        settings = json.load(f)
+def get_rss_bytes():
+    """Current resident set size of the process, or the peak one when the current one is not available.
+    0 when neither is available, e.g. on Windows"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        try:
+            import resource
+        except ImportError:
+            return 0
+
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes on Linux
+        return max_rss if is_macos() else max_rss * 1024
 
-    return settings[key]
+
+def get_settings(key):
+    return settings.get(key)
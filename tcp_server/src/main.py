@@ -1,5 +1,7 @@
+import multiprocessing
 import os
 import threading
+import time
 from os.path import join
 from dotenv import load_dotenv
 
@@ -10,21 +12,45 @@ and when we run it from the binary
 dotenv_path = join(os.getcwd(), '.env')
 load_dotenv(dotenv_path)
 
-import lib.nlp as nlp
+from lib.constants import IS_STARTUP_PROFILE_ENABLED
+from lib.startup_profiler import startup_profiler
+
+# Only when the server starts, worker processes re-import this module
+if IS_STARTUP_PROFILE_ENABLED and __name__ == '__main__':
+    startup_profiler.enable()
+
+imports_started_at = time.perf_counter()
+
+from lib.settings import settings
 from lib.tcp_server import TCPServer
 
-nlp.load_spacy_model()
+startup_profiler.add_phase('imports', imports_started_at, time.perf_counter())
 
 tcp_server_host = os.environ.get('LEON_PY_TCP_SERVER_HOST', '0.0.0.0')
 tcp_server_port = os.environ.get('LEON_PY_TCP_SERVER_PORT', 1342)
 
-tcp_server = TCPServer(tcp_server_host, tcp_server_port)
+# Guarded because worker processes (see lib/nlp_worker.py) import this module again
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    with startup_profiler.phase('server_init'):
+        tcp_server = TCPServer(tcp_server_host, tcp_server_port)
+
+    # Models load in the background so the server accepts connections right away
+    model_loader_threads = tcp_server.load_models()
+
+    if IS_STARTUP_PROFILE_ENABLED:
+        def report_startup_profile():
+            tic = time.perf_counter()
+            for thread in model_loader_threads:
+                thread.join()
+            startup_profiler.add_phase('models', tic, time.perf_counter())
+            startup_profiler.disable()
+            startup_profiler.print_report(tcp_server.model_loader.get_status())
 
-# Use thread as ASR starts recording audio and it blocks the main thread
-asr_thread = threading.Thread(target=tcp_server.init_asr)
-asr_thread.start()
+        threading.Thread(target=report_startup_profile, name='startup-profiler', daemon=True).start()
 
-tcp_server.init_tts()
+    # Apply settings.json changes without restarting
+    settings.watch()
 
-tcp_server_thread = threading.Thread(target=tcp_server.init)
-tcp_server_thread.start()
+    tcp_server.init()
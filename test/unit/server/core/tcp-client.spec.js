@@ -0,0 +1,84 @@
+import TCPClient from '@/core/tcp-client'
+
+const FRAME_HEADER_SIZE = 9
+const MESSAGE_TYPE_JSON = 1
+
+/**
+ * Frame a JSON message like the TCP server does
+ * (see tcp_server/src/lib/protocol.py)
+ */
+function encodeJSONFrame(data, requestId) {
+  const payload = Buffer.from(JSON.stringify(data), 'utf8')
+  const header = Buffer.alloc(FRAME_HEADER_SIZE)
+
+  header.writeUInt32BE(payload.length, 0)
+  header.writeUInt32BE(requestId, 4)
+  header.writeUInt8(MESSAGE_TYPE_JSON, 8)
+
+  return Buffer.concat([header, payload])
+}
+
+describe('TCP client', () => {
+  describe('request()', () => {
+    test('settles on the final reply, not on the progress messages', async () => {
+      const tcpClient = new TCPClient('Python', 'localhost', 0)
+      const writeSpy = jest
+        .spyOn(tcpClient.tcpSocket, 'write')
+        .mockImplementation(() => true)
+      const queuedListener = jest.fn()
+
+      tcpClient.ee.on('tts-job-queued', queuedListener)
+
+      const reply = tcpClient.request('tts-synthesize', 'Hello')
+      const requestId = writeSpy.mock.calls[0][0].readUInt32BE(4)
+
+      tcpClient.tcpSocket.emit(
+        'data',
+        Buffer.concat([
+          encodeJSONFrame(
+            { topic: 'tts-job-queued', data: { jobId: '1' } },
+            requestId
+          ),
+          encodeJSONFrame(
+            {
+              topic: 'tts-audio-streaming',
+              data: { outputPath: '/tmp/1.wav', audioId: '1' }
+            },
+            requestId
+          )
+        ])
+      )
+
+      expect(queuedListener).toHaveBeenCalledWith({ jobId: '1' })
+      await expect(reply).resolves.toEqual({
+        outputPath: '/tmp/1.wav',
+        audioId: '1'
+      })
+    })
+
+    test('rejects on an error reply', async () => {
+      const tcpClient = new TCPClient('Python', 'localhost', 0)
+      const writeSpy = jest
+        .spyOn(tcpClient.tcpSocket, 'write')
+        .mockImplementation(() => true)
+
+      const reply = tcpClient.request('tts-synthesize', '')
+      const requestId = writeSpy.mock.calls[0][0].readUInt32BE(4)
+
+      tcpClient.tcpSocket.emit(
+        'data',
+        encodeJSONFrame(
+          {
+            topic: 'tcp-server-error',
+            data: { topic: 'tts-synthesize', message: 'Nothing to synthesize' }
+          },
+          requestId
+        )
+      )
+
+      await expect(reply).rejects.toThrow(
+        'tts-synthesize: Nothing to synthesize'
+      )
+    })
+  })
+})